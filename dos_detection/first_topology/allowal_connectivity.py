@@ -1,18 +1,107 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
 from ryu.lib.packet import ether_types
-from ryu.lib.packet import udp
-from ryu.lib.packet import tcp
-from ryu.lib.packet import icmp
-import subprocess
+from ryu.lib import hub
+from ryu.lib import addrconv
+import itertools
 import time
-import threading
+import json
+import os
+import socket
+import struct
+from stat import S_ISDIR
+
+# Flow and port counters are polled every STATS_INTERVAL seconds and the
+# feature vectors are written to STATS_FILE (see cap_scripts/flow_stats.py).
+STATS_INTERVAL = 5
+STATS_FILE = "/tmp/flow_stats.json"
+
+# Mitigation requests from the detector (cap_scripts/mitigation.py) arrive on
+# a Unix socket, which the cap host can reach from its network namespace.
+# The socket (mode 0600) lives in a directory only the controller user can
+# enter (mode 0700), so only that user and root can request a block.
+# They are handled in batches every MITIGATION_INTERVAL seconds: the source is
+# dropped for BLOCK_TIMEOUT seconds on its ingress switch, above the flows
+# added by total_connectivity.sh (default priority 32768). At most
+# MAX_PENDING_BLOCKS sources wait for a batch, the others are dropped.
+MITIGATION_DIR = "/tmp/dos_mitigation"
+MITIGATION_SOCKET = os.path.join(MITIGATION_DIR, "mitigation.sock")
+MITIGATION_INTERVAL = 0.2
+MAX_PENDING_BLOCKS = 1024
+BLOCK_TIMEOUT = 60
+DROP_PRIORITY = 65000
+
+# The forwarding entries of mac_to_port are pushed to every switch when it
+# connects, so packet-in is only used for the destinations missing from the
+# table. They go in one atomic bundle (ONF bundle extension of OpenFlow 1.3)
+# when USE_BUNDLES is set, and as plain flow mods if the switch rejects it.
+# FORWARD_PRIORITY is the priority of the original packet-in flows. It is
+# below the in_port flows of total_connectivity.sh (default priority 32768),
+# which main.py installs, so in that setup every packet matches those flows
+# and the mac_to_port entries only serve the switches without them.
+USE_BUNDLES = True
+FORWARD_PRIORITY = 1
+
+# Packet-in storm protection. The table-miss entry goes through an OpenFlow
+# meter that drops what exceeds PACKET_IN_RATE packets per second on the way
+# to the controller, and the controller handles at most PACKET_IN_RATE
+# packet-ins per second per switch (token bucket of PACKET_IN_BURST), so a
+# flood of misses cannot starve the statistics and mitigation threads.
+# Repeated misses for a destination whose flow was installed less than
+# COALESCE_INTERVAL seconds ago are forwarded without installing it again.
+PACKET_IN_METER_ID = 1
+PACKET_IN_RATE = 100
+PACKET_IN_BURST = 50
+COALESCE_INTERVAL = 1.0
+PACKET_IN_COUNTERS = ("received", "handled", "rate_limited", "coalesced", "unknown_destination", "ignored")
+
+# Switch each host is attached to (see main.py). Unknown sources are dropped on every switch.
+INGRESS_SWITCH = {
+    "10.0.0.1": 3, "10.0.0.2": 3, "10.0.0.3": 3,
+    "10.0.0.5": 1, "10.0.0.6": 2, "10.0.0.7": 1,
+    "10.0.0.8": 1, "10.0.0.10": 4,
+}
  
+def normalize_mac(mac):
+    """
+    Returns mac as six two-digit lowercase hex octets (as reported by the
+    packet parser), or None if it is not a valid MAC address.
+    """
+    octets = mac.split(":")
+    if len(octets) != 6 or not all(1 <= len(octet) <= 2 for octet in octets):
+        return None
+    try:
+        return ":".join(f"{int(octet, 16):02x}" for octet in octets)
+    except ValueError:
+        return None
+
+def host_mac(ip):
+    # Mininet MAC of a host, written with its host number as in mac_to_port.
+    return normalize_mac("00:00:00:00:00:" + ip.split(".")[-1])
+
+class TokenBucket:
+    """
+    Allows rate events per second on average, with bursts of at most burst events.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
 class TrafficSlicing(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
@@ -22,16 +111,37 @@ class TrafficSlicing(app_manager.RyuApp):
         # Destination Mapping [router --> MAC Destination --> Eth Port Output]
         self.mac_to_port = {
             1: {"00:00:00:00:00:01": 1, "00:00:00:00:00:02": 1, "00:00:00:00:00:03": 1,  "00:00:00:00:00:05": 3, 
-                "00:00:00:00:00:06": 1,"00:00:00:00:00:07": 2, "00:00:00:00:00:8": 4,"00:00:00:00:00:10": 1},
-            2: {"00:00:00:00:00:01": 1, "00:00:00:00:02": 1, "00:00:00:00:00:03": 1, "00:00:00:00:00:05": 1, "00:00:00:00:00:06": 3,
-                 "00:00:00:00:00:07": 1,"00:00:00:00:00:8": 1, "00:00:00:00:00:10": 2},
+                "00:00:00:00:00:06": 1,"00:00:00:00:00:07": 2, "00:00:00:00:00:08": 4,"00:00:00:00:00:10": 1},
+            2: {"00:00:00:00:00:01": 1, "00:00:00:00:00:02": 1, "00:00:00:00:00:03": 1, "00:00:00:00:00:05": 1, "00:00:00:00:00:06": 3,
+                 "00:00:00:00:00:07": 1,"00:00:00:00:00:08": 1, "00:00:00:00:00:10": 2},
             3: {"00:00:00:00:00:01": 3, "00:00:00:00:00:02": 4, "00:00:00:00:00:03": 5, "00:00:00:00:00:05": 1, "00:00:00:00:00:06": 2,
-                 "00:00:00:00:00:07": 1, "00:00:00:00:00:8": 1,"00:00:00:00:00:10": 2},
+                 "00:00:00:00:00:07": 1, "00:00:00:00:00:08": 1,"00:00:00:00:00:10": 2},
             4: {"00:00:00:00:00:01": 1, "00:00:00:00:00:02": 1, "00:00:00:00:00:03": 1, "00:00:00:00:00:05": 1, "00:00:00:00:00:06": 1, 
-                "00:00:00:00:00:07": 1,"00:00:00:00:00:8": 1, "00:00:00:00:00:10": 2},
+                "00:00:00:00:00:07": 1,"00:00:00:00:00:08": 1, "00:00:00:00:00:10": 2},
         }
-        
-        
+        self.mac_to_port = self._normalize_mac_table(self.mac_to_port)
+
+        # Host attached to each access port (ip of INGRESS_SWITCH whose MAC is
+        # behind the port): the rx counters of the port are what it sends.
+        self.port_hosts = {}
+        for ip, dpid in INGRESS_SWITCH.items():
+            port = self.mac_to_port.get(dpid, {}).get(host_mac(ip))
+            if port is not None:
+                self.port_hosts[(dpid, port)] = ip
+
+        # Forwarding bundles sent and not yet acknowledged: dpid -> (xids, flow mods).
+        self.pending_bundles = {}
+        self.bundle_ids = itertools.count(1)
+
+        # Packet-in meters not yet acknowledged: dpid -> xids of the meter and table-miss mods.
+        self.pending_meters = {}
+
+        # Packet-in protection: token bucket and counters per switch, and
+        # (dpid, destination) -> time its flow was last installed from a packet-in.
+        self.packet_in_buckets = {}
+        self.packet_in_counters = {}
+        self.packet_in_logged = {}
+        self.installed_at = {}
 
         # Source Mapping        
         self.port_to_port = {
@@ -40,6 +150,25 @@ class TrafficSlicing(app_manager.RyuApp):
             3: {1:2, 2:1, 1:3, 3:1, 1:4,4:1,1:5,5:1,2:3,3:2,2:4,4:2,2:5,5:2,3:4,4:3,3:5,5:3,4:5,5:4},
             4: {1:2,2:1},
         }
+
+        # Statistics collection: connected switches, replies being received
+        # (multipart replies can be split in several messages), latest vectors
+        # per switch and counters of the previous poll, for the interval rates.
+        self.datapaths = {}
+        self.flow_replies = {}
+        self.port_replies = {}
+        self.flow_stats = {}
+        self.port_stats = {}
+        self.prev_counters = {}
+        self.monitor_thread = hub.spawn(self._monitor)
+
+        # Mitigation: requested source -> earliest detection time, and
+        # blocked source -> expiry of its drop flow.
+        self.pending_blocks = {}
+        self.dropped_blocks = 0
+        self.blocked = {}
+        self.mitigation_thread = hub.spawn(self._mitigation_server)
+        self.block_thread = hub.spawn(self._block_loop)
       
         
 
@@ -47,26 +176,134 @@ class TrafficSlicing(app_manager.RyuApp):
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
+
+        # install the table-miss flow entry, behind the packet-in meter.
+        self._install_table_miss(datapath)
+
+        # install the static forwarding entries before the first packet.
+        self._install_forwarding(datapath)
+
+    def _install_table_miss(self, datapath, metered=True):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
-
-        # install the table-miss flow entry.
         match = parser.OFPMatch()
         actions = [
             parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)
         ]
-        self.add_flow(datapath, 0, match, actions)
+        if not metered:
+            self.add_flow(datapath, 0, match, actions)
+            return
+        band = parser.OFPMeterBandDrop(rate=PACKET_IN_RATE, burst_size=PACKET_IN_BURST)
+        meter = parser.OFPMeterMod(datapath, command=ofproto.OFPMC_ADD,
+                                   flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+                                   meter_id=PACKET_IN_METER_ID, bands=[band])
+        inst = [parser.OFPInstructionMeter(PACKET_IN_METER_ID),
+                parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath, priority=0, match=match, instructions=inst)
+        for msg in (meter, mod):
+            datapath.set_xid(msg)
+        # switches without meters reject both, the entry is then sent without it.
+        self.pending_meters[datapath.id] = {meter.xid, mod.xid}
+        datapath.send_msg(meter)
+        datapath.send_msg(mod)
+
+    def _normalize_mac_table(self, table):
+        # MAC addresses are matched in canonical form; invalid ones are skipped.
+        normalized = {}
+        for dpid, ports in table.items():
+            normalized[dpid] = {}
+            for mac, port in ports.items():
+                canonical = normalize_mac(mac)
+                if canonical is None:
+                    self.logger.error("Invalid MAC address %r for switch %s, entry skipped", mac, dpid)
+                    continue
+                normalized[dpid][canonical] = port
+        return normalized
 
-    def add_flow(self, datapath, priority, match, actions):
+    def flow_mod(self, datapath, priority, match, actions, hard_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        # construct flow_mod message and send it.
+        # construct flow_mod message.
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
-        mod = parser.OFPFlowMod(
-            datapath=datapath, priority=priority, match=match, instructions=inst
+        return parser.OFPFlowMod(
+            datapath=datapath, priority=priority, match=match, instructions=inst,
+            hard_timeout=hard_timeout
         )
-        datapath.send_msg(mod)
+
+    def add_flow(self, datapath, priority, match, actions, hard_timeout=0):
+        datapath.send_msg(self.flow_mod(datapath, priority, match, actions, hard_timeout))
+
+    def _forwarding_mods(self, datapath):
+        parser = datapath.ofproto_parser
+        return [self.flow_mod(datapath, FORWARD_PRIORITY, parser.OFPMatch(eth_dst=mac),
+                              [parser.OFPActionOutput(port)])
+                for mac, port in self.mac_to_port.get(datapath.id, {}).items()]
+
+    def _install_forwarding(self, datapath):
+        mods = self._forwarding_mods(datapath)
+        if not mods:
+            return
+        if USE_BUNDLES and hasattr(datapath.ofproto_parser, "ONFBundleCtrlMsg"):
+            self._send_bundle(datapath, mods)
+        else:
+            self._send_flow_mods(datapath, mods)
+
+    def _send_bundle(self, datapath, mods):
+        # open, add every flow mod, commit: the switch applies all of them or none.
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        bundle_id = next(self.bundle_ids)
+        flags = ofproto.ONF_BF_ATOMIC
+        msgs = [parser.ONFBundleCtrlMsg(datapath, bundle_id, ofproto.ONF_BCT_OPEN_REQUEST, flags, [])]
+        msgs += [parser.ONFBundleAddMsg(datapath, bundle_id, flags, mod, []) for mod in mods]
+        msgs.append(parser.ONFBundleCtrlMsg(datapath, bundle_id, ofproto.ONF_BCT_COMMIT_REQUEST, flags, []))
+        for msg in msgs:
+            datapath.set_xid(msg)
+        self.pending_bundles[datapath.id] = ({msg.xid for msg in msgs}, mods)
+        for msg in msgs:
+            datapath.send_msg(msg)
+        # errors of the bundle come before the reply to the barrier.
+        datapath.send_msg(parser.OFPBarrierRequest(datapath))
+
+    def _send_flow_mods(self, datapath, mods):
+        for mod in mods:
+            datapath.send_msg(mod)
+        datapath.send_msg(datapath.ofproto_parser.OFPBarrierRequest(datapath))
+        self.logger.info("Installed %d forwarding flows on switch %s", len(mods), datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _barrier_reply_handler(self, ev):
+        datapath = ev.msg.datapath
+        self.pending_meters.pop(datapath.id, None)
+        pending = self.pending_bundles.pop(datapath.id, None)
+        if pending is not None:
+            self.logger.info("Installed %d forwarding flows on switch %s in one bundle", len(pending[1]), datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _error_msg_handler(self, ev):
+        msg = ev.msg
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        meter_xids = self.pending_meters.get(datapath.id)
+        if meter_xids is not None and msg.xid in meter_xids:
+            if msg.type == ofproto.OFPET_METER_MOD_FAILED and msg.code == ofproto.OFPMMFC_METER_EXISTS:
+                # reconnection: the meter of the previous connection is still there.
+                return
+            del self.pending_meters[datapath.id]
+            self.logger.info("Switch %s rejected the packet-in meter (error type %d, code %d), "
+                             "packet-ins are only limited by the controller", datapath.id, msg.type, msg.code)
+            self._install_table_miss(datapath, metered=False)
+            return
+        pending = self.pending_bundles.get(datapath.id)
+        if pending is not None and msg.xid in pending[0]:
+            # bundles not supported: nothing was applied, the flows are sent one by one.
+            del self.pending_bundles[datapath.id]
+            self.logger.info("Switch %s rejected the forwarding bundle (error type %d, code %d)",
+                             datapath.id, msg.type, msg.code)
+            self._send_flow_mods(datapath, pending[1])
+            return
+        self.logger.error("OpenFlow error from switch %s: type %d, code %d", datapath.id, msg.type, msg.code)
 
     def _send_package(self, msg, datapath, in_port, actions):
         data = None
@@ -88,27 +325,244 @@ class TrafficSlicing(app_manager.RyuApp):
     def _packet_in_handler(self, ev):
         msg = ev.msg
         datapath = msg.datapath
-        ofproto = datapath.ofproto
-        in_port = msg.match["in_port"]
+        dpid = datapath.id
+
+        counters = self.packet_in_counters.get(dpid)
+        if counters is None:
+            counters = self.packet_in_counters[dpid] = dict.fromkeys(PACKET_IN_COUNTERS, 0)
+            self.packet_in_buckets[dpid] = TokenBucket(PACKET_IN_RATE, PACKET_IN_BURST)
+        counters["received"] += 1
+        if not self.packet_in_buckets[dpid].take():
+            counters["rate_limited"] += 1
+            return
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        # only the Ethernet header is needed, the packet is not parsed.
+        data = msg.data
+        if len(data) < 14:
+            counters["ignored"] += 1
+            return
+        (ethertype,) = struct.unpack_from("!H", data, 12)
+        if ethertype == ether_types.ETH_TYPE_LLDP:
             # ignore lldp packet
+            counters["ignored"] += 1
             return
-        
-        dst = eth.dst
-        src = eth.src
-        
-        dpid = datapath.id
-        
-        if dpid in self.mac_to_port:
-            
-                
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
-                actions = [datapath.ofproto_parser.OFPActionOutput(out_port)]
-                match = datapath.ofproto_parser.OFPMatch(eth_dst=dst)
-                self.add_flow(datapath, 1, match, actions)
-                self._send_package(msg, datapath, in_port, actions)
-        
\ No newline at end of file
+
+        dst = addrconv.mac.bin_to_text(data[:6])
+        out_port = self.mac_to_port.get(dpid, {}).get(dst)
+        if out_port is None:
+            counters["unknown_destination"] += 1
+            return
+
+        # the entry is normally installed at connect time, this only
+        # happens when a packet races with the installation.
+        in_port = msg.match["in_port"]
+        actions = [datapath.ofproto_parser.OFPActionOutput(out_port)]
+        now = time.monotonic()
+        if now - self.installed_at.get((dpid, dst), -COALESCE_INTERVAL) < COALESCE_INTERVAL:
+            # the flow is already on its way to the switch.
+            counters["coalesced"] += 1
+        else:
+            self.installed_at[(dpid, dst)] = now
+            match = datapath.ofproto_parser.OFPMatch(eth_dst=dst)
+            self.add_flow(datapath, FORWARD_PRIORITY, match, actions)
+        self._send_package(msg, datapath, in_port, actions)
+        counters["handled"] += 1
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        datapath = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            self.flow_stats.pop(datapath.id, None)
+            self.port_stats.pop(datapath.id, None)
+
+    def _monitor(self):
+        # Polls all the switches, then publishes the vectors of the previous round.
+        while True:
+            for datapath in list(self.datapaths.values()):
+                self._request_stats(datapath)
+            hub.sleep(STATS_INTERVAL)
+            self._write_stats()
+            self._log_packet_in()
+
+    def _request_stats(self, datapath):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        datapath.send_msg(parser.OFPFlowStatsRequest(datapath))
+        datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY))
+
+    def _interval_rates(self, key, now, packets, bytes_):
+        # Packets and bytes per second since the previous poll of the same counter.
+        prev = self.prev_counters.get(key)
+        self.prev_counters[key] = (now, packets, bytes_)
+        if prev is None or now <= prev[0] or packets < prev[1]:
+            return None, None
+        elapsed = now - prev[0]
+        return (packets - prev[1]) / elapsed, (bytes_ - prev[2]) / elapsed
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        self.flow_replies.setdefault(dpid, []).extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+
+        now = time.time()
+        vectors = []
+        for stat in self.flow_replies.pop(dpid):
+            if stat.priority == 0:
+                # table-miss entry
+                continue
+            match = dict(stat.match.items())
+            dur = stat.duration_sec + stat.duration_nsec / 1e9
+            key = ("flow", dpid, stat.priority, json.dumps(match, sort_keys=True))
+            pps_interval, rate_interval = self._interval_rates(key, now, stat.packet_count, stat.byte_count)
+            # Same names as the packet features of process_pcap.py where they apply.
+            vectors.append({
+                "dpid": dpid,
+                "priority": stat.priority,
+                "match": match,
+                "dur": dur,
+                "spkts": stat.packet_count,
+                "sbytes": stat.byte_count,
+                "rate": stat.byte_count / dur if dur > 0 else None,
+                "pps": stat.packet_count / dur if dur > 0 else None,
+                "bpp": stat.byte_count / stat.packet_count if stat.packet_count else None,
+                "pps_interval": pps_interval,
+                "rate_interval": rate_interval,
+            })
+        self.flow_stats[dpid] = vectors
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        self.port_replies.setdefault(dpid, []).extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+
+        now = time.time()
+        vectors = []
+        for stat in self.port_replies.pop(dpid):
+            if stat.port_no > msg.datapath.ofproto.OFPP_MAX:
+                # local port
+                continue
+            key = ("port", dpid, stat.port_no)
+            rx_pps, rx_rate = self._interval_rates(key, now, stat.rx_packets, stat.rx_bytes)
+            vectors.append({
+                "dpid": dpid,
+                "port_no": stat.port_no,
+                "rx_packets": stat.rx_packets,
+                "rx_bytes": stat.rx_bytes,
+                "tx_packets": stat.tx_packets,
+                "tx_bytes": stat.tx_bytes,
+                "rx_dropped": stat.rx_dropped,
+                "rx_errors": stat.rx_errors,
+                "rx_pps": rx_pps,
+                "rx_rate": rx_rate,
+                "source_ip": self.port_hosts.get((dpid, stat.port_no)),
+            })
+        self.port_stats[dpid] = vectors
+
+    def _write_stats(self):
+        snapshot = {
+            "timestamp": time.time(),
+            "interval": STATS_INTERVAL,
+            "flows": [v for dpid in sorted(self.flow_stats) for v in self.flow_stats[dpid]],
+            "ports": [v for dpid in sorted(self.port_stats) for v in self.port_stats[dpid]],
+            "packet_in": [{"dpid": dpid, **self.packet_in_counters[dpid]} for dpid in sorted(self.packet_in_counters)],
+        }
+        try:
+            # Written under a temporary name so readers never see a partial file.
+            with open(STATS_FILE + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(STATS_FILE + ".tmp", STATS_FILE)
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error("Could not write %s: %s", STATS_FILE, e)
+
+    def _log_packet_in(self):
+        # Packet-ins dropped by the rate limit since the previous poll.
+        for dpid, counters in self.packet_in_counters.items():
+            previous = self.packet_in_logged.get(dpid, dict.fromkeys(PACKET_IN_COUNTERS, 0))
+            self.packet_in_logged[dpid] = dict(counters)
+            dropped = counters["rate_limited"] - previous["rate_limited"]
+            if dropped:
+                self.logger.warning("Switch %s: %d of %d packet-ins dropped by the rate limit in the last %d s "
+                                    "(%d handled, %d coalesced)", dpid, dropped,
+                                    counters["received"] - previous["received"], STATS_INTERVAL,
+                                    counters["handled"] - previous["handled"],
+                                    counters["coalesced"] - previous["coalesced"])
+
+    def _mitigation_server(self):
+        os.makedirs(MITIGATION_DIR, mode=0o700, exist_ok=True)
+        info = os.lstat(MITIGATION_DIR)
+        if not S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            # Someone else could replace the socket: no mitigation rather than an open one.
+            self.logger.error("%s is not a private directory of this user, mitigation disabled", MITIGATION_DIR)
+            return
+        if os.path.exists(MITIGATION_SOCKET):
+            os.remove(MITIGATION_SOCKET)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(MITIGATION_SOCKET)
+        os.chmod(MITIGATION_SOCKET, 0o600)
+        server.listen(8)
+        self.logger.info("Mitigation requests accepted on %s", MITIGATION_SOCKET)
+        while True:
+            conn, _ = server.accept()
+            hub.spawn(self._mitigation_client, conn)
+
+    def _mitigation_client(self, conn):
+        # One JSON object per line: {"source_ip": ..., "detected_at": ...}
+        with conn, conn.makefile("r") as requests:
+            for line in requests:
+                try:
+                    request = json.loads(line)
+                    source_ip = request["source_ip"]
+                    detected_at = float(request.get("detected_at", time.time()))
+                except (ValueError, KeyError, TypeError) as e:
+                    self.logger.error("Invalid mitigation request %r: %s", line, e)
+                    continue
+                if source_ip not in self.pending_blocks and len(self.pending_blocks) >= MAX_PENDING_BLOCKS:
+                    self.dropped_blocks += 1
+                    continue
+                # Repeated alerts for the same source are coalesced until the next batch.
+                self.pending_blocks[source_ip] = min(detected_at, self.pending_blocks.get(source_ip, detected_at))
+
+    def _block_loop(self):
+        while True:
+            hub.sleep(MITIGATION_INTERVAL)
+            if self.dropped_blocks:
+                self.logger.warning("%d mitigation requests dropped, more than %d sources pending",
+                                    self.dropped_blocks, MAX_PENDING_BLOCKS)
+                self.dropped_blocks = 0
+            if self.pending_blocks:
+                pending, self.pending_blocks = self.pending_blocks, {}
+                self._block_sources(pending)
+
+    def _block_sources(self, pending):
+        now = time.time()
+        self.blocked = {source_ip: expiry for source_ip, expiry in self.blocked.items() if expiry > now}
+        for source_ip, detected_at in pending.items():
+            if self.blocked.get(source_ip, 0) > now:
+                # Still dropped by a previous request.
+                continue
+            dpid = INGRESS_SWITCH.get(source_ip)
+            if dpid is None:
+                targets = list(self.datapaths.values())
+            else:
+                targets = [self.datapaths[dpid]] if dpid in self.datapaths else []
+            if not targets:
+                self.logger.error("No switch connected to block %s", source_ip)
+                continue
+            for datapath in targets:
+                parser = datapath.ofproto_parser
+                match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP, ipv4_src=source_ip)
+                # No actions: matching packets are dropped.
+                self.add_flow(datapath, DROP_PRIORITY, match, [], hard_timeout=BLOCK_TIMEOUT)
+            self.blocked[source_ip] = now + BLOCK_TIMEOUT
+            self.logger.info("Blocked %s on switches %s for %d s, %.1f ms after detection",
+                             source_ip, [datapath.id for datapath in targets], BLOCK_TIMEOUT,
+                             (time.time() - detected_at) * 1000)
@@ -0,0 +1,327 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import cap_main
+import log_writer
+import process_csv
+import process_csv_joblib
+import process_pcap
+import raw_pcap
+from forest_engine import load_array_forest
+from heavy_hitters import HeavyHitterCounter
+from check_malicius_packets import SlidingWindowCounter
+from synthetic_pcap import ATTACKER, generate
+from windowing import WINDOW_PACKETS
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+RESULTS_DIR = os.path.join(SCRIPT_DIR, "benchmark_results")
+
+# Packets of the synthetic captures, and the part of them sent by the floods.
+SIZES = [10000, 100000]
+ATTACK_FRACTION = 0.3
+
+STAGES = ["extract", "predict", "alert", "pipeline"]
+PARSE_BACKENDS = ["scapy", "raw"]
+# predict_forest row by row, forest_engine.ArrayForest, the compiled forest,
+# and the joblib tree with its scaler, scaled or folded into the thresholds.
+INFERENCE_BACKENDS = ["python", "array", "compiled", "joblib", "folded"]
+COUNTERS = ["exact", "sketch"]
+# The inference backends of the detection service, as (model, fold_scaler).
+# The compiled forest has scaled thresholds, so the scaler is folded into it.
+SERVICE_MODELS = {"compiled": ("forest", True), "joblib": ("joblib", False), "folded": ("joblib", True)}
+
+# predict_forest takes a few milliseconds per row: it is timed on the first rows only.
+PYTHON_ROWS = 2000
+# A throughput lower by more than this than in the compared results is reported.
+REGRESSION_THRESHOLD = 0.1
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def ignore_attack(source_ip, count):
+    # The benchmarks write no attack to attack_log.txt.
+    pass
+
+def latency(seconds):
+    """
+    Returns the distribution of the per-window latencies of a stage, in milliseconds.
+    """
+    if not seconds:
+        return None
+    ms = np.asarray(seconds) * 1000
+    return {"windows": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max())}
+
+def load_features(pcap_file):
+    return pd.concat(process_pcap.extract_features(pcap_file, True, backend="raw"), ignore_index=True)
+
+def load_inference(backend):
+    """
+    Returns a function classifying a feature matrix with an inference backend.
+    """
+    forest_file = os.path.join(SCRIPT_DIR, "forest_model.json")
+    if backend == "python":
+        with open(forest_file, 'r') as f:
+            forest = json.load(f)
+        return lambda X: np.array([process_csv.predict_forest(forest, row) for row in X])
+    if backend == "array":
+        return load_array_forest(forest_file).predict
+    if backend == "compiled":
+        return process_csv.load_model(forest_file).predict
+    registry = process_csv_joblib.load_registry(os.path.join(SCRIPT_DIR, "trained_model.joblib"),
+                                                os.path.join(SCRIPT_DIR, "scaler_params.json"),
+                                                fold_scaler=backend == "folded")
+    return lambda X: registry.predict(X)[0]
+
+def run_extract(pcap_file, backend):
+    setup_rss = peak_rss_mb()
+    start = time.perf_counter()
+    rows = sum(len(data) for data in process_pcap.extract_features(pcap_file, True, backend=backend))
+    return {"seconds": time.perf_counter() - start, "rows": rows, "setup_rss_mb": setup_rss,
+            "peak_rss_mb": peak_rss_mb()}
+
+def run_predict(pcap_file, backend):
+    X = process_pcap.feature_matrix(load_features(pcap_file), process_csv.FEATURES)
+    if backend == "python":
+        X = X[:PYTHON_ROWS]
+    predict = load_inference(backend)
+    setup_rss = peak_rss_mb()
+    start = time.perf_counter()
+    predictions = predict(X)
+    return {"seconds": time.perf_counter() - start, "rows": len(X), "malicious": int(np.sum(predictions == 1)),
+            "setup_rss_mb": setup_rss, "peak_rss_mb": peak_rss_mb()}
+
+def run_alert(pcap_file, counter):
+    """
+    Counts the flood packets (the packets of the attacker with a SYN flood
+    window) window by window, as the service counts the malicious predictions.
+    """
+    data = load_features(pcap_file)
+    batches = []
+    malicious = 0
+    for first in range(0, len(data), WINDOW_PACKETS):
+        window = data.iloc[first:first + WINDOW_PACKETS]
+        flood = window[(window["source_ip"] == ATTACKER) & (window["swin"] <= 15)]
+        malicious += len(flood)
+        batches.append((flood["source_ip"].value_counts(), float(window["dur"].iloc[-1])))
+    counter_class = HeavyHitterCounter if counter == "sketch" else SlidingWindowCounter
+    counter = counter_class(reporter=ignore_attack)
+    setup_rss = peak_rss_mb()
+    times = []
+    first_alert = None
+    start = time.perf_counter()
+    for index, (counts, now) in enumerate(batches):
+        batch_start = time.perf_counter()
+        alerts = counter.add_batch(counts, now)
+        times.append(time.perf_counter() - batch_start)
+        if alerts and first_alert is None:
+            first_alert = index
+    return {"seconds": time.perf_counter() - start, "rows": len(data), "malicious": malicious,
+            "first_alert_window": first_alert, "latency": {"alert": latency(times)},
+            "setup_rss_mb": setup_rss, "peak_rss_mb": peak_rss_mb()}
+
+class BenchmarkService(cap_main.DetectionService):
+    """
+    Detection service that times its stages for every window: feature
+    extraction, prediction and alert counting, and records when the first
+    alert is raised.
+    """
+
+    def __init__(self, script_dir, config):
+        super().__init__(script_dir, config, reporter=ignore_attack)
+        self.times = {"extract": [], "predict": [], "alert": []}
+        self.rows = 0
+        self.alerted = set()
+        self.first_alert = None
+        registry_predict = self.registry.predict
+        add_batch = self.counter.add_batch
+        self.registry.predict = functools.partial(self.timed, "predict", registry_predict)
+        self.counter.add_batch = functools.partial(self.timed, "alert", add_batch)
+
+    def timed(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        end = time.perf_counter()
+        self.times[stage].append(end - start)
+        if stage == "extract":
+            self.rows += len(result)
+        elif stage == "alert" and result:
+            if self.first_alert is None:
+                self.first_alert = end
+            self.alerted.update(result)
+        return result
+
+    def extracted_windows(self):
+        for source, packet_count, first_time, result in super().extracted_windows():
+            yield source, packet_count, first_time, functools.partial(self.timed, "extract", result)
+
+def run_pipeline(pcap_file, backend, model, workers, first_attack_index):
+    """
+    Runs the capture through the detection service: the packets are put in
+    the window buffer as fast as it accepts them. The time to alert is the
+    time from the first flood packet entering the buffer to the first alert.
+    """
+    model, fold_scaler = SERVICE_MODELS[model]
+    with tempfile.TemporaryDirectory() as script_dir:
+        # The service reads the models of its folder, and writes its checkpoint there.
+        for name in ("forest_model.json", "trained_model.joblib", "scaler_params.json"):
+            os.symlink(os.path.join(SCRIPT_DIR, name), os.path.join(script_dir, name))
+        config = cap_main.ServiceConfig(backend=backend, model=model, fold_scaler=fold_scaler, workers=workers)
+        service = BenchmarkService(script_dir, config)
+        setup_rss = peak_rss_mb()
+        attack_queued = None
+        start = time.perf_counter()
+        windows_thread = service.start_windows()
+        for index, (timestamp, frame) in enumerate(raw_pcap.iter_packets(pcap_file)):
+            if index == first_attack_index:
+                attack_queued = time.perf_counter()
+            service.buffer.put(pcap_file, timestamp, frame)
+        service.buffer.flush()
+        service.buffer.close()
+        windows_thread.join()
+        seconds = time.perf_counter() - start
+        if service.pool is not None:
+            service.pool.shutdown()
+    time_to_alert = None
+    if service.first_alert is not None and attack_queued is not None:
+        time_to_alert = service.first_alert - attack_queued
+    return {"seconds": seconds, "rows": service.rows, "time_to_alert_s": time_to_alert,
+            "alerted_sources": sorted(service.alerted),
+            "latency": {stage: latency(times) for stage, times in service.times.items()},
+            "setup_rss_mb": setup_rss, "peak_rss_mb": peak_rss_mb()}
+
+def measure(function, *args):
+    """
+    Runs function(*args) in a new process, so that every measure has its own peak RSS.
+    The process only writes errors to the logs.
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"), initializer=log_writer.configure,
+                             initargs=(None, "ERROR")) as pool:
+        return pool.submit(function, *args).result()
+
+def commit_id():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(result):
+    if "packets_per_second" in result:
+        throughput = f"{result['packets_per_second']:>12,.0f} packets/s"
+    else:
+        throughput = f"{result['rows_per_second']:>12,.0f} rows/s   "
+    line = (f"{result['packets']:>8} packets  {result['stage']:<8} {result['backend']:<14} {throughput}  "
+            f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+    if result["stage"] == "pipeline":
+        alert = result["time_to_alert_s"]
+        line += "  time to alert " + (f"{alert * 1000:.0f} ms" if alert is not None else "- (no alert)")
+    print(line, flush=True)
+
+def run_benchmarks(sizes, stages, parse_backends, inference_backends, counters, workers, attack_fraction, seed,
+                   repeat=1):
+    """
+    Generates a synthetic capture of every size and measures the stages on
+    it, keeping the fastest of repeat runs. Returns the list of results.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as pcap_dir:
+        for size in sizes:
+            pcap_file = os.path.join(pcap_dir, f"synthetic_{size}.pcap")
+            capture = generate(pcap_file, size, attack_fraction, seed)
+            runs = []
+            if "extract" in stages:
+                runs += [("extract", backend, run_extract, (pcap_file, backend)) for backend in parse_backends]
+            if "predict" in stages:
+                runs += [("predict", backend, run_predict, (pcap_file, backend)) for backend in inference_backends]
+            if "alert" in stages:
+                runs += [("alert", counter, run_alert, (pcap_file, counter)) for counter in counters]
+            if "pipeline" in stages:
+                runs += [("pipeline", f"{backend}+{model}", run_pipeline,
+                          (pcap_file, backend, model, workers, capture["first_attack_index"]))
+                         for backend in parse_backends for model in inference_backends if model in SERVICE_MODELS]
+            for stage, backend, function, args in runs:
+                result = {"packets": size, "stage": stage, "backend": backend}
+                result.update(min((measure(function, *args) for _ in range(repeat)), key=lambda r: r["seconds"]))
+                result["rows_per_second"] = result["rows"] / result["seconds"] if result["seconds"] else None
+                if stage != "predict":
+                    result["packets_per_second"] = size / result["seconds"] if result["seconds"] else None
+                report(result)
+                results.append(result)
+    return results
+
+def compare(results, previous_file):
+    """
+    Prints the throughput and time to alert of results against a previous
+    results file. Returns the number of throughput regressions.
+    """
+    with open(previous_file, 'r') as f:
+        previous = json.load(f)
+    before = {(r["packets"], r["stage"], r["backend"]): r for r in previous["results"]}
+    print(f"Compared with {previous_file} (commit {previous.get('commit')}):")
+    regressions = 0
+    for result in results:
+        old = before.get((result["packets"], result["stage"], result["backend"]))
+        if old is None or not old.get("rows_per_second") or not result.get("rows_per_second"):
+            continue
+        ratio = result["rows_per_second"] / old["rows_per_second"]
+        line = f"{result['packets']:>8} packets  {result['stage']:<8} {result['backend']:<14} throughput x{ratio:.2f}"
+        if result.get("time_to_alert_s") is not None and old.get("time_to_alert_s") is not None:
+            line += f", time to alert {old['time_to_alert_s'] * 1000:.0f} -> {result['time_to_alert_s'] * 1000:.0f} ms"
+        if ratio < 1 - REGRESSION_THRESHOLD:
+            line += "  REGRESSION"
+            regressions += 1
+        print(line)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline on synthetic captures.")
+    parser.add_argument("--packets", type=int, nargs="+", default=SIZES,
+                        help=f"packets of the synthetic captures (default {' '.join(map(str, SIZES))})")
+    parser.add_argument("--attack-fraction", type=float, default=ATTACK_FRACTION,
+                        help=f"part of the packets sent by the SYN floods (default {ATTACK_FRACTION})")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic captures (default 1)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="stages to measure (default: all)")
+    parser.add_argument("--backends", nargs="+", choices=PARSE_BACKENDS, default=PARSE_BACKENDS,
+                        help="packet parsers (default: all)")
+    parser.add_argument("--models", nargs="+", choices=INFERENCE_BACKENDS, default=INFERENCE_BACKENDS,
+                        help="inference backends (default: all; the pipeline runs the compiled, joblib "
+                             "and folded ones)")
+    parser.add_argument("--counters", nargs="+", choices=COUNTERS, default=COUNTERS,
+                        help="malicious packet counters (default: all)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="feature extraction processes of the pipeline (default 1)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs of every measure, the fastest one is kept (default 1)")
+    parser.add_argument("--output", help=f"results file (default {RESULTS_DIR}/benchmark_<time>.json)")
+    parser.add_argument("--compare", metavar="RESULTS_FILE",
+                        help="compare the throughput and time to alert with a previous results file")
+    args = parser.parse_args()
+
+    started = datetime.now()
+    results = run_benchmarks(args.packets, args.stages, args.backends, args.models, args.counters, args.workers,
+                             args.attack_fraction, args.seed, args.repeat)
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{started:%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({"commit": commit_id(), "started": started.isoformat(), "python": platform.python_version(),
+                   "platform": platform.platform(), "cpus": os.cpu_count(), "config": vars(args),
+                   "results": results}, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
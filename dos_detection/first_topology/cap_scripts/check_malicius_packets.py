@@ -1,10 +1,193 @@
 import pandas as pd
 from datetime import datetime, timedelta
+from collections import Counter, OrderedDict
+import json
+import os
 import sys
+import time
+import log_writer
+
+# A source is reported when it sent more than ALERT_THRESHOLD malicious packets
+# in the last WINDOW_SECONDS seconds.
+WINDOW_SECONDS = 60
+ALERT_THRESHOLD = 10
+
+# A source that stays above the threshold is reported again only
+# ALERT_COOLDOWN seconds after its previous alert.
+ALERT_COOLDOWN = 10
 
 def log_attack(source_ip, count):
-    with open('attack_log.txt', 'a') as log_file:
-        log_file.write(f"{datetime.now()} - {source_ip} sent {count} malicious packets in the last minute\n")
+    # attack_log.txt is written by the log writer, in the log directory.
+    log_writer.log_attack(f"{source_ip} sent {count} malicious packets in the last minute")
+
+class AlertLog:
+    """
+    Reports the sources above the threshold, at most once every cooldown
+    seconds per source, by calling reporter(source_ip, count) (by default
+    log_attack, which writes to attack_log.txt).
+    """
+
+    def __init__(self, cooldown=ALERT_COOLDOWN, reporter=log_attack):
+        self.cooldown = cooldown
+        self.reporter = reporter
+        # Source -> time of its last alert.
+        self.last_alert = {}
+        self.last_prune = None
+
+    def report(self, source_ip, count, now):
+        """
+        Reports an attack of source_ip unless it was reported less than cooldown
+        seconds before now. Returns True if it was reported.
+        """
+        if self.last_prune is None or now - self.last_prune >= self.cooldown:
+            self.last_alert = {ip: t for ip, t in self.last_alert.items() if 0 <= now - t < self.cooldown}
+            self.last_prune = now
+        last = self.last_alert.get(source_ip)
+        if last is not None and 0 <= now - last < self.cooldown:
+            return False
+        self.last_alert[source_ip] = now
+        self.reporter(source_ip, count)
+        return True
+
+class SourceWindow:
+    """
+    Ring of per-second buckets with the malicious packet counts of one source.
+    """
+    __slots__ = ("counts", "seconds", "total", "last")
+
+    def __init__(self, window):
+        self.counts = [0] * window
+        self.seconds = [None] * window
+        self.total = 0
+        self.last = None
+
+class SlidingWindowCounter:
+    """
+    In-memory, incrementally updated per-source count of malicious packets
+    over the last `window` seconds, replacing the re-read of malicious_packets.csv.
+    Each source has a ring of one-second buckets: adding packets only touches the
+    current bucket and clears the buckets that left the window since the last
+    update, so updates are O(1) amortized. Sources without packets in the window
+    are dropped, oldest first.
+    If checkpoint_file is given, the buckets are saved to it at most every
+    checkpoint_interval seconds and reloaded at startup.
+    """
+
+    def __init__(self, window=WINDOW_SECONDS, threshold=ALERT_THRESHOLD,
+                 checkpoint_file=None, checkpoint_interval=10, cooldown=ALERT_COOLDOWN, reporter=log_attack):
+        self.window = window
+        self.threshold = threshold
+        self.alert_log = AlertLog(cooldown, reporter)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.time()
+        # Sources ordered by last update, least recent first.
+        self.sources = OrderedDict()
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            self.load_checkpoint()
+
+    def advance(self, state, second):
+        """
+        Clears the buckets of state that are older than the window at `second`.
+        """
+        if state.last is not None and second <= state.last:
+            return
+        if state.last is None or second - state.last >= self.window:
+            state.counts = [0] * self.window
+            state.seconds = [None] * self.window
+            state.total = 0
+        else:
+            for t in range(state.last + 1, second + 1):
+                i = t % self.window
+                state.total -= state.counts[i]
+                state.counts[i] = 0
+                state.seconds[i] = None
+        state.last = second
+
+    def add(self, source_ip, count=1, now=None):
+        """
+        Adds count malicious packets from source_ip at time now (seconds since the epoch).
+        Returns the number of malicious packets of source_ip in the window.
+        """
+        now = time.time() if now is None else now
+        second = int(now)
+        state = self.sources.get(source_ip)
+        if state is None:
+            state = self.sources[source_ip] = SourceWindow(self.window)
+        self.advance(state, second)
+        self.sources.move_to_end(source_ip)
+        if second > state.last - self.window:
+            i = second % self.window
+            if state.seconds[i] != second:
+                state.total -= state.counts[i]
+                state.counts[i] = 0
+                state.seconds[i] = second
+            state.counts[i] += count
+            state.total += count
+        self.expire_sources(second)
+        return state.total
+
+    def count(self, source_ip, now=None):
+        """
+        Returns the number of malicious packets of source_ip in the window ending at now.
+        """
+        state = self.sources.get(source_ip)
+        if state is None:
+            return 0
+        second = int(time.time() if now is None else now)
+        if state.last is not None and second - state.last >= self.window:
+            return 0
+        return sum(c for c, s in zip(state.counts, state.seconds) if s is not None and second - s < self.window)
+
+    def expire_sources(self, second):
+        # Sources are ordered by last update, so only the front needs checking.
+        while self.sources:
+            source_ip, state = next(iter(self.sources.items()))
+            if second - state.last < self.window:
+                break
+            del self.sources[source_ip]
+
+    def add_batch(self, source_ips, now=None):
+        """
+        Ingests the source IPs of a batch of malicious predictions (weights can be
+        given as a dict/Series of source_ip -> count) and logs an attack for every
+        source above the threshold, unless it was reported less than cooldown
+        seconds before. Returns {source_ip: count} for the reported sources.
+        """
+        now = time.time() if now is None else now
+        counts = source_ips if hasattr(source_ips, "items") else Counter(source_ips)
+        alerts = {}
+        for source_ip, count in counts.items():
+            total = self.add(source_ip, count, now)
+            if total > self.threshold and self.alert_log.report(source_ip, total, now):
+                alerts[source_ip] = total
+        self.maybe_checkpoint(now)
+        return alerts
+
+    def maybe_checkpoint(self, now):
+        if self.checkpoint_file and now - self.last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint()
+            self.last_checkpoint = now
+
+    def save_checkpoint(self):
+        """
+        Writes the non-empty buckets to checkpoint_file (atomically, through a rename).
+        """
+        state = {
+            source_ip: [[s, c] for c, s in zip(window.counts, window.seconds) if s is not None and c]
+            for source_ip, window in self.sources.items()
+        }
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_file, 'r') as f:
+            state = json.load(f)
+        buckets = sorted((s, source_ip, c) for source_ip, items in state.items() for s, c in items)
+        for second, source_ip, count in buckets:
+            self.add(source_ip, count, second)
 
 def detect_attacks(csv_file):
     try:
@@ -0,0 +1,120 @@
+import json
+import numpy as np
+
+# Marker used by the JSON model for leaf nodes.
+LEAF = -2
+
+class ArrayForest:
+    """
+    Random Forest stored as flat NumPy arrays.
+    All the trees of the JSON model are concatenated into a single set of
+    node arrays, with children indices rebased to the global node index:
+      - feature: feature index tested at the node (LEAF for leaf nodes)
+      - threshold: threshold for the decision
+      - left/right: global index of the child nodes (self index for leaves)
+      - leaf_class: argmax of the class distribution at the node
+      - roots: global index of the root node of every tree
+    """
+
+    def __init__(self, feature, threshold, left, right, leaf_class, roots, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_class = leaf_class
+        self.roots = roots
+        self.depth = depth
+        self.n_classes = int(leaf_class.max()) + 1 if len(leaf_class) else 1
+
+    @classmethod
+    def from_json(cls, forest):
+        """
+        Builds the flat arrays from the list of tree structures of forest_model.json.
+        """
+        features, thresholds, lefts, rights, classes, roots = [], [], [], [], [], []
+        depth = 0
+        offset = 0
+        for tree in forest:
+            feature = np.asarray(tree["feature"], dtype=np.int64)
+            n_nodes = len(feature)
+            node_ids = np.arange(offset, offset + n_nodes)
+            is_leaf = feature == LEAF
+            left = np.asarray(tree["children_left"], dtype=np.int64) + offset
+            right = np.asarray(tree["children_right"], dtype=np.int64) + offset
+            # Leaves point to themselves so that extra levels are a no-op.
+            left[is_leaf] = node_ids[is_leaf]
+            right[is_leaf] = node_ids[is_leaf]
+
+            features.append(np.where(is_leaf, 0, feature))
+            thresholds.append(np.asarray(tree["threshold"], dtype=np.float64))
+            lefts.append(left)
+            rights.append(right)
+            # Same as np.argmax(tree["values"][node]) in predict_tree.
+            classes.append(np.array([np.argmax(v) for v in tree["values"]], dtype=np.int64))
+            roots.append(offset)
+            depth = max(depth, tree_depth(tree))
+            offset += n_nodes
+
+        return cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(lefts),
+            np.concatenate(rights),
+            np.concatenate(classes),
+            np.asarray(roots, dtype=np.int64),
+            depth,
+        )
+
+    def tree_predictions(self, X):
+        """
+        Evaluates every tree on every row of X, level by level.
+        Returns an array of shape (n_rows, n_trees) with the class voted by each tree.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        n_rows = X.shape[0]
+        rows = np.arange(n_rows)[:, None]
+        node = np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy()
+        for _ in range(self.depth):
+            # NaN comparisons are False, so missing values go right as in predict_tree.
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.leaf_class[node]
+
+    def predict(self, X):
+        """
+        Returns the majority vote of the forest for every row of X.
+        Ties are broken like Counter.most_common: the class voted first wins.
+        """
+        votes = self.tree_predictions(X)
+        n_rows, n_trees = votes.shape
+        if n_rows == 0:
+            return np.empty(0, dtype=np.int64)
+        classes = np.arange(self.n_classes)
+        is_class = votes[:, None, :] == classes[None, :, None]
+        counts = is_class.sum(axis=2)
+        first_vote = np.where(is_class.any(axis=2), is_class.argmax(axis=2), n_trees)
+        # Highest count first, then earliest first vote.
+        score = counts * (n_trees + 1) - first_vote
+        return classes[score.argmax(axis=1)]
+
+def tree_depth(tree):
+    """
+    Returns the number of decisions on the longest root-to-leaf path of a JSON tree.
+    """
+    depth = 0
+    stack = [(0, 0)]
+    while stack:
+        node, level = stack.pop()
+        if tree["feature"][node] == LEAF:
+            depth = max(depth, level)
+        else:
+            stack.append((tree["children_left"][node], level + 1))
+            stack.append((tree["children_right"][node], level + 1))
+    return depth
+
+def load_array_forest(model_file):
+    """
+    Loads forest_model.json and converts it into an ArrayForest.
+    """
+    with open(model_file, 'r') as f:
+        return ArrayForest.from_json(json.load(f))
@@ -0,0 +1,150 @@
+import ctypes
+import socket
+import struct
+import threading
+import time
+import log_writer
+
+SCRIPT_NAME = "live_capture.py"
+
+# Interface of the cap host, attached to the port of s1 that tcpdump used to capture (s1-eth4).
+CAPTURE_INTERFACE = "cap-eth0"
+
+SNAPLEN = 65535
+SOCKET_BUFFER = 8 * 1024 * 1024
+
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+# SO_TIMESTAMP makes the kernel attach the receive time of every packet
+# (struct timeval, control message SCM_TIMESTAMP = SO_TIMESTAMP) to recvmsg().
+SO_TIMESTAMP = 29
+TIMEVAL = struct.Struct("ll")
+
+# Rejects every packet: attached until the socket is bound to the interface.
+DROP_FILTER = [(0x06, 0, 0, 0x00000000)]
+
+# Classic BPF program of the "tcp" filter, as printed by `tcpdump -dd tcp`:
+# IPv4 or IPv6 packets whose protocol (or IPv6 fragment next header) is TCP.
+TCP_FILTER = [
+    (0x28, 0, 0, 0x0000000c),
+    (0x15, 0, 5, 0x000086dd),
+    (0x30, 0, 0, 0x00000014),
+    (0x15, 6, 0, 0x00000006),
+    (0x15, 0, 6, 0x0000002c),
+    (0x30, 0, 0, 0x00000036),
+    (0x15, 3, 4, 0x00000006),
+    (0x15, 0, 3, 0x00000800),
+    (0x30, 0, 0, 0x00000017),
+    (0x15, 0, 1, 0x00000006),
+    (0x06, 0, 0, 0x00040000),
+    (0x06, 0, 0, 0x00000000),
+]
+
+def log_error(message):
+    log_writer.log_error(SCRIPT_NAME, message)
+
+def log_message(message):
+    log_writer.log_message(SCRIPT_NAME, message)
+
+def attach_filter(sock, program):
+    """
+    Attaches a classic BPF program to a socket, so that the kernel only
+    queues the packets accepted by the filter.
+    """
+    instructions = b"".join(struct.pack("HBBI", *instruction) for instruction in program)
+    buffer = ctypes.create_string_buffer(instructions, len(instructions))
+    # struct sock_fprog { unsigned short len; struct sock_filter *filter; }
+    fprog = struct.pack("HL", len(program), ctypes.addressof(buffer))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+def drain(sock):
+    """
+    Discards the packets already queued on a socket, without blocking.
+    Returns the number of packets discarded.
+    """
+    drained = 0
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(SNAPLEN)
+            drained += 1
+    except BlockingIOError:
+        pass
+    return drained
+
+def kernel_timestamp(ancdata):
+    """
+    Returns the SO_TIMESTAMP receive time of a packet, in seconds since the
+    epoch, from the ancillary data of recvmsg(), or None if there is none.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMP and len(data) >= TIMEVAL.size:
+            seconds, microseconds = TIMEVAL.unpack_from(data)
+            return seconds + microseconds / 1e6
+    return None
+
+class LiveCapture:
+    """
+    Captures the packets of an interface with an AF_PACKET socket (Linux only,
+    needs root) into an in-memory buffer.
+    A background thread receives the frames and puts them, with their
+    timestamps, in a windowing.WindowBuffer; the detection takes the windows
+    from the buffer. There is no file rotation, so no packet is lost between
+    captures and the latency is only the window delay. The buffer should use
+    the OVERFLOW_DROP policy, so that the capture never waits for the detection.
+    The timestamps are the kernel receive times (SO_TIMESTAMP), so the time a
+    packet waits in the socket buffer does not stretch windows and flows.
+    """
+
+    def __init__(self, buffer, interface=CAPTURE_INTERFACE, tcp_only=True):
+        self.buffer = buffer
+        self.interface = interface
+        self.tcp_only = tcp_only
+        self.captured = 0
+        self.running = False
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMP, 1)
+        # Until bind(), the socket receives the packets of every interface:
+        # drop them all, then discard what was queued before the real filter.
+        attach_filter(self.sock, DROP_FILTER)
+        self.sock.bind((self.interface, ETH_P_ALL))
+        drain(self.sock)
+        if self.tcp_only:
+            attach_filter(self.sock, TCP_FILTER)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+        self.sock.settimeout(0.5)
+        self.running = True
+        self.thread = threading.Thread(target=self.capture_loop, name="live-capture", daemon=True)
+        self.thread.start()
+        log_message(f"Live capture started on {self.interface}" + (" (tcp only)" if self.tcp_only else ""))
+
+    def capture_loop(self):
+        while self.running:
+            try:
+                frame, ancdata, _, _ = self.sock.recvmsg(SNAPLEN, socket.CMSG_SPACE(TIMEVAL.size))
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.running:
+                    log_error(f"Live capture on {self.interface} stopped: {e}")
+                    self.running = False
+                break
+            timestamp = kernel_timestamp(ancdata)
+            self.buffer.put(self.interface, time.time() if timestamp is None else timestamp, frame)
+            self.captured += 1
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.sock is not None:
+            self.sock.close()
+        log_message(f"Live capture stopped on {self.interface}: {self.captured} packets captured, "
+                    f"{self.buffer.dropped} dropped by the buffer")
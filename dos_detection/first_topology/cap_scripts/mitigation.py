@@ -0,0 +1,85 @@
+import json
+import socket
+import sys
+import time
+import log_writer
+
+SCRIPT_NAME = "mitigation.py"
+
+# Unix socket of the mitigation endpoint of allowal_connectivity.py, only
+# reachable by the user of the controller (and root).
+MITIGATION_SOCKET = "/tmp/dos_mitigation/mitigation.sock"
+
+# A source is not requested again before RESEND_INTERVAL seconds: the
+# controller keeps it blocked for longer than that anyway.
+RESEND_INTERVAL = 10
+
+def log_error(message):
+    log_writer.log_error(SCRIPT_NAME, message)
+
+def log_message(message):
+    log_writer.log_message(SCRIPT_NAME, message)
+
+class MitigationClient:
+    """
+    Sends block requests for the sources flagged by the detector to the
+    controller. The requests of one alert batch go out in a single write on
+    a persistent connection; if the controller is not reachable the requests
+    are dropped (and logged) and the connection is retried on the next alert.
+    """
+
+    def __init__(self, socket_path=MITIGATION_SOCKET, resend_interval=RESEND_INTERVAL):
+        self.socket_path = socket_path
+        self.resend_interval = resend_interval
+        self.sock = None
+        self.requested = {}
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(1)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+    def block(self, source_ips, detected_at=None):
+        """
+        Requests a drop rule for every source in source_ips.
+        detected_at (seconds since the epoch, by default now) is sent along so
+        that the controller can report the time from detection to block.
+        Returns the sources actually requested.
+        """
+        now = time.time()
+        detected_at = now if detected_at is None else detected_at
+        self.requested = {ip: t for ip, t in self.requested.items() if now - t < self.resend_interval}
+        sources = [ip for ip in dict.fromkeys(source_ips) if ip not in self.requested]
+        if not sources:
+            return []
+        payload = "".join(json.dumps({"source_ip": ip, "detected_at": detected_at}) + "\n" for ip in sources)
+        try:
+            if self.sock is None:
+                self.connect()
+            self.sock.sendall(payload.encode())
+        except OSError as e:
+            log_error(f"Could not send the block requests for {', '.join(sources)}: {e}")
+            self.close()
+            return []
+        for ip in sources:
+            self.requested[ip] = now
+        log_message(f"Block requested for {', '.join(sources)}, "
+                    f"{(time.time() - detected_at) * 1000:.1f} ms after detection")
+        return sources
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+if __name__ == "__main__":
+    # Manual block: python3 mitigation.py <source_ip> [<source_ip> ...]
+    if len(sys.argv) < 2:
+        print("Usage: python3 mitigation.py <source_ip> [<source_ip> ...]")
+        sys.exit(1)
+    client = MitigationClient()
+    if not client.block(sys.argv[1:]):
+        print(f"Could not reach the controller on {MITIGATION_SOCKET}")
+        sys.exit(1)
+    client.close()
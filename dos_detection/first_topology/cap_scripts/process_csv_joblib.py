@@ -4,24 +4,18 @@ import sys
 import os
 import numpy as np
 from datetime import datetime
-from collections import Counter
 import joblib
+from model_registry import ModelRegistry
+from process_csv import FEATURES
+import log_writer
 
-SCRIPT_NAME = "process_csv.py"
+SCRIPT_NAME = "process_csv_joblib.py"
 
 def log_error(message):
-    try:
-        with open('errors_logs.txt', 'a') as log_file:
-            log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
-    except Exception as e:
-        print(f"An error occurred while logging an error: {e}")
+    log_writer.log_error(SCRIPT_NAME, message)
 
 def log_message(message):
-    try:
-        with open('logs.txt', 'a') as log_file:
-            log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
-    except Exception as e:
-        print(f"An error occurred while logging a message: {e}")
+    log_writer.log_message(SCRIPT_NAME, message)
 
 def load_csv(csv_file):
     try:
@@ -54,23 +48,26 @@ def load_scaler_params(scaler_params_file):
         log_error(error_message)
         sys.exit(1)
 
-def scale_features(features, scaler_params):
-    mean = np.array(scaler_params["mean"])
-    scale = np.array(scaler_params["scale"])
-    return (features - mean) / scale
-
-def predict(data, model, scaler_params):
+def load_registry(model_file, scaler_params_file, fold_scaler=False):
+    """
+    Returns a ModelRegistry holding the joblib model and the scaler arrays.
+    Both are loaded once; a change of either file loads a new model version
+    when the registry is started (see model_registry.py).
+    With fold_scaler the scaler is folded into the model thresholds, and the
+    raw features are classified without being scaled.
+    """
+    return ModelRegistry(model_file, load_model, FEATURES, scaler_params_file, load_scaler_params,
+                         fold_scaler=fold_scaler)
+
+def predict(data, registry):
     try:
-        # Extract the features used during training.
-        features = data[["id", "dur", "spkts", "sttl", "swin", 
-                         "stcpb", "dtcpb", "pps", "ttl_ratio", "tcp_diff", "swin_interaction"]]
-        
-        features_array = features.to_numpy()
-        scaled_features = scale_features(features_array, scaler_params)
-        predictions = model.predict(scaled_features)
-        
+        features_array = data[FEATURES].to_numpy(dtype=np.float64)
+        predictions, version = registry.predict(features_array)
+
         data['prediction'] = predictions
-        log_message("Made predictions on the data")
+        # Every batch records the model version that classified it.
+        data['model_version'] = version
+        log_message(f"Made predictions on the data with model {version}")
         return data
     except Exception as e:
         error_message = f"An error occurred while making predictions: {e}"
@@ -101,8 +98,7 @@ def update_malicious_csv(data, output_file):
         sys.exit(1)
 
 if __name__ == "__main__":
-    print("Starting process_csv.py")
-    ensure_log_files_exist()
+    print("Starting process_csv_joblib.py")
     log_message("Processing CSV file...")
     
     if len(sys.argv) != 2:
@@ -121,9 +117,8 @@ if __name__ == "__main__":
             f.write('source_ip,timestamp\n')
 
     data = load_csv(csv_file)
-    model = load_model(model_file)
-    scaler_params = load_scaler_params(scaler_params_file)
-    result = predict(data, model, scaler_params)
+    registry = load_registry(model_file, scaler_params_file)
+    result = predict(data, registry)
 
     # Update the malicious packets CSV file with the new predictions.
     update_malicious_csv(result, output_file)
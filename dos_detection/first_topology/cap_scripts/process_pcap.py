@@ -1,119 +1,351 @@
+import argparse
 import csv
 import os
-from scapy.all import rdpcap, TCP, IP
-from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scapy.all import PcapReader, Ether, TCP, UDP, IP
+
+import raw_pcap
+from flow_aggregator import FlowAggregator
+from feature_file import FEATURE_FILE_EXT, write_feature_file
+from spool import SPOOL_DIR
+import log_writer
 
 SCRIPT_NAME = "process_pcap.py"
 
+CSV_HEADER = [
+    "id", "source_ip", "dur", "spkts", "sbytes", "sttl", "swin", "stcpb",
+    "dtcpb", "rate", "pps", "bpp", "ttl_ratio", "tcp_diff", "swin_interaction"
+]
+
+# Per-packet columns that identify the flow of a packet, together with source_ip.
+# They are not written to the CSV.
+PACKET_KEY_COLUMNS = ["dst_ip", "sport", "dport", "proto"]
+
+# Number of packets a sampled packet stands for (see sampling.py). Not written to the CSV.
+WEIGHT_COLUMN = "weight"
+
+# Features that are integers in the CSV.
+INTEGER_COLUMNS = ["id", "spkts", "sbytes", "sttl", "swin", "stcpb", "dtcpb", "sport", "dport", "proto"]
+
+# Maximum number of feature rows handed to the downstream stage at once.
+CHUNK_SIZE = 10000
+
 def log_error(message):
-    with open('errors_logs.txt', 'a') as log_file:
-        log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
+    log_writer.log_error(SCRIPT_NAME, message)
 
 def log_message(message):
-    with open('logs.txt', 'a') as log_file:
-        log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
+    log_writer.log_message(SCRIPT_NAME, message)
 
-def pcap_to_csv(pcap_file, csv_file, exclude_non_tcp=False):
+def packet_features(packet, pkt_id):
+    """
+    Computes the feature row of a single packet, in the CSV_HEADER order.
+    Missing values are reported as "N/A".
+    """
+    # Extract basic features
+    dur = getattr(packet, "time", "N/A")
+    spkts = 1  
+    sbytes = len(packet)
+    sttl = getattr(packet[IP], "ttl", "N/A") if packet.haslayer(IP) else "N/A"
+    swin = getattr(packet[TCP], "window", "N/A") if packet.haslayer(TCP) else "N/A"
+    stcpb = getattr(packet[TCP], "seq", "N/A") if packet.haslayer(TCP) else "N/A"
+    dtcpb = getattr(packet[TCP], "ack", "N/A") if packet.haslayer(TCP) else "N/A"
+    source_ip = packet[IP].src if packet.haslayer(IP) else "N/A"
+
+    # Calculate derived features using safe conversions
+
+    # Convert duration to float
     try:
-        log_message(f"Reading pcap file: {pcap_file}")
-        packets = rdpcap(pcap_file)
-        total_packets = len(packets)
-        log_message(f"Total packets read: {total_packets}")
-        
-        non_tcp_packets_excluded = 0
-        processed_packets = 0
-        
-        with open(csv_file, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([
-                "id", "source_ip", "dur", "spkts", "sbytes", "sttl", "swin", "stcpb", 
-                "dtcpb", "rate", "pps", "bpp", "ttl_ratio", "tcp_diff", "swin_interaction"
-            ])
-            
-            for i, packet in enumerate(packets):
-                if exclude_non_tcp and not packet.haslayer(TCP):
-                    non_tcp_packets_excluded += 1
-                    continue
-                
-                processed_packets += 1
-                pkt_id = processed_packets
-                
-                # Extract basic features
-                dur = getattr(packet, "time", "N/A")
-                spkts = 1  
-                sbytes = len(packet)
-                sttl = getattr(packet[IP], "ttl", "N/A") if packet.haslayer(IP) else "N/A"
-                swin = getattr(packet[TCP], "window", "N/A") if packet.haslayer(TCP) else "N/A"
-                stcpb = getattr(packet[TCP], "seq", "N/A") if packet.haslayer(TCP) else "N/A"
-                dtcpb = getattr(packet[TCP], "ack", "N/A") if packet.haslayer(TCP) else "N/A"
-                source_ip = packet[IP].src if packet.haslayer(IP) else "N/A"
-                
-                # Calculate derived features using safe conversions
-
-                # Convert duration to float
-                try:
-                    dur_float = float(dur)
-                except (ValueError, TypeError):
-                    dur_float = None
-
-                # Rate (bytes per second)
-                if dur_float is None or dur_float == 0:
-                    rate = "N/A"
-                else:
-                    rate = sbytes / dur_float
-
-                # Packets per second (pps)
-                if dur_float is None or dur_float == 0:
-                    pps = "N/A"
-                else:
-                    pps = spkts / dur_float
-
-                # Bytes per packet (bpp)
-                if spkts == 0:
-                    bpp = "N/A"
-                else:
-                    bpp = sbytes / spkts
-
-                # TTL ratio (sttl/dur)
-                try:
-                    sttl_float = float(sttl)
-                except (ValueError, TypeError):
-                    sttl_float = None
-                if sttl_float is None or dur_float is None or dur_float == 0:
-                    ttl_ratio = "N/A"
-                else:
-                    ttl_ratio = sttl_float / dur_float
-
-                # TCP difference (dtcpb - stcpb)
-                try:
-                    stcpb_float = float(stcpb)
-                except (ValueError, TypeError):
-                    stcpb_float = None
-                try:
-                    dtcpb_float = float(dtcpb)
-                except (ValueError, TypeError):
-                    dtcpb_float = None
-                if stcpb_float is None or dtcpb_float is None:
-                    tcp_diff = "N/A"
-                else:
-                    tcp_diff = dtcpb_float - stcpb_float
-
-                # swin_interaction (swin * stcpb)
-                try:
-                    swin_float = float(swin)
-                except (ValueError, TypeError):
-                    swin_float = None
-                if swin_float is None or stcpb_float is None:
-                    swin_interaction = "N/A"
-                else:
-                    swin_interaction = swin_float * stcpb_float
-
-                writer.writerow([
-                    pkt_id, source_ip, dur, spkts, sbytes, sttl, swin, stcpb, dtcpb, rate, pps, bpp, ttl_ratio, tcp_diff, swin_interaction
-                ])
-
-        log_message(f"Total packets processed: {processed_packets}")
-        log_message(f"Non-TCP packets excluded: {non_tcp_packets_excluded}")
+        dur_float = float(dur)
+    except (ValueError, TypeError):
+        dur_float = None
+
+    # Rate (bytes per second)
+    if dur_float is None or dur_float == 0:
+        rate = "N/A"
+    else:
+        rate = sbytes / dur_float
+
+    # Packets per second (pps)
+    if dur_float is None or dur_float == 0:
+        pps = "N/A"
+    else:
+        pps = spkts / dur_float
+
+    # Bytes per packet (bpp)
+    if spkts == 0:
+        bpp = "N/A"
+    else:
+        bpp = sbytes / spkts
+
+    # TTL ratio (sttl/dur)
+    try:
+        sttl_float = float(sttl)
+    except (ValueError, TypeError):
+        sttl_float = None
+    if sttl_float is None or dur_float is None or dur_float == 0:
+        ttl_ratio = "N/A"
+    else:
+        ttl_ratio = sttl_float / dur_float
+
+    # TCP difference (dtcpb - stcpb)
+    try:
+        stcpb_float = float(stcpb)
+    except (ValueError, TypeError):
+        stcpb_float = None
+    try:
+        dtcpb_float = float(dtcpb)
+    except (ValueError, TypeError):
+        dtcpb_float = None
+    if stcpb_float is None or dtcpb_float is None:
+        tcp_diff = "N/A"
+    else:
+        tcp_diff = dtcpb_float - stcpb_float
+
+    # swin_interaction (swin * stcpb)
+    try:
+        swin_float = float(swin)
+    except (ValueError, TypeError):
+        swin_float = None
+    if swin_float is None or stcpb_float is None:
+        swin_interaction = "N/A"
+    else:
+        swin_interaction = swin_float * stcpb_float
+
+    return [
+        pkt_id, source_ip, dur, spkts, sbytes, sttl, swin, stcpb, dtcpb, rate, pps, bpp, ttl_ratio, tcp_diff, swin_interaction
+    ]
+
+def packet_key(packet):
+    """
+    Returns the PACKET_KEY_COLUMNS values of a packet, "N/A" when missing.
+    """
+    dst_ip = packet[IP].dst if packet.haslayer(IP) else "N/A"
+    proto = packet[IP].proto if packet.haslayer(IP) else "N/A"
+    if packet.haslayer(TCP):
+        sport, dport = packet[TCP].sport, packet[TCP].dport
+    elif packet.haslayer(UDP):
+        sport, dport = packet[UDP].sport, packet[UDP].dport
+    else:
+        sport, dport = "N/A", "N/A"
+    return [dst_ip, sport, dport, proto]
+
+def iter_features(pcap_file, exclude_non_tcp=False):
+    """
+    Streams the packets of a pcap file and yields their feature rows one by one.
+    Packets are read incrementally with PcapReader, so memory stays constant
+    whatever the size of the capture.
+    """
+    log_message(f"Reading pcap file: {pcap_file}")
+    total_packets = 0
+    non_tcp_packets_excluded = 0
+    processed_packets = 0
+
+    with PcapReader(pcap_file) as packets:
+        for packet in packets:
+            total_packets += 1
+            if exclude_non_tcp and not packet.haslayer(TCP):
+                non_tcp_packets_excluded += 1
+                continue
+            processed_packets += 1
+            yield packet_features(packet, processed_packets) + packet_key(packet)
+
+    log_message(f"Total packets read: {total_packets}")
+    log_message(f"Total packets processed: {processed_packets}")
+    log_message(f"Non-TCP packets excluded: {non_tcp_packets_excluded}")
+
+def iter_raw_features(pcap_file, exclude_non_tcp=False, chunk_size=CHUNK_SIZE):
+    """
+    Same as extract_features, but the headers are read directly from a memory
+    map of the pcap file by raw_pcap instead of being dissected by scapy.
+    """
+    log_message(f"Reading pcap file: {pcap_file}")
+    total_packets = 0
+    non_tcp_packets_excluded = 0
+    processed_packets = 0
+
+    for columns in raw_pcap.iter_columns(pcap_file, chunk_size):
+        total_packets += len(columns["is_tcp"])
+        data = raw_columns_to_frame(columns, exclude_non_tcp, processed_packets + 1)
+        non_tcp_packets_excluded += len(columns["is_tcp"]) - len(data)
+        processed_packets += len(data)
+        if len(data):
+            yield data
+
+    log_message(f"Total packets read: {total_packets}")
+    log_message(f"Total packets processed: {processed_packets}")
+    log_message(f"Non-TCP packets excluded: {non_tcp_packets_excluded}")
+
+def raw_columns_to_frame(columns, exclude_non_tcp, first_id, weights=None):
+    """
+    Builds the feature DataFrame from the columns returned by raw_pcap,
+    dropping the non-TCP packets if requested and numbering the rows from first_id.
+    """
+    columns = dict(columns)
+    if weights is not None:
+        columns[WEIGHT_COLUMN] = np.asarray(weights, dtype=np.float64)
+    is_tcp = columns.pop("is_tcp")
+    if exclude_non_tcp:
+        columns = {name: values[is_tcp] for name, values in columns.items()}
+    count = len(columns["dur"])
+    columns["id"] = np.arange(first_id, first_id + count)
+    return columns_to_frame(columns)
+
+def window_features(frames, timestamps, exclude_non_tcp=False, first_id=1, backend="raw", weights=None):
+    """
+    Computes the features of a window of Ethernet frames (see windowing.py),
+    numbering the rows from first_id. Returns a DataFrame, possibly empty.
+    The weights of sampled packets, if given, go to the WEIGHT_COLUMN.
+    """
+    if backend == "raw":
+        return raw_columns_to_frame(raw_pcap.packets_columns(frames, timestamps), exclude_non_tcp, first_id, weights)
+    if backend != "scapy":
+        raise ValueError(f"Unknown feature extraction backend: {backend}")
+    rows = []
+    kept_weights = []
+    for index, (frame, timestamp) in enumerate(zip(frames, timestamps)):
+        packet = Ether(frame)
+        packet.time = timestamp
+        if exclude_non_tcp and not packet.haslayer(TCP):
+            continue
+        rows.append(packet_features(packet, first_id + len(rows)) + packet_key(packet))
+        if weights is not None:
+            kept_weights.append(weights[index])
+    if not rows:
+        columns = {column: [] for column in CSV_HEADER}
+        if weights is not None:
+            columns[WEIGHT_COLUMN] = []
+        return columns_to_frame(columns)
+    data = features_to_frame(rows)
+    if weights is not None:
+        data[WEIGHT_COLUMN] = np.asarray(kept_weights, dtype=np.float64)
+    return data
+
+def renumber(data, first_id):
+    """
+    Numbers the rows of a feature DataFrame from first_id, for windows whose
+    features were computed out of order (e.g. by a worker pool).
+    """
+    data["id"] = pd.array(np.arange(first_id, first_id + len(data)), dtype="Int64")
+    return data
+
+def extract_features(pcap_file, exclude_non_tcp=False, chunk_size=CHUNK_SIZE, backend="scapy"):
+    """
+    Yields the features of a pcap file as DataFrames of at most chunk_size rows.
+    backend selects how packets are parsed: "scapy" dissects every packet,
+    "raw" reads the Ethernet/IP/TCP headers at fixed offsets (see raw_pcap.py).
+    Captures that the raw parser does not support are read with scapy.
+    """
+    if backend == "raw":
+        try:
+            with open(pcap_file, "rb") as f:
+                header = f.read(24)
+            if header:
+                raw_pcap.read_pcap_header(header)
+        except ValueError as e:
+            log_message(f"Raw parser not usable for {pcap_file} ({e}), falling back to scapy")
+        else:
+            yield from iter_raw_features(pcap_file, exclude_non_tcp, chunk_size)
+            return
+    elif backend != "scapy":
+        raise ValueError(f"Unknown feature extraction backend: {backend}")
+
+    chunk = []
+    for row in iter_features(pcap_file, exclude_non_tcp):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield features_to_frame(chunk)
+            chunk = []
+    if chunk:
+        yield features_to_frame(chunk)
+
+def columns_to_frame(columns):
+    """
+    Builds the feature DataFrame from a dict of columns, in the CSV_HEADER order
+    followed by the PACKET_KEY_COLUMNS and the WEIGHT_COLUMN when they are present.
+    Integer features use the nullable Int64 dtype so that the CSV output keeps
+    integers and "N/A" for missing values.
+    """
+    names = CSV_HEADER + [column for column in PACKET_KEY_COLUMNS + [WEIGHT_COLUMN] if column in columns]
+    data = pd.DataFrame({column: columns[column] for column in names})
+    for column in INTEGER_COLUMNS:
+        if column in data:
+            data[column] = data[column].astype("Int64")
+    return data
+
+def features_to_frame(rows):
+    """
+    Builds the feature DataFrame from rows returned by packet_features, optionally
+    followed by the packet_key values: "N/A" values become missing values.
+    """
+    names = CSV_HEADER + PACKET_KEY_COLUMNS
+    data = pd.DataFrame(rows, columns=names[:len(rows[0])])
+    columns = {}
+    for column in data.columns:
+        if column in ("source_ip", "dst_ip"):
+            columns[column] = data[column].where(data[column] != "N/A", None)
+        else:
+            columns[column] = pd.to_numeric(data[column].where(data[column] != "N/A", np.nan))
+    return columns_to_frame(columns)
+
+def aggregate_flows(frames, aggregator, flush=True):
+    """
+    Feeds per-packet feature DataFrames (with their PACKET_KEY_COLUMNS) to a
+    FlowAggregator and yields DataFrames with one row per finished flow.
+    With flush=False the flows still open at the end stay in the aggregator,
+    so that they can continue in the next capture.
+    """
+    for data in frames:
+        columns = [data[column].astype(object).where(data[column].notna(), None).tolist()
+                   for column in ("source_ip", "dst_ip", "sport", "dport", "proto",
+                                  "dur", "sbytes", "sttl", "swin", "stcpb", "dtcpb")]
+        rows = []
+        for src, dst, sport, dport, proto, ts, sbytes, sttl, swin, stcpb, dtcpb in zip(*columns):
+            rows += aggregator.add((src, dst, sport, dport, proto), ts, sbytes, sttl, swin, stcpb, dtcpb)
+        rows += aggregator.expire()
+        if rows:
+            yield features_to_frame(rows)
+    rows = aggregator.flush() if flush else aggregator.expire()
+    if rows:
+        yield features_to_frame(rows)
+
+def feature_matrix(data, features):
+    """
+    Returns the float matrix of the given feature columns, with NaN for missing values.
+    """
+    return data[features].to_numpy(dtype=np.float64, na_value=np.nan)
+
+def write_csv(frames, csv_file):
+    with open(csv_file, mode='w', newline='') as file:
+        header = True
+        for data in frames:
+            data = data[CSV_HEADER].copy()
+            # scapy reports timestamps with microsecond precision.
+            data["dur"] = data["dur"].map("{:.6f}".format)
+            data.to_csv(file, header=header, index=False, na_rep="N/A", lineterminator="\r\n")
+            header = False
+        if header:
+            csv.writer(file).writerow(CSV_HEADER)
+
+def write_features(frames, output_file):
+    """
+    Writes the features to a binary feature file when output_file has the
+    FEATURE_FILE_EXT extension, to a CSV file otherwise.
+    """
+    if output_file.endswith(FEATURE_FILE_EXT):
+        write_feature_file(frames, output_file)
+    else:
+        write_csv(frames, output_file)
+
+def pcap_to_csv(pcap_file, csv_file, exclude_non_tcp=False, flows=False):
+    try:
+        frames = extract_features(pcap_file, exclude_non_tcp)
+        if flows:
+            # One row per flow instead of one row per packet.
+            frames = aggregate_flows(frames, FlowAggregator())
+        write_features(frames, csv_file)
 
         # Delete the pcap file after processing
         os.remove(pcap_file)
@@ -122,21 +354,44 @@ def pcap_to_csv(pcap_file, csv_file, exclude_non_tcp=False):
     except Exception as e:
         log_error(f"An error occurred while processing pcap file {pcap_file}: {e}")
 
+def convert_pcap(pcap_path, output_ext, flows=False):
+    """
+    Writes the features file of a pcap file next to it (pcap_to_csv deletes
+    the pcap file). Returns the path of the features file.
+    """
+    exclude_non_tcp = True
+    csv_path = os.path.splitext(pcap_path)[0] + ("_tcp_only" if exclude_non_tcp else "") + output_ext
+    pcap_to_csv(pcap_path, csv_path, exclude_non_tcp, flows)
+    log_message(f"Features file saved as {csv_path}")
+    return csv_path
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the pcap files of the spool directory to features files.")
+    # The features are handed to process_csv.py in the binary format, unless --csv is given.
+    parser.add_argument("--csv", action="store_true", help=f"write CSV files instead of {FEATURE_FILE_EXT} files")
+    parser.add_argument("--flows", action="store_true",
+                        help="write one row per flow instead of one row per packet")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="pcap files converted at a time, one per process (default 1)")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
     log_message("Processing pcap files...")
-    tmp_dir = '/tmp'
+    # Only complete captures have the .pcap name in the spool directory.
+    tmp_dir = SPOOL_DIR
+    output_ext = ".csv" if args.csv else FEATURE_FILE_EXT
+    flows = args.flows
+    workers = args.workers
     try:
         files = os.listdir(tmp_dir)
-        pcap_files = [f for f in files if f.endswith('.pcap') and os.path.isfile(os.path.join(tmp_dir, f))]
-        
-        for pcap_file in pcap_files:
-            pcap_path = os.path.join(tmp_dir, pcap_file)
-            exclude_non_tcp = True
-            csv_file = os.path.splitext(pcap_file)[0] + ("_tcp_only.csv" if exclude_non_tcp else ".csv")
-            csv_path = os.path.join(tmp_dir, csv_file)
-            pcap_to_csv(pcap_path, csv_path, exclude_non_tcp)
-            log_message(f"CSV file saved as {csv_path}")
-            os.remove(pcap_file)
-            log_message(f"Deleted pcap file: {pcap_file}")
+        pcap_paths = [os.path.join(tmp_dir, f) for f in files
+                      if f.endswith('.pcap') and os.path.isfile(os.path.join(tmp_dir, f))]
+
+        if workers > 1:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+                list(pool.map(convert_pcap, pcap_paths, [output_ext] * len(pcap_paths), [flows] * len(pcap_paths)))
+        else:
+            for pcap_path in pcap_paths:
+                convert_pcap(pcap_path, output_ext, flows)
     except Exception as e:
-        log_error(f"An error occurred: {e}")
\ No newline at end of file
+        log_error(f"An error occurred: {e}")
@@ -0,0 +1,299 @@
+import mmap
+import struct
+import sys
+import numpy as np
+
+# pcap magic numbers, as read with little-endian byte order.
+PCAP_MAGIC = {
+    0xa1b2c3d4: ("<", 10**6),
+    0xd4c3b2a1: (">", 10**6),
+    0xa1b23c4d: ("<", 10**9),
+    0x4d3cb2a1: (">", 10**9),
+}
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86dd
+ETH_P_8021Q = 0x8100
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+def read_pcap_header(buf):
+    """
+    Parses the global header of a pcap file.
+    Returns (endian, timestamp resolution, linktype).
+    Raises ValueError for pcapng files and unsupported link types.
+    """
+    if len(buf) < 24:
+        raise ValueError("file too short for a pcap header")
+    magic = struct.unpack_from("<I", buf, 0)[0]
+    if magic not in PCAP_MAGIC:
+        raise ValueError(f"not a pcap file (magic {magic:#010x})")
+    endian, resolution = PCAP_MAGIC[magic]
+    linktype = struct.unpack_from(endian + "I", buf, 20)[0] & 0x0fffffff
+    if linktype not in (LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL):
+        raise ValueError(f"unsupported link type {linktype}")
+    return endian, resolution, linktype
+
+def iter_records(buf, endian, chunk_size):
+    """
+    Walks the pcap record headers and yields, for every chunk of at most
+    chunk_size packets, the arrays (data offset, captured length, seconds, fraction).
+    Only the 16-byte record headers are touched here, packet data is left in the map.
+    """
+    record = struct.Struct(endian + "IIII")
+    pos = 24
+    end = len(buf)
+    while pos + 16 <= end:
+        offsets, caplens, secs, fracs = [], [], [], []
+        while pos + 16 <= end and len(offsets) < chunk_size:
+            sec, frac, caplen, _ = record.unpack_from(buf, pos)
+            pos += 16
+            if pos + caplen > end:
+                # Truncated last record, as written by a capture still in progress.
+                pos = end
+                break
+            offsets.append(pos)
+            caplens.append(caplen)
+            secs.append(sec)
+            fracs.append(frac)
+            pos += caplen
+        if offsets:
+            yield (np.array(offsets, dtype=np.int64), np.array(caplens, dtype=np.int64),
+                   np.array(secs, dtype=np.int64), np.array(fracs, dtype=np.int64))
+
+class PacketBytes:
+    """
+    Bounds-checked vectorized reads of big-endian header fields.
+    Every read returns (values, valid) where valid is False for the packets
+    whose captured data does not contain the whole field.
+    """
+
+    def __init__(self, data, end):
+        self.data = data
+        self.end = end
+
+    def u8(self, pos):
+        valid = pos + 1 <= self.end
+        return self.data[np.where(valid, pos, 0)].astype(np.int64), valid
+
+    def u16(self, pos):
+        valid = pos + 2 <= self.end
+        pos = np.where(valid, pos, 0)
+        return (self.data[pos].astype(np.int64) << 8) | self.data[pos + 1], valid
+
+    def u32(self, pos):
+        valid = pos + 4 <= self.end
+        pos = np.where(valid, pos, 0)
+        value = np.zeros(len(pos), dtype=np.int64)
+        for i in range(4):
+            value = (value << 8) | self.data[pos + i]
+        return value, valid
+
+def header_fields(data, offsets, caplens, linktype):
+    """
+    Locates the IPv4/IPv6 and TCP headers of every packet and reads the fields
+    used by the features. Returns a dict of arrays with a validity mask per field.
+    """
+    end = offsets + caplens
+    packet = PacketBytes(data, end)
+    n = len(offsets)
+
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype, _ = packet.u16(offsets + 12)
+        l3 = offsets + 14
+        # A single 802.1Q tag is skipped.
+        vlan = ethertype == ETH_P_8021Q
+        inner, _ = packet.u16(offsets + 16)
+        ethertype = np.where(vlan, inner, ethertype)
+        l3 = np.where(vlan, l3 + 4, l3)
+        has_l2 = caplens >= 14
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype, _ = packet.u16(offsets + 14)
+        l3 = offsets + 16
+        has_l2 = caplens >= 16
+    else:
+        version, _ = packet.u8(offsets)
+        version >>= 4
+        ethertype = np.where(version == 4, ETH_P_IP, np.where(version == 6, ETH_P_IPV6, 0))
+        l3 = offsets
+        has_l2 = np.ones(n, dtype=bool)
+
+    version_ihl, _ = packet.u8(l3)
+    is_ipv4 = has_l2 & (ethertype == ETH_P_IP) & (l3 + 20 <= end) & (version_ihl >> 4 == 4)
+    is_ipv6 = has_l2 & (ethertype == ETH_P_IPV6) & (l3 + 40 <= end)
+
+    ttl, _ = packet.u8(l3 + 8)
+    proto, _ = packet.u8(l3 + 9)
+    fragment, _ = packet.u16(l3 + 6)
+    src, _ = packet.u32(l3 + 12)
+    dst, _ = packet.u32(l3 + 16)
+    next_header, _ = packet.u8(l3 + 6)
+
+    # TCP is only dissected in the first fragment of an IPv4 datagram.
+    first_fragment = (fragment & 0x1fff) == 0
+    ipv4_tcp = is_ipv4 & (proto == IPPROTO_TCP) & first_fragment
+    ipv6_tcp = is_ipv6 & (next_header == IPPROTO_TCP)
+    l4 = np.where(is_ipv4, l3 + (version_ihl & 0x0f) * 4, l3 + 40)
+    is_tcp = (ipv4_tcp | ipv6_tcp) & (l4 + 20 <= end)
+    is_udp = (((is_ipv4 & (proto == IPPROTO_UDP) & first_fragment) | (is_ipv6 & (next_header == IPPROTO_UDP)))
+              & (l4 + 8 <= end))
+
+    seq, _ = packet.u32(l4 + 4)
+    ack, _ = packet.u32(l4 + 8)
+    window, _ = packet.u16(l4 + 14)
+    sport, _ = packet.u16(l4)
+    dport, _ = packet.u16(l4 + 2)
+
+    return {
+        "is_ipv4": is_ipv4,
+        "is_tcp": is_tcp,
+        "is_udp": is_udp,
+        "ttl": ttl,
+        "proto": proto,
+        "src": src,
+        "dst": dst,
+        "sport": sport,
+        "dport": dport,
+        "seq": seq,
+        "ack": ack,
+        "window": window,
+    }
+
+def format_ips(src):
+    """
+    Converts IPv4 addresses stored as integers to dotted strings.
+    Each distinct address is formatted once.
+    """
+    unique, inverse = np.unique(src, return_inverse=True)
+    text = np.array([f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}" for ip in unique.tolist()],
+                    dtype=object)
+    return text[inverse]
+
+def packet_columns(fields, caplens, secs, fracs, resolution):
+    """
+    Computes the feature columns with the same arithmetic as
+    process_pcap.packet_features, and the packet_key columns.
+    Missing values are NaN (or None for the addresses).
+    """
+    n = len(caplens)
+    nan = np.full(n, np.nan)
+    is_ipv4 = fields["is_ipv4"]
+    is_tcp = fields["is_tcp"]
+
+    # Exact for microsecond captures: the integer division is correctly rounded,
+    # like float() of scapy's Decimal timestamp.
+    dur = (secs * resolution + fracs) / resolution
+    sbytes = caplens.astype(np.float64)
+    sttl = np.where(is_ipv4, fields["ttl"], nan)
+    swin = np.where(is_tcp, fields["window"], nan)
+    stcpb = np.where(is_tcp, fields["seq"], nan)
+    dtcpb = np.where(is_tcp, fields["ack"], nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        nonzero = dur != 0
+        rate = np.where(nonzero, sbytes / dur, nan)
+        pps = np.where(nonzero, 1 / dur, nan)
+        ttl_ratio = np.where(nonzero, sttl / dur, nan)
+
+    source_ip = np.full(n, None, dtype=object)
+    dst_ip = np.full(n, None, dtype=object)
+    if is_ipv4.any():
+        source_ip[is_ipv4] = format_ips(fields["src"][is_ipv4])
+        dst_ip[is_ipv4] = format_ips(fields["dst"][is_ipv4])
+    has_ports = is_tcp | fields["is_udp"]
+
+    return {
+        "source_ip": source_ip,
+        "dur": dur,
+        "spkts": np.ones(n),
+        "sbytes": sbytes,
+        "sttl": sttl,
+        "swin": swin,
+        "stcpb": stcpb,
+        "dtcpb": dtcpb,
+        "rate": rate,
+        "pps": pps,
+        "bpp": sbytes / 1,
+        "ttl_ratio": ttl_ratio,
+        "tcp_diff": dtcpb - stcpb,
+        "swin_interaction": swin * stcpb,
+        "dst_ip": dst_ip,
+        "sport": np.where(has_ports, fields["sport"], nan),
+        "dport": np.where(has_ports, fields["dport"], nan),
+        "proto": np.where(is_ipv4, fields["proto"], nan),
+        "is_tcp": is_tcp,
+    }
+
+def iter_columns(pcap_file, chunk_size):
+    """
+    Reads a pcap file through a memory map, without scapy dissection, and yields
+    the feature columns of every chunk of at most chunk_size packets.
+    The "id" column is left to the caller, together with the TCP filtering
+    (the "is_tcp" column).
+    """
+    with open(pcap_file, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            endian, resolution, linktype = read_pcap_header(buf)
+            data = np.frombuffer(buf, dtype=np.uint8)
+            try:
+                for offsets, caplens, secs, fracs in iter_records(buf, endian, chunk_size):
+                    fields = header_fields(data, offsets, caplens, linktype)
+                    yield packet_columns(fields, caplens, secs, fracs, resolution)
+            finally:
+                # The map cannot be closed while NumPy still references it.
+                del data
+
+def iter_packets(pcap_file, chunk_size=10000):
+    """
+    Yields (timestamp, frame) for every packet of an Ethernet pcap file, for
+    the sources that hand frames to windowing.WindowBuffer.
+    Raises ValueError for other link types.
+    """
+    with open(pcap_file, "rb") as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            endian, resolution, linktype = read_pcap_header(buf)
+            if linktype != LINKTYPE_ETHERNET:
+                raise ValueError(f"link type {linktype} is not Ethernet")
+            for offsets, caplens, secs, fracs in iter_records(buf, endian, chunk_size):
+                for offset, caplen, sec, frac in zip(offsets.tolist(), caplens.tolist(), secs.tolist(), fracs.tolist()):
+                    yield sec + frac / resolution, buf[offset:offset + caplen]
+
+def packets_columns(packets, timestamps, linktype=LINKTYPE_ETHERNET):
+    """
+    Same as iter_columns, for a batch of packets captured live: packets is a
+    list of frames (bytes) and timestamps their capture times in seconds,
+    kept with microsecond precision as in a pcap file.
+    """
+    caplens = np.fromiter((len(packet) for packet in packets), dtype=np.int64, count=len(packets))
+    offsets = np.zeros(len(packets), dtype=np.int64)
+    np.cumsum(caplens[:-1], out=offsets[1:])
+    data = np.frombuffer(b"".join(packets), dtype=np.uint8)
+    micros = np.round(np.asarray(timestamps, dtype=np.float64) * 10**6).astype(np.int64)
+    fields = header_fields(data, offsets, caplens, linktype)
+    return packet_columns(fields, caplens, micros // 10**6, micros % 10**6, 10**6)
+
+if __name__ == "__main__":
+    # Validation: python3 raw_pcap.py <pcap_file> compares both extraction backends.
+    import process_pcap
+    import pandas as pd
+
+    if len(sys.argv) != 2:
+        print("Usage: python3 raw_pcap.py <pcap_file>")
+        sys.exit(1)
+    for exclude_non_tcp in (True, False):
+        scapy_frame = pd.concat(process_pcap.extract_features(sys.argv[1], exclude_non_tcp, backend="scapy"))
+        raw_frame = pd.concat(process_pcap.extract_features(sys.argv[1], exclude_non_tcp, backend="raw"))
+        try:
+            pd.testing.assert_frame_equal(scapy_frame.reset_index(drop=True), raw_frame.reset_index(drop=True))
+            print(f"exclude_non_tcp={exclude_non_tcp}: {len(raw_frame)} rows, identical")
+        except AssertionError as e:
+            print(f"exclude_non_tcp={exclude_non_tcp}: outputs differ\n{e}")
+            sys.exit(1)
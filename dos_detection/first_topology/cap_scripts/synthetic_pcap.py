@@ -0,0 +1,214 @@
+import heapq
+import random
+import struct
+import sys
+
+# Synthetic captures for benchmark.py: the benign traffic of simulator.py
+# and the SYN floods of attack_launcher.py, written without a network.
+
+WEB_SERVERS = ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+DNS_SERVER = "10.0.0.10"
+CLIENTS = ["10.0.0.5", "10.0.0.6", "10.0.0.7"]
+# attack_launcher.py is run on r1.
+ATTACKER = "10.0.0.5"
+
+# Benign sessions (HTTP request, ping or nslookup) started per second.
+SESSION_RATE = 50
+# Seconds of benign traffic before the first flood.
+ATTACK_START = 2.0
+# Frames are cut at the MTU, as the kernel fragments the larger hping3 packets.
+MTU = 1500
+
+TCP_FIN, TCP_SYN, TCP_PSH, TCP_ACK, TCP_URG = 0x01, 0x02, 0x08, 0x10, 0x20
+PROTO_ICMP, PROTO_TCP, PROTO_UDP = 1, 6, 17
+
+def mac_address(ip):
+    # Mininet autoSetMacs: the MAC address of a host is its host number.
+    return int(ip.split(".")[-1]).to_bytes(6, "big")
+
+def ip_checksum(header):
+    total = sum(struct.unpack(f"!{len(header) // 2}H", header))
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def ipv4_frame(src, dst, proto, payload, ttl=64, ip_id=0):
+    """
+    Returns an Ethernet frame carrying an IPv4 packet, cut at the MTU.
+    """
+    payload = payload[:MTU - 20]
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), ip_id, 0x4000, ttl, proto, 0,
+                         bytes(map(int, src.split("."))), bytes(map(int, dst.split("."))))
+    header = header[:10] + struct.pack("!H", ip_checksum(header)) + header[12:]
+    return mac_address(dst) + mac_address(src) + b"\x08\x00" + header + payload
+
+def tcp_frame(src, dst, sport, dport, seq, ack, flags, window, data=b"", ttl=64):
+    segment = struct.pack("!HHIIBBHHH", sport, dport, seq, ack, 5 << 4, flags, window, 0, 0) + data
+    return ipv4_frame(src, dst, PROTO_TCP, segment, ttl, seq & 0xFFFF)
+
+def http_session(rng, now, client, server):
+    """
+    Returns the (time, frame) of an HTTP request of simulator.py: handshake,
+    request, response and teardown.
+    """
+    sport = rng.randint(32768, 60999)
+    cseq, sseq = rng.getrandbits(32), rng.getrandbits(32)
+    rtt = rng.uniform(0.0002, 0.002)
+    method = rng.choice(["GET", "POST", "HEAD", "PUT", "PATCH", "OPTIONS", "DELETE"])
+    request = f"{method} /?q=data{rng.randint(1, 3)} HTTP/1.1\r\nHost: {server}\r\n\r\n".encode()
+    response = b"HTTP/1.0 200 OK\r\n\r\n" + b"x" * rng.randint(100, 3000)
+    packets = [
+        (client, server, sport, 80, cseq, 0, TCP_SYN, 64240, b""),
+        (server, client, 80, sport, sseq, cseq + 1, TCP_SYN | TCP_ACK, 65160, b""),
+        (client, server, sport, 80, cseq + 1, sseq + 1, TCP_ACK, 502, b""),
+        (client, server, sport, 80, cseq + 1, sseq + 1, TCP_PSH | TCP_ACK, 502, request),
+    ]
+    sent = 0
+    while sent < len(response):
+        data = response[sent:sent + MTU - 40]
+        packets.append((server, client, 80, sport, sseq + 1 + sent, cseq + 1 + len(request), TCP_PSH | TCP_ACK,
+                        509, data))
+        sent += len(data)
+    end = cseq + 1 + len(request)
+    packets += [
+        (client, server, sport, 80, end, sseq + 1 + sent, TCP_ACK, 501, b""),
+        (server, client, 80, sport, sseq + 1 + sent, end, TCP_FIN | TCP_ACK, 509, b""),
+        (client, server, sport, 80, end, sseq + 2 + sent, TCP_FIN | TCP_ACK, 501, b""),
+        (server, client, 80, sport, sseq + 2 + sent, end + 1, TCP_ACK, 509, b""),
+    ]
+    return [(now + i * rtt / 2, tcp_frame(*packet)) for i, packet in enumerate(packets)]
+
+def ping_session(rng, now, client, server):
+    """
+    Returns the echo requests and replies of "ping -c 1..3 -s 32..1024".
+    """
+    ident = rng.getrandbits(16)
+    data = bytes(rng.randint(32, 1024))
+    frames = []
+    for seq in range(1, rng.randint(1, 3) + 1):
+        for src, dst, icmp_type, at in ((client, server, 8, now), (server, client, 0, now + 0.0005)):
+            message = struct.pack("!BBHHH", icmp_type, 0, 0, ident, seq) + data
+            checksum = ip_checksum(message + b"\x00" * (len(message) % 2))
+            message = message[:2] + struct.pack("!H", checksum) + message[4:]
+            frames.append((at, ipv4_frame(src, dst, PROTO_ICMP, message, ip_id=seq)))
+        now += 1.0
+    return frames
+
+def dns_session(rng, now, client, server):
+    """
+    Returns the query and the answer of an nslookup to the DNS server.
+    """
+    sport = rng.randint(32768, 60999)
+    name = b"".join(bytes([len(label)]) + label
+                    for label in rng.choice([b"portal1.com", b"portal2.com", b"portal3.local"]).split(b"."))
+    question = struct.pack("!HHHHHH", rng.getrandbits(16), 0x0100, 1, 0, 0, 0) + name + b"\x00\x00\x01\x00\x01"
+    record = b"\xc0\x0c" + struct.pack("!HHIH", 1, 1, 300, 4) + bytes(map(int, server.split(".")))
+    answer = question[:2] + b"\x81\x80" + question[4:6] + b"\x00\x01" + question[8:] + record
+    query = struct.pack("!HHHH", sport, 53, 8 + len(question), 0) + question
+    reply = struct.pack("!HHHH", 53, sport, 8 + len(answer), 0) + answer
+    return [(now, ipv4_frame(client, server, PROTO_UDP, query)),
+            (now + 0.0003, ipv4_frame(server, client, PROTO_UDP, reply))]
+
+def benign_traffic(rng, packets, session_rate=SESSION_RATE):
+    """
+    Yields (time, frame) for about packets packets of the simulator.py mix, in
+    time order: sessions start at random (Poisson) times, each one a random
+    HTTP request, ping or nslookup from a random client.
+    """
+    pending = []
+    now = 0.0
+    count = 0
+    while count < packets:
+        now += rng.expovariate(session_rate)
+        # Frames of earlier sessions that come before this one.
+        while pending and pending[0][0] <= now:
+            yield heapq.heappop(pending)
+        kind = rng.choice(["http", "ping", "nslookup"])
+        client = rng.choice(CLIENTS)
+        if kind == "http":
+            session = http_session(rng, now, client, rng.choice(WEB_SERVERS))
+        elif kind == "ping":
+            session = ping_session(rng, now, client, rng.choice(WEB_SERVERS + [DNS_SERVER]))
+        else:
+            session = dns_session(rng, now, client, DNS_SERVER)
+        for frame in session[:packets - count]:
+            heapq.heappush(pending, frame)
+        count += len(session)
+    while pending:
+        yield heapq.heappop(pending)
+
+def syn_flood(rng, packets, start=ATTACK_START, attacker=ATTACKER):
+    """
+    Yields (time, frame) for packets packets of the floods of attack_launcher.py:
+    launches of "hping3 -S -U -d 0..5000 -c 1..200 -i u100 -w 8..15" at a
+    random web server, 0.1 seconds apart.
+    """
+    now = start
+    count = 0
+    while count < packets:
+        target = rng.choice(WEB_SERVERS)
+        for _ in range(rng.randint(2, 20)):
+            size = rng.randint(0, 5000)
+            window = rng.randint(8, 15)
+            # hping3 increments the source port from a random base; the destination port is 0.
+            sport = rng.randint(1024, 60000)
+            for i in range(min(rng.randint(1, 200), packets - count)):
+                yield now, tcp_frame(attacker, target, sport + i, 0, rng.getrandbits(32), 0, TCP_SYN | TCP_URG,
+                                     window, bytes(size))
+                now += 0.0001
+                count += 1
+            now += 0.1
+            if count >= packets:
+                return
+
+def write_pcap(pcap_file, packets):
+    """
+    Writes (time, frame) pairs to a pcap file (microsecond timestamps, Ethernet).
+    Returns the number of packets written.
+    """
+    count = 0
+    with open(pcap_file, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for timestamp, frame in packets:
+            seconds = int(timestamp)
+            f.write(struct.pack("<IIII", seconds, int((timestamp - seconds) * 1e6), len(frame), len(frame)))
+            f.write(frame)
+            count += 1
+    return count
+
+def generate(pcap_file, packets, attack_fraction=0.3, seed=1, start_time=1_700_000_000.0):
+    """
+    Writes a capture of packets packets, of which attack_fraction are SYN
+    flood packets from ATTACKER, the others benign traffic.
+    Returns a description of the capture, with the time of its first attack packet.
+    """
+    rng = random.Random(seed)
+    attack_packets = int(packets * attack_fraction)
+    benign = benign_traffic(rng, packets - attack_packets)
+    attack = syn_flood(rng, attack_packets)
+    frames = ((start_time + t, frame) for t, frame in heapq.merge(benign, attack, key=lambda packet: packet[0]))
+    info = {"packets": 0, "benign_packets": packets - attack_packets, "attack_packets": attack_packets,
+            "attacker": ATTACKER, "first_attack_index": None}
+
+    attacker = bytes(map(int, ATTACKER.split(".")))
+
+    def numbered(frames):
+        for index, (timestamp, frame) in enumerate(frames):
+            # The floods are the only TCP packets of the attacker with the URG flag.
+            if info["first_attack_index"] is None and frame[26:30] == attacker and frame[23] == PROTO_TCP:
+                if frame[47] & TCP_URG:
+                    info["first_attack_index"] = index
+            yield timestamp, frame
+
+    info["packets"] = write_pcap(pcap_file, numbered(frames))
+    return info
+
+if __name__ == "__main__":
+    # python3 synthetic_pcap.py <pcap_file> [packets] [attack fraction] [seed]
+    if len(sys.argv) < 2:
+        print("Usage: python3 synthetic_pcap.py <pcap_file> [packets] [attack fraction] [seed]")
+        sys.exit(1)
+    packets = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    attack_fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    print(generate(sys.argv[1], packets, attack_fraction, seed))
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import cap_main
+import log_writer
+from synthetic_pcap import TCP_ACK, TCP_SYN, tcp_frame
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+class DetectionServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.script_dir = tempfile.TemporaryDirectory()
+        log_writer.configure(self.script_dir.name, "ERROR")
+        # The service reads the models of its folder, and writes its checkpoint there.
+        for name in ("forest_model.json", "trained_model.joblib", "scaler_params.json"):
+            os.symlink(os.path.join(SCRIPT_DIR, name), os.path.join(self.script_dir.name, name))
+
+    def tearDown(self):
+        log_writer.shutdown()
+        self.script_dir.cleanup()
+
+    def service(self, **options):
+        return cap_main.DetectionService(self.script_dir.name, cap_main.ServiceConfig(**{"backend": "raw", **options}))
+
+    def test_open_flows_classified_at_shutdown(self):
+        service = self.service(flows=True)
+        windows = service.start_windows()
+        # A single flow, still open (no idle or active timeout) when the buffer is closed.
+        for i in range(50):
+            flags = TCP_SYN if i == 0 else TCP_ACK
+            frame = tcp_frame("10.0.0.5", "10.0.0.1", 40000, 80, 1000 + i, 0, flags, 502)
+            service.buffer.put("capture.pcap", 1_700_000_000.0 + i * 0.01, frame)
+        service.buffer.flush()
+        service.buffer.close()
+        windows.join(timeout=30)
+        self.assertFalse(windows.is_alive())
+        self.assertEqual(service.stats.counters["rows_classified"], 1)
+        self.assertEqual(service.aggregator.flows, {})
+
+    def test_flow_counts_its_packets(self):
+        service = self.service(flows=True, model="joblib")
+        windows = service.start_windows()
+        # One malicious flow of 50 packets is over the threshold, like 50 malicious packets.
+        for i in range(50):
+            frame = tcp_frame("10.0.0.5", "10.0.0.1", 40000, 80, 1_000_000 + i, 0, TCP_SYN, 10)
+            service.buffer.put("capture.pcap", 1_700_000_000.0 + i * 0.01, frame)
+        service.buffer.flush()
+        service.buffer.close()
+        windows.join(timeout=30)
+        self.assertEqual(service.stats.counters["malicious_rows"], 1)
+        self.assertEqual(service.stats.counters["alerts"], 1)
+
+    def test_empty_window_refused(self):
+        with self.assertRaises(ValueError):
+            self.service(window_packets=0)
+        with self.assertRaises(ValueError):
+            self.service(window_delay=-1)
+
+    def test_raw_backend_without_pool(self):
+        self.assertIsNone(self.service(workers=2).pool)
+
+    def test_broken_pool_stops_detection(self):
+        service = self.service(backend="scapy", workers=2)
+        # A pool that was shut down refuses every window.
+        service.pool.shutdown()
+        windows = service.start_windows()
+        service.buffer.put("capture.pcap", 1_700_000_000.0, tcp_frame("10.0.0.5", "10.0.0.1", 40000, 80, 1, 0,
+                                                                     TCP_SYN, 0))
+        service.buffer.flush()
+        windows.join(timeout=30)
+        self.assertFalse(windows.is_alive())
+        self.assertIsInstance(service.error, RuntimeError)
+        self.assertTrue(service.buffer.closed)
+
+if __name__ == "__main__":
+    unittest.main()
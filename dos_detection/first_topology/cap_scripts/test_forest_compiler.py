@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import forest_compiler
+import process_csv
+from model_registry import scaler_arrays
+from test_forest_engine import SCRIPT_DIR, leaf, threshold_rows
+
+class CompiledForestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(SCRIPT_DIR, "forest_model.json"), 'r') as f:
+            self.forest = json.load(f)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def compile(self, forest):
+        return forest_compiler.compile_forest(forest, self.cache_dir.name)
+
+    def assert_same_predictions(self, forest, X):
+        expected = np.array([process_csv.predict_forest(forest, row) for row in X])
+        np.testing.assert_array_equal(self.compile(forest).predict(X), expected)
+
+    def test_model_at_thresholds(self):
+        self.assert_same_predictions(self.forest, threshold_rows(self.forest, len(process_csv.FEATURES)))
+
+    def test_ties_go_to_the_first_vote(self):
+        X = np.zeros((1, 1))
+        self.assert_same_predictions([leaf([0, 1]), leaf([1, 0])], X)
+        self.assert_same_predictions([leaf([1, 0]), leaf([0, 1])], X)
+
+    def test_cache(self):
+        module = self.compile(self.forest)
+        self.assertEqual(self.compile(self.forest).MODEL_HASH, module.MODEL_HASH)
+        # One module per model, and no temporary file left behind.
+        self.assertEqual(os.listdir(self.cache_dir.name), [f"forest_{module.MODEL_HASH}.py"])
+
+    def test_random_forest_refused(self):
+        import joblib
+        from sklearn.ensemble import RandomForestClassifier
+        X = np.arange(20, dtype=np.float64).reshape(10, 2)
+        model_file = os.path.join(self.cache_dir.name, "forest.joblib")
+        joblib.dump(RandomForestClassifier(n_estimators=3, random_state=0).fit(X, np.arange(10) % 2), model_file)
+        with self.assertRaises(ValueError):
+            forest_compiler.load_compiled_forest(model_file, self.cache_dir.name)
+
+class FoldedForestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(SCRIPT_DIR, "forest_model.json"), 'r') as f:
+            self.forest = json.load(f)
+        with open(os.path.join(SCRIPT_DIR, "scaler_params.json"), 'r') as f:
+            self.mean, self.scale = scaler_arrays(json.load(f), process_csv.FEATURES)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def raw_rows(self, forest, float32=False):
+        # Raw values at the folded thresholds and one float on each side of them.
+        folded = forest_compiler.fold_scaler(forest, self.mean, self.scale, float32)
+        return threshold_rows(folded, len(process_csv.FEATURES))
+
+    def test_json_forest(self):
+        X = self.raw_rows(self.forest)
+        expected = np.array([process_csv.predict_forest(self.forest, row) for row in (X - self.mean) / self.scale])
+        folded = forest_compiler.compile_folded(self.forest, self.mean, self.scale, self.cache_dir.name)
+        np.testing.assert_array_equal(folded.predict(X), expected)
+
+    def test_joblib_tree(self):
+        import joblib
+        model = joblib.load(os.path.join(SCRIPT_DIR, "trained_model.joblib"))
+        X = self.raw_rows(forest_compiler.forest_from_estimator(model), float32=True)
+        # scikit-learn refuses missing and infinite values.
+        X = np.where(np.isfinite(X), X, 0.0)
+        folded = forest_compiler.compile_folded(model, self.mean, self.scale, self.cache_dir.name)
+        np.testing.assert_array_equal(folded.predict(X), model.predict((X - self.mean) / self.scale))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import json
+import os
+import unittest
+
+import numpy as np
+
+import process_csv
+from forest_engine import LEAF, ArrayForest
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+def threshold_rows(forest, n_features, seed=0):
+    """
+    Returns rows whose values sit on every threshold of the forest, one float
+    below and one float above it, with some NaN, so every split is tested at its edge.
+    """
+    rng = np.random.default_rng(seed)
+    splits = [(feature, threshold) for tree in forest
+              for feature, threshold in zip(tree["feature"], tree["threshold"]) if feature != LEAF]
+    values = np.array([threshold for _, threshold in splits])
+    rows = []
+    for feature, threshold in splits:
+        for value in (np.nextafter(threshold, -np.inf), threshold, np.nextafter(threshold, np.inf)):
+            row = rng.choice(values, n_features)
+            row[feature] = value
+            rows.append(row)
+    X = np.array(rows)
+    X[rng.random(X.shape) < 0.05] = np.nan
+    return X
+
+def leaf(values):
+    return {"feature": [LEAF], "threshold": [-2.0], "children_left": [-1], "children_right": [-1],
+            "values": [values]}
+
+class ArrayForestTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(SCRIPT_DIR, "forest_model.json"), 'r') as f:
+            self.forest = json.load(f)
+
+    def assert_same_predictions(self, forest, X):
+        expected = np.array([process_csv.predict_forest(forest, row) for row in X])
+        np.testing.assert_array_equal(ArrayForest.from_json(forest).predict(X), expected)
+
+    def test_model_at_thresholds(self):
+        self.assert_same_predictions(self.forest, threshold_rows(self.forest, len(process_csv.FEATURES)))
+
+    def test_ties_go_to_the_first_vote(self):
+        X = np.zeros((1, 1))
+        self.assert_same_predictions([leaf([0, 1]), leaf([1, 0])], X)
+        self.assert_same_predictions([leaf([1, 0]), leaf([0, 1])], X)
+
+    def test_no_rows(self):
+        predictions = ArrayForest.from_json(self.forest).predict(np.empty((0, len(process_csv.FEATURES))))
+        self.assertEqual(len(predictions), 0)
+
+if __name__ == "__main__":
+    unittest.main()
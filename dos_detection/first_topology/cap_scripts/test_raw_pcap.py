@@ -0,0 +1,77 @@
+import os
+import struct
+import tempfile
+import unittest
+
+import pandas as pd
+
+import log_writer
+import process_pcap
+import raw_pcap
+import synthetic_pcap
+from synthetic_pcap import PROTO_TCP, TCP_ACK, TCP_SYN, ip_checksum, mac_address, tcp_frame
+
+def tcp_segment(sport=40000, dport=80, seq=1000, ack=0, flags=TCP_SYN, window=502, data=b""):
+    return struct.pack("!HHIIBBHHH", sport, dport, seq, ack, 5 << 4, flags, window, 0, 0) + data
+
+def ipv4_header(src, dst, proto, payload_length, options=b"", flags_fragment=0x4000, ttl=64):
+    ihl = 5 + len(options) // 4
+    header = struct.pack("!BBHHHBBH4s4s", 0x40 | ihl, 0, ihl * 4 + payload_length, 7, flags_fragment, ttl, proto,
+                         0, bytes(map(int, src.split("."))), bytes(map(int, dst.split(".")))) + options
+    return header[:10] + struct.pack("!H", ip_checksum(header)) + header[12:]
+
+def ethernet(src, dst, ethertype):
+    return mac_address(dst) + mac_address(src) + struct.pack("!H", ethertype)
+
+def edge_frames():
+    """
+    Frames the raw parser must read like scapy: 802.1Q, IPv6, IPv4 options,
+    fragments and a truncated TCP header.
+    """
+    src, dst = "10.0.0.6", "10.0.0.1"
+    plain = tcp_frame(src, dst, 40000, 80, 1, 0, TCP_SYN, 502)
+    vlan = plain[:12] + b"\x81\x00\x00\x0a" + plain[12:]
+    segment = tcp_segment(data=b"x" * 10)
+    ipv6 = (ethernet(src, dst, 0x86dd)
+            + struct.pack("!IHBB16s16s", 6 << 28, len(segment), PROTO_TCP, 57, b"\xfe\x80" + b"\x00" * 13 + b"\x06",
+                          b"\xfe\x80" + b"\x00" * 13 + b"\x01")
+            + segment)
+    options = ethernet(src, dst, 0x0800) + ipv4_header(src, dst, PROTO_TCP, len(segment), b"\x01\x01\x01\x00") + segment
+    payload = tcp_segment(flags=TCP_ACK, data=b"y" * 40)
+    # More fragments flag on the first fragment, offset 24 bytes (3 units) on the second.
+    first = ethernet(src, dst, 0x0800) + ipv4_header(src, dst, PROTO_TCP, 24, flags_fragment=0x2000) + payload[:24]
+    second = ethernet(src, dst, 0x0800) + ipv4_header(src, dst, PROTO_TCP, len(payload) - 24,
+                                                      flags_fragment=3) + payload[24:]
+    truncated = plain[:14 + 20 + 10]
+    return [vlan, ipv6, options, first, second, truncated]
+
+class RawParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        log_writer.configure(self.tmp.name, "ERROR")
+        synthetic = os.path.join(self.tmp.name, "synthetic.pcap")
+        # Benign HTTP, ping and DNS sessions with a SYN flood.
+        synthetic_pcap.generate(synthetic, 400)
+        packets = list(raw_pcap.iter_packets(synthetic))
+        start = packets[-1][0]
+        packets += [(start + (i + 1) * 0.001, frame) for i, frame in enumerate(edge_frames())]
+        self.pcap_file = os.path.join(self.tmp.name, "capture.pcap")
+        synthetic_pcap.write_pcap(self.pcap_file, packets)
+
+    def tearDown(self):
+        log_writer.shutdown()
+        self.tmp.cleanup()
+
+    def features(self, backend, exclude_non_tcp):
+        frames = process_pcap.extract_features(self.pcap_file, exclude_non_tcp, chunk_size=100, backend=backend)
+        return pd.concat(frames, ignore_index=True)
+
+    def test_same_features_as_scapy(self):
+        for exclude_non_tcp in (False, True):
+            with self.subTest(exclude_non_tcp=exclude_non_tcp):
+                pd.testing.assert_frame_equal(self.features("raw", exclude_non_tcp),
+                                              self.features("scapy", exclude_non_tcp))
+
+if __name__ == "__main__":
+    unittest.main()
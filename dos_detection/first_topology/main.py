@@ -6,6 +6,7 @@ from mininet.node import OVSKernelSwitch, RemoteController
 from mininet.cli import CLI
 from mininet.link import TCLink
 import subprocess
+import sys
 import time
 from datetime import datetime
 
@@ -90,18 +91,27 @@ if __name__=="__main__":
     for i in range(20):
         net.get('r1').cmd("python3 simulator.py &")
 
-    # Start PCAP capture loop in the background
-    print("Starting rotating PCAP capture on s1-eth4...")
-    net.get('s1').cmd("""
-        while true; do 
-            timestamp=$(date +%H%M%S)
-            sudo timeout 30 tcpdump -i s1-eth4 -w /tmp/capture_$timestamp.pcap &
-            wait
-        done &
-    """)
+    # With --live the cap host captures packets itself on cap-eth0 (connected to
+    # s1-eth4) and classifies them in sub-second micro-batches, without pcap files.
+    live = "--live" in sys.argv[1:]
+    if not live:
+        # Start PCAP capture loop in the background. Every capture is written as
+        # .pcap.part in the spool directory and renamed to .pcap once complete,
+        # so cap_main.py never reads a capture that tcpdump is still writing.
+        print("Starting rotating PCAP capture on s1-eth4...")
+        net.get('s1').cmd("""
+            mkdir -p /var/spool/dos_detection
+            while true; do 
+                timestamp=$(date +%H%M%S)
+                capture=/var/spool/dos_detection/capture_$timestamp.pcap
+                sudo timeout 30 tcpdump -i s1-eth4 -w $capture.part &
+                wait
+                mv $capture.part $capture
+            done &
+        """)
 
     print("Start monitoring the network for DoS attacks...")
-    net.get('cap').cmd("python3 cap_scripts/cap_main.py &")
+    net.get('cap').cmd("python3 cap_scripts/cap_main.py --mitigate" + (" --live" if live else "") + " &")
     time.sleep(0.2)
         
     CLI(net)
@@ -1,78 +1,700 @@
 import time
 import os
+import sys
+import argparse
+import functools
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import subprocess
 import pandas as pd
-from datetime import datetime
+
+import process_pcap
+import process_csv
+import flow_stats
+import process_csv_joblib
+import raw_pcap
+import log_writer
+from check_malicius_packets import SlidingWindowCounter, log_attack
+from heavy_hitters import HeavyHitterCounter
+from feature_file import FEATURE_FILE_EXT, iter_feature_file
+from flow_aggregator import FlowAggregator
+from mitigation import MitigationClient
+from sampling import make_sampler
+from spool import SPOOL_DIR, ReadyFiles
+from model_registry import ModelRegistry
+from live_capture import CAPTURE_INTERFACE, LiveCapture
+from tracing import STAGES, Tracer, wall_to_monotonic
+from metrics_endpoint import METRICS_HOST, METRICS_PORT, MetricsEndpoint, PipelineStats, render_metrics
+from windowing import OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_POLICIES, WINDOW_DELAY, WINDOW_PACKETS, WindowBuffer
 
 SCRIPT_NAME = "cap_main.py"
 
+# Seconds between two reports of the queue depths in the logs.
+METRICS_INTERVAL = 10
+
+# Seconds between two checks for a new snapshot of the controller statistics.
+FLOW_STATS_CHECK = 1
+
 def log_error(message):
-    with open('errors_logs.txt', 'a') as log_file:
-        log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
+    log_writer.log_error(SCRIPT_NAME, message)
 
 def log_message(message):
-    with open('logs.txt', 'a') as log_file:
-        log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
+    log_writer.log_message(SCRIPT_NAME, message)
+
+class ServiceConfig:
+    """
+    Options of the detection service, with the defaults of cap_main.py.
+    """
+
+    def __init__(self, **options):
+        self.exclude_non_tcp = True
+        # "binary" or "csv": hand the features off through a file in the watched directory.
+        self.handoff = None
+        self.backend = "scapy"
+        self.flows = False
+        self.mitigate = False
+        self.window_packets = WINDOW_PACKETS
+        self.window_delay = WINDOW_DELAY
+        self.overflow = OVERFLOW_BLOCK
+        self.model = "forest"
+        self.fold_scaler = False
+        self.workers = 1
+        # See sampling.make_sampler.
+        self.sample = None
+        self.counter = "exact"
+        self.trace_file = None
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise TypeError(f"Unknown detection service option: {name}")
+            setattr(self, name, value)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(handoff=args.handoff, flows=args.flows, mitigate=args.mitigate,
+                   # A live capture cannot wait for the detection, pcap files can.
+                   backend=args.backend or ("raw" if args.live else "scapy"),
+                   overflow=args.overflow or (OVERFLOW_DROP if args.live else OVERFLOW_BLOCK),
+                   window_packets=args.window_packets, window_delay=args.window_delay, model=args.model,
+                   fold_scaler=args.fold_scaler, workers=args.workers, sample=args.sample,
+                   counter=args.counter, trace_file=args.trace)
+
+class DetectionService:
+    """
+    Resident detection service: packets from pcap files or the live capture
+    are classified in windows (see windowing.py) by the model loaded at
+    startup, and the sources of the malicious packets are counted for the
+    alerts, which go to reporter(source_ip, count) (attack_log.txt by default).
+    """
+
+    def __init__(self, script_dir, config=None, reporter=log_attack):
+        config = config or ServiceConfig()
+        self.config = config
+        self.exclude_non_tcp = config.exclude_non_tcp
+        self.backend = config.backend
+        self.handoff = config.handoff
+        self.buffer = WindowBuffer(config.window_packets, config.window_delay, overflow=config.overflow)
+        # Windows and features files can be classified from different threads.
+        self.classify_lock = threading.Lock()
+        # Flows still open at the end of a capture continue in the next one.
+        self.aggregator = FlowAggregator() if config.flows else None
+        # Malicious packets per source over the last minute, kept in memory and
+        # checkpointed to disk instead of rewriting malicious_packets.csv.
+        # With counter="sketch" the counts are kept by a bounded-memory heavy-hitter sketch instead.
+        if config.counter == "sketch":
+            self.counter = HeavyHitterCounter(checkpoint_file=os.path.join(script_dir, "malicious_sketch.json"),
+                                              reporter=reporter)
+        else:
+            self.counter = SlidingWindowCounter(checkpoint_file=os.path.join(script_dir, "malicious_counts.json"),
+                                                reporter=reporter)
+        self.mitigation = MitigationClient() if config.mitigate else None
+        # The model loaders exit on failure, which is what we want at startup.
+        # The registry loads a new version of the model files when they are replaced.
+        if config.model == "joblib":
+            self.registry = process_csv_joblib.load_registry(os.path.join(script_dir, "trained_model.joblib"),
+                                                             os.path.join(script_dir, "scaler_params.json"),
+                                                             config.fold_scaler)
+        elif config.fold_scaler:
+            # The thresholds of forest_model.json are in scaled units: the scaler
+            # is folded into them, so the compiled forest takes the raw features.
+            self.registry = ModelRegistry(os.path.join(script_dir, "forest_model.json"), process_csv.load_forest,
+                                          process_csv.FEATURES, os.path.join(script_dir, "scaler_params.json"),
+                                          process_csv_joblib.load_scaler_params, fold_scaler=True)
+        else:
+            self.registry = ModelRegistry(os.path.join(script_dir, "forest_model.json"), process_csv.load_model,
+                                          process_csv.FEATURES)
+        self.registry.start()
+        self.workers = config.workers
+        # Windows being extracted by the worker pool, waiting for inference.
+        self.extracted = None
+        # Error that stopped the classification of the windows, if any.
+        self.error = None
+        self.sampler = make_sampler(config.sample, self.buffer) if config.sample else None
+        self.sampled_packets = 0
+        self.kept_packets = 0
+        # Counters and stage latencies (see metrics_endpoint.py), and the
+        # trace of every capture file or live window (see tracing.py).
+        self.stats = PipelineStats(STAGES)
+        self.tracer = Tracer(config.trace_file)
+        # Trace of the capture file of the windows being queued and classified.
+        self.traces = {}
+        self.pool = None
+        if config.workers > 1 and config.backend == "raw":
+            # Sending the frames of a window to a worker costs more than parsing them with raw_pcap.
+            log_message(f"The raw backend extracts the features in this process, --workers {config.workers} ignored")
+        elif config.workers > 1:
+            # Workers are forked from a server process, not from this process and its threads.
+            # Predictions and alerts stay in this process, in the order of the windows.
+            self.pool = ProcessPoolExecutor(config.workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    def process_pcap(self, pcap_file, ready_at=None):
+        """
+        Classifies a pcap file; ready_at is the time.monotonic() at which it was complete.
+        """
+        trace = self.start_trace(pcap_file, ready_at)
+        if not self.handoff:
+            try:
+                self.queue_pcap(pcap_file, trace, ready_at)
+            except ValueError as e:
+                # Not an Ethernet pcap file: the whole file is classified at once.
+                log_message(f"Classifying {pcap_file} without windows ({e})")
+            else:
+                os.remove(pcap_file)
+                log_message(f"Deleted pcap file: {pcap_file}")
+                return
+        frames = process_pcap.extract_features(pcap_file, self.exclude_non_tcp, backend=self.backend)
+        if self.aggregator is not None:
+            frames = process_pcap.aggregate_flows(frames, self.aggregator, flush=False)
+        start = time.monotonic()
+        if self.handoff:
+            ext = FEATURE_FILE_EXT if self.handoff == "binary" else ".csv"
+            features_file = os.path.splitext(pcap_file)[0] + ("_tcp_only" if self.exclude_non_tcp else "") + ext
+            # Write under a temporary name so the file is only seen once complete.
+            # The features are extracted while they are written.
+            process_pcap.write_features(frames, features_file + ".part" + ext)
+            os.replace(features_file + ".part" + ext, features_file)
+            self.record("write", start, trace, source=pcap_file)
+            log_message(f"Features file saved as {features_file}")
+        else:
+            # Each chunk of features is classified as soon as it is extracted.
+            for data in frames:
+                self.record("extract", start, trace, source=pcap_file)
+                self.classify(data, trace)
+                start = time.monotonic()
+        os.remove(pcap_file)
+        log_message(f"Deleted pcap file: {pcap_file}")
+
+    def process_features(self, features_file, ready_at=None):
+        trace = self.start_trace(features_file, ready_at)
+        if features_file.endswith(FEATURE_FILE_EXT):
+            frames = iter_feature_file(features_file)
+        else:
+            frames = pd.read_csv(features_file, chunksize=process_pcap.CHUNK_SIZE)
+        start = time.monotonic()
+        for data in frames:
+            self.record("read", start, trace, source=features_file)
+            self.classify(data, trace)
+            start = time.monotonic()
+        os.remove(features_file)
+        log_message(f"Deleted features file: {features_file}")
+
+    def start_trace(self, path, ready_at=None):
+        """
+        Starts the trace of a capture or features file, recording the time
+        it waited for processing since it was complete (ready_at).
+        """
+        trace = self.tracer.start(ready_at)
+        if ready_at is not None:
+            self.record("dispatch", ready_at, trace, source=path)
+        return trace
+
+    def record(self, stage, start, trace=None, end=None, **args):
+        """
+        Records that stage ran from start until end (time.monotonic(), by
+        default now): in the stage latency histograms, and as a span of trace.
+        Returns end.
+        """
+        end = time.monotonic() if end is None else end
+        self.stats.observe(stage, end - start)
+        if trace is not None:
+            self.tracer.span(trace, stage, start, end, **args)
+        return end
+
+    def queue_pcap(self, pcap_file, trace=None, ready_at=None):
+        """
+        Puts the packets of a pcap file in the window buffer. When the buffer is
+        full this waits for the detection to catch up (back-pressure).
+        The windows of the file are classified in trace, which starts at its first packet.
+        Raises ValueError if the file is not an Ethernet pcap file.
+        """
+        with open(pcap_file, "rb") as f:
+            header = f.read(24)
+        if header:
+            _, _, linktype = raw_pcap.read_pcap_header(header)
+            if linktype != raw_pcap.LINKTYPE_ETHERNET:
+                raise ValueError(f"link type {linktype} is not Ethernet")
+        count = 0
+        start = time.monotonic()
+        if trace is not None:
+            self.traces[pcap_file] = trace
+        for timestamp, frame in raw_pcap.iter_packets(pcap_file):
+            if count == 0 and trace is not None:
+                # From the first packet to the file being complete: the rotation of the capture.
+                origin = wall_to_monotonic(timestamp)
+                self.tracer.set_origin(trace, origin)
+                self.record("capture", origin, trace, ready_at if ready_at is not None else start, source=pcap_file)
+            self.buffer.put(pcap_file, timestamp, frame)
+            count += 1
+        self.buffer.flush()
+        self.record("read", start, trace, source=pcap_file, packets=count)
+        self.stats.add("pcap_files")
+        log_message(f"Queued {count} packets of {pcap_file}")
+
+    def submit_windows(self, extracted):
+        """
+        Sends the windows of the buffer to the worker pool and puts their
+        (source, packet count, first packet time, result) in extracted, in order, then None.
+        extracted is bounded, so at most 2 * workers windows are in progress.
+        If a window cannot be sent, the error is kept in self.error and None
+        still ends extracted, so that extracted_windows() raises it.
+        """
+        try:
+            for source, frames, timestamps in self.buffer.windows():
+                future = self.pool.submit(process_pcap.window_features, *self.window_job(frames, timestamps))
+                extracted.put((source, len(frames), timestamps[0], future.result))
+        except Exception as e:
+            log_error(f"Could not send a window to the worker pool: {e}")
+            self.error = e
+        finally:
+            extracted.put(None)
+
+    def window_job(self, frames, timestamps):
+        """
+        Returns the arguments of process_pcap.window_features for a window,
+        after sampling its packets if a sampler is set.
+        """
+        weights = None
+        if self.sampler is not None:
+            self.sampled_packets += len(frames)
+            frames, timestamps, weights = self.sampler.sample(frames, timestamps)
+            self.kept_packets += len(frames)
+        return frames, timestamps, self.exclude_non_tcp, 1, self.backend, weights
+
+    def extracted_windows(self):
+        """
+        Yields (source, packet count, first packet time, result) for the windows
+        of the buffer, in order; result() returns the features of the window,
+        numbered from 1.
+        """
+        if self.pool is None:
+            for source, frames, timestamps in self.buffer.windows():
+                yield source, len(frames), timestamps[0], functools.partial(process_pcap.window_features,
+                                                                            *self.window_job(frames, timestamps))
+            return
+        self.extracted = queue.Queue(2 * self.workers)
+        threading.Thread(target=self.submit_windows, args=(self.extracted,), name="submit-windows",
+                         daemon=True).start()
+        for item in iter(self.extracted.get, None):
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def run_windows(self):
+        """
+        Classifies the windows of the buffer until it is closed, then the
+        flows still open. Rows are numbered per source, as when a pcap file
+        was processed at once. If the windows cannot be read any more, the
+        error is kept in self.error and the buffer is closed, which stops the service.
+        """
+        try:
+            self.classify_windows()
+        except Exception as e:
+            log_error(f"The detection stopped, windows are no longer classified: {e}")
+            self.error = e
+            self.buffer.close()
+        self.flush_flows()
+
+    def classify_windows(self):
+        source, processed_packets, window = None, 0, 0
+        for window_source, packet_count, first_time, result in self.extracted_windows():
+            if window_source != source:
+                self.traces.pop(source, None)
+                source, processed_packets, window = window_source, 0, 0
+            window += 1
+            trace = self.traces.get(source)
+            if trace is None:
+                # Live capture: every window is a trace, from its first packet to the window being cut.
+                trace = self.tracer.start(wall_to_monotonic(first_time))
+                self.record("capture", self.tracer.origin(trace), trace, source=source)
+            try:
+                start = time.monotonic()
+                data = result()
+                self.record("extract", start, trace, source=source, window=window, packets=packet_count)
+                data = process_pcap.renumber(data, processed_packets + 1)
+                processed_packets += len(data)
+                chunks = [data]
+                if self.aggregator is not None:
+                    chunks = process_pcap.aggregate_flows(chunks, self.aggregator, flush=False)
+                for chunk in chunks:
+                    if len(chunk):
+                        self.classify(chunk, trace, window=window)
+            except (Exception, SystemExit) as e:
+                log_error(f"An error occurred while processing a window of {packet_count} packets from {source}: {e}")
+
+    def flush_flows(self):
+        """
+        Classifies the flows still open when the service stops: during a
+        flood the attack flow itself is usually one of them.
+        """
+        if self.aggregator is None:
+            return
+        try:
+            rows = self.aggregator.flush()
+            if rows:
+                log_message(f"Classifying the {len(rows)} flows still open")
+                self.classify(process_pcap.features_to_frame(rows))
+        except (Exception, SystemExit) as e:
+            log_error(f"An error occurred while classifying the open flows: {e}")
+
+    def metrics(self):
+        """
+        Returns the depth and counters of the queues between the stages:
+        packets waiting for a window, and windows waiting for inference.
+        """
+        metrics = {"buffer": self.buffer.metrics()}
+        if self.extracted is not None:
+            metrics["extracted"] = {"depth": self.extracted.qsize(), "capacity": self.extracted.maxsize}
+        if self.sampler is not None:
+            metrics["sampling"] = {"packets": self.sampled_packets, "kept": self.kept_packets}
+        return metrics
+
+    def start_windows(self):
+        thread = threading.Thread(target=self.run_windows, name="windows", daemon=True)
+        thread.start()
+        return thread
+
+    def classify(self, data, trace=None, **args):
+        with self.classify_lock:
+            self.classify_chunk(data, trace, **args)
+
+    def classify_chunk(self, data, trace=None, **args):
+        start = time.monotonic()
+        predictions, version = self.registry.predict(process_pcap.feature_matrix(data, process_csv.FEATURES))
+        self.record("predict", start, trace, rows=len(data), **args)
+        data['prediction'] = predictions
+        data['model_version'] = version
+        log_message(f"Made predictions on {len(data)} rows with model {version}")
+        malicious = data[(data['prediction'] == 1) & data['source_ip'].notna()]
+        self.stats.add("rows_classified", len(data))
+        self.stats.add("malicious_rows", len(malicious))
+        if malicious.empty:
+            log_message("No malicious packets found.")
+            return
+        self.alert(malicious, trace, **args)
+
+    def alert(self, malicious, trace=None, **args):
+        """
+        Counts the malicious rows per source, and reports and blocks the
+        sources above the alert threshold.
+        """
+        # Every row counts for the packets it stands for: a sampled packet for
+        # its weight, a flow for its spkts (which is 1 for a packet row).
+        if process_pcap.WEIGHT_COLUMN in malicious:
+            weights = malicious[process_pcap.WEIGHT_COLUMN]
+        else:
+            weights = malicious['spkts']
+        counts = weights.astype(float).groupby(malicious['source_ip']).sum().round().astype(int)
+        # Sources above the threshold are written to attack_log.txt as soon as they cross it (then every ALERT_COOLDOWN s).
+        detected_at = time.time()
+        start = time.monotonic()
+        alerts = self.counter.add_batch(counts, detected_at)
+        end = self.record("alert", start, trace, alerts=len(alerts), **args)
+        self.stats.add("alerts", len(alerts))
+        # The first alert of a trace ends it.
+        origin = self.tracer.pop_origin(trace) if alerts and trace is not None else None
+        if origin is not None:
+            self.record("capture_to_alert", origin, trace, end, sources=sorted(alerts), **args)
+        if alerts and self.mitigation is not None:
+            self.mitigation.block(list(alerts), detected_at)
+
+    def watch_flow_stats(self, stats_file, stopped):
+        """
+        Checks the snapshots of the controller statistics (see flow_stats.py)
+        as they are written, until stopped is set: the packets of the hosts
+        above flow_stats.PPS_THRESHOLD are counted as malicious.
+        """
+        last = None
+        while not stopped.wait(FLOW_STATS_CHECK):
+            try:
+                snapshot = flow_stats.load_snapshot(stats_file)
+                if snapshot["timestamp"] == last:
+                    continue
+                last = snapshot["timestamp"]
+                rows = flow_stats.source_rows(snapshot)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                log_error(f"Could not read the flow statistics {stats_file}: {e}")
+                continue
+            with self.classify_lock:
+                self.classify_flow_stats(rows)
+
+    def classify_flow_stats(self, rows):
+        trace = self.tracer.start()
+        malicious = rows[rows["pps"] > flow_stats.PPS_THRESHOLD]
+        self.stats.add("rows_classified", len(rows))
+        self.stats.add("malicious_rows", len(malicious))
+        log_message(f"{len(malicious)} of {len(rows)} hosts above {flow_stats.PPS_THRESHOLD} packets/s "
+                    "in the flow statistics")
+        if not malicious.empty:
+            # Every row stands for the packets of its interval (spkts).
+            self.alert(malicious, trace)
 
 class PcapFileHandler(FileSystemEventHandler):
+    """
+    Hands the complete pcap and features files of the watched directory to the
+    service. The events only tell ready (see spool.py) when a file is
+    complete: when it is renamed to its final name or closed by its writer.
+    The files are processed one at a time by run(), outside of the observer
+    thread, so a file that is still being written is never read.
+    """
+
+    def __init__(self, service, ready):
+        super().__init__()
+        self.service = service
+        self.ready = ready
+
     def on_created(self, event):
-        script_dir = os.path.dirname(os.path.realpath(__file__))
-        if event.is_directory:
-            return
-        if event.src_path.endswith('.pcap'):
-            message = f"New pcap file detected: {event.src_path}"
+        if not event.is_directory and self.wanted(event.src_path):
+            self.ready.created(event.src_path)
+
+    def on_closed(self, event):
+        if not event.is_directory and self.wanted(event.src_path):
+            self.ready.completed(event.src_path)
+
+    def on_moved(self, event):
+        # Files written under a temporary name appear when they are renamed.
+        if not event.is_directory and self.wanted(event.dest_path):
+            self.ready.completed(event.dest_path)
+
+    def wanted(self, path):
+        name = os.path.basename(path)
+        return name.endswith(('.pcap', '.csv', FEATURE_FILE_EXT)) and '.part.' not in name
+
+    def scan(self, directory):
+        # Files left complete by a previous run.
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and self.wanted(path):
+                self.ready.completed(path)
+
+    def run(self):
+        for path in self.ready.files():
+            try:
+                self.dispatch_file(path)
+            finally:
+                self.ready.done(path)
+
+    def dispatch_file(self, path):
+        if path.endswith('.pcap'):
+            message = f"New pcap file detected: {path}"
             log_message(message)
-            self.process_pcap(event.src_path, script_dir)
-        elif event.src_path.endswith('.csv'):
-            message = f"New CSV file detected: {event.src_path}"
+            self.process_pcap(path)
+        elif path.endswith(('.csv', FEATURE_FILE_EXT)):
+            message = f"New features file detected: {path}"
             log_message(message)
-            self.process_csv(event.src_path, script_dir)
+            self.process_features(path)
 
-    def process_pcap(self, pcap_file, script_dir):
+    def process_pcap(self, pcap_file):
         try:
             log_message(f"Processing pcap file: {pcap_file}")
-            subprocess.call(["python3", os.path.join(script_dir, "process_pcap.py"), pcap_file])
-        except Exception as e:
+            self.service.process_pcap(pcap_file, self.ready.completed_time(pcap_file))
+        # The process_csv helpers call sys.exit on failure, which must not stop the service.
+        except (Exception, SystemExit) as e:
             error_message = f"An error occurred while processing pcap file {pcap_file}: {e}"
             log_error(error_message)
 
-    def process_csv(self, csv_file, script_dir):
+    def process_features(self, features_file):
         try:
-            log_message(f"Processing pcap file: {csv_file}")
-            subprocess.call(["python3", os.path.join(script_dir, "process_csv.py"), csv_file])
-        except Exception as e:
-            error_message = f"An error occurred while processing pcap file {csv_file}: {e}"
+            log_message(f"Processing features file: {features_file}")
+            self.service.process_features(features_file, self.ready.completed_time(features_file))
+        except (Exception, SystemExit) as e:
+            error_message = f"An error occurred while processing features file {features_file}: {e}"
             log_error(error_message)
 
-    def read_malicious_csv(self, script_dir):
-        try:
-            csv_file = os.path.join(script_dir, 'malicious_packets.csv')
-            if os.path.exists(csv_file):
-                data = pd.read_csv(csv_file)
-                log_message(f"Read CSV file: {csv_file}")
-                log_message(str(data))
-                # Call check_malicious_packets.py script
-                subprocess.call(["python3", "check_malicius_packets.py", csv_file])
-            else:
-                log_message(f"CSV file {csv_file} does not exist.")
-        except Exception as e:
-            error_message = f"An error occurred while reading the CSV file {csv_file}: {e}"
-            log_error(error_message)
+def log_metrics(service, ready=None):
+    """
+    Writes the depth and the counters of the queues between the stages to the logs.
+    """
+    metrics = service.metrics()
+    buffer = metrics["buffer"]
+    message = (f"Queues: {buffer['depth']}/{buffer['capacity']} packets buffered (max {buffer['max_depth']}), "
+               f"{buffer['dropped']} dropped, {buffer['sampled_out']} sampled out")
+    if buffer["degraded"]:
+        message += " (degraded mode)"
+    if "extracted" in metrics:
+        message += f"; {metrics['extracted']['depth']}/{metrics['extracted']['capacity']} windows extracted"
+    if "sampling" in metrics:
+        message += f"; {metrics['sampling']['kept']}/{metrics['sampling']['packets']} packets kept by sampling"
+    if ready is not None:
+        spool = ready.metrics()
+        message += f"; {spool['depth']} files waiting (max {spool['max_depth']}), {spool['dropped']} dropped"
+    log_message(message)
 
-if __name__ == "__main__":
-    tmp_dir = '/tmp'
-    event_handler = PcapFileHandler()
-    observer = Observer()
-    observer.schedule(event_handler, path=tmp_dir, recursive=False)
-    observer.start()
-    log_message(f"Monitoring {tmp_dir} for new pcap and csv files...")
+def endpoint_page(service, ready=None):
+    """
+    Returns the page of the metrics endpoint for the service.
+    """
+    return render_metrics(service.stats, service.metrics(), ready.metrics() if ready is not None else None,
+                          service.registry.current.version)
 
+def monitor(service, ready=None, running=lambda: True):
+    """
+    Waits until running() is False, the detection stopped on an error or
+    the service is interrupted, logging the queue depths every METRICS_INTERVAL seconds.
+    """
+    next_report = time.monotonic() + METRICS_INTERVAL
     try:
-        while True:
+        while running() and service.error is None:
             time.sleep(1)
+            if time.monotonic() >= next_report:
+                log_metrics(service, ready)
+                next_report += METRICS_INTERVAL
     except KeyboardInterrupt:
+        pass
+
+def positive(kind):
+    """
+    Returns an argparse type converting to kind and refusing zero and negative values.
+    """
+    def convert(value):
+        try:
+            number = kind(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid {kind.__name__} value: {value!r}")
+        if number <= 0:
+            raise argparse.ArgumentTypeError(f"must be positive: {value!r}")
+        return number
+    return convert
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitor a directory for new captures and detect DoS attacks.")
+    parser.add_argument("--watch-dir", default=SPOOL_DIR,
+                        help=f"spool directory where the pcap files are written (default {SPOOL_DIR})")
+    parser.add_argument("--handoff", choices=["binary", "csv"],
+                        help="hand the features off through a file in the watched directory")
+    parser.add_argument("--backend", choices=["scapy", "raw"],
+                        help="packet parser used for feature extraction (default: raw in live mode, scapy otherwise)")
+    parser.add_argument("--flows", action="store_true",
+                        help="classify one row per flow instead of one row per packet")
+    parser.add_argument("--live", nargs="?", const=CAPTURE_INTERFACE, metavar="INTERFACE",
+                        help=f"capture packets live on INTERFACE (default {CAPTURE_INTERFACE}) "
+                             "instead of watching for pcap files")
+    parser.add_argument("--flow-stats", nargs="?", const=flow_stats.STATS_FILE, metavar="STATS_FILE",
+                        help=f"detect from the flow statistics of the controller (default {flow_stats.STATS_FILE}) "
+                             "instead of watching for pcap files, without capture")
+    parser.add_argument("--window-packets", type=positive(int), default=WINDOW_PACKETS,
+                        help=f"maximum number of packets classified at once (default {WINDOW_PACKETS})")
+    parser.add_argument("--window-delay", type=positive(float), default=WINDOW_DELAY,
+                        help=f"maximum seconds between a packet and its classification (default {WINDOW_DELAY})")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES,
+                        help="when the packet buffer is full: block the pcap reader, drop the oldest packets, or "
+                             "sample the packets of every source (default: drop in live mode, block otherwise)")
+    parser.add_argument("--sample", metavar="MODE[:N]",
+                        help="sample the packets before feature extraction: uniform[:N] (one in N), "
+                             "reservoir[:N] (N packets per flow and window) or adaptive[:N] "
+                             "(rate following the buffer depth, up to one in N)")
+    parser.add_argument("--counter", choices=["exact", "sketch"], default="exact",
+                        help="per-source malicious counts: exact, or a heavy-hitter sketch with bounded memory "
+                             "for floods from spoofed sources (default exact)")
+    parser.add_argument("--model", choices=["forest", "joblib"], default="forest",
+                        help="forest_model.json, or trained_model.joblib with scaler_params.json (default forest)")
+    parser.add_argument("--fold-scaler", action="store_true",
+                        help="fold scaler_params.json into the thresholds of the model, which then takes the raw "
+                             "features (otherwise the joblib model scales them, the forest takes them unscaled)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"processes computing the features of the windows in parallel with the scapy "
+                             f"backend (default 1, {os.cpu_count()} cores here)")
+    parser.add_argument("--mitigate", action="store_true",
+                        help="ask the controller to block the sources of the detected attacks")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help=f"port of the Prometheus metrics endpoint on {METRICS_HOST} "
+                             f"(default {METRICS_PORT}, 0 to disable it)")
+    parser.add_argument("--trace", metavar="TRACE_FILE",
+                        help="append the stages of every capture and window to TRACE_FILE as JSON lines "
+                             "(python3 tracing.py TRACE_FILE prints the latencies and converts it to a Chrome trace)")
+    parser.add_argument("--log-dir",
+                        help=f"directory of logs.txt and errors_logs.txt (default: ${log_writer.LOG_DIR_ENV} "
+                             "or the topology folder)")
+    parser.add_argument("--log-level", choices=list(log_writer.LEVELS),
+                        help=f"lowest level written to the logs (default: ${log_writer.LOG_LEVEL_ENV} or INFO)")
+    args = parser.parse_args()
+    if args.sample:
+        try:
+            make_sampler(args.sample)
+        except ValueError as e:
+            parser.error(str(e))
+    log_writer.configure(args.log_dir, args.log_level)
+
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    service = DetectionService(script_dir, ServiceConfig.from_args(args))
+    log_message("Detection service started, model loaded.")
+    # Spool files waiting, once the spool directory is watched.
+    ready = None
+    endpoint = None
+    if args.metrics_port:
+        try:
+            endpoint = MetricsEndpoint(lambda: endpoint_page(service, ready), port=args.metrics_port).start()
+        except OSError as e:
+            log_error(f"Could not serve the metrics on port {args.metrics_port}, continuing without them: {e}")
+    windows_thread = service.start_windows()
+
+    if args.live:
+        capture = LiveCapture(service.buffer, args.live, tcp_only=service.exclude_non_tcp)
+        capture.start()
+        monitor(service, running=lambda: capture.running)
+        capture.stop()
+    elif args.flow_stats:
+        stopped = threading.Event()
+        stats_thread = threading.Thread(target=service.watch_flow_stats, args=(args.flow_stats, stopped),
+                                        name="flow-stats", daemon=True)
+        stats_thread.start()
+        log_message(f"Detecting from the flow statistics of {args.flow_stats}...")
+        monitor(service)
+        stopped.set()
+        stats_thread.join()
+    else:
+        spool_dir = args.watch_dir
+        os.makedirs(spool_dir, exist_ok=True)
+        observer = Observer()
+        # Only inotify reports when a writer closes a file, other observers
+        # fall back on waiting for the size of new files to stop changing.
+        ready = ReadyFiles(size_stable=type(observer).__name__ != "InotifyObserver").start()
+        event_handler = PcapFileHandler(service, ready)
+        observer.schedule(event_handler, path=spool_dir, recursive=False)
+        observer.start()
+        event_handler.scan(spool_dir)
+        files_thread = threading.Thread(target=event_handler.run, name="spool-files", daemon=True)
+        files_thread.start()
+        log_message(f"Monitoring {spool_dir} for new pcap and features files...")
+        monitor(service, ready)
         observer.stop()
-    observer.join()
-    log_message("Stopped the file monitoring service.")
\ No newline at end of file
+        observer.join()
+        ready.close()
+        files_thread.join()
+
+    # The packets already received are classified before stopping.
+    service.buffer.close()
+    windows_thread.join()
+    if service.pool is not None:
+        service.pool.shutdown()
+    if endpoint is not None:
+        endpoint.stop()
+    service.counter.save_checkpoint()
+    service.tracer.log_summary()
+    service.tracer.close()
+    log_message("Stopped the detection service.")
+    if service.error is not None:
+        sys.exit(1)
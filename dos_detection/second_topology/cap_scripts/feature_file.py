@@ -0,0 +1,72 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Extension of the binary feature files handed from process_pcap to process_csv.
+FEATURE_FILE_EXT = ".feat"
+
+FORMAT_VERSION = 1
+
+def write_feature_file(frames, feature_file):
+    """
+    Writes feature DataFrames to a binary columnar file.
+    The file is a sequence of .npy arrays: a JSON header with the column names
+    and dtypes, then every chunk as one typed array per column. Numeric columns
+    are stored as float64 with NaN for missing values, so no text conversion is
+    needed on either side and chunks can be streamed in and out.
+    Returns the number of rows written.
+    """
+    rows = 0
+    with open(feature_file, "wb") as f:
+        header = None
+        for data in frames:
+            if header is None:
+                header = [[column, str(data[column].dtype)] for column in data.columns]
+                write_header(f, header)
+            for column, dtype in header:
+                np.save(f, column_array(data[column], dtype), allow_pickle=False)
+            rows += len(data)
+        if header is None:
+            write_header(f, [])
+    return rows
+
+def write_header(f, columns):
+    header = json.dumps({"version": FORMAT_VERSION, "columns": columns})
+    np.save(f, np.array(header), allow_pickle=False)
+
+def column_array(values, dtype):
+    if dtype in ("object", "str", "string"):
+        return values.fillna("").to_numpy(dtype=str)
+    return values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+def iter_feature_file(feature_file):
+    """
+    Yields the chunks of a binary feature file as DataFrames with the dtypes
+    they were written with.
+    """
+    with open(feature_file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        header = json.loads(str(np.load(f, allow_pickle=False)))
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported feature file version: {header['version']}")
+        columns = header["columns"]
+        while columns and f.tell() < size:
+            data = {}
+            for column, dtype in columns:
+                values = np.load(f, allow_pickle=False)
+                if values.dtype.kind == "U":
+                    values = pd.Series(values, dtype=object)
+                    data[column] = values.where(values != "", None)
+                else:
+                    data[column] = pd.Series(values).astype(dtype)
+            yield pd.DataFrame(data)
+
+def read_feature_file(feature_file):
+    """
+    Reads a whole binary feature file into a single DataFrame.
+    """
+    chunks = list(iter_feature_file(feature_file))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
@@ -0,0 +1,117 @@
+# A flow ends when no packet is seen for IDLE_TIMEOUT seconds, or when it has
+# been active for ACTIVE_TIMEOUT seconds (long flows are then split).
+IDLE_TIMEOUT = 15.0
+ACTIVE_TIMEOUT = 120.0
+
+def is_missing(value):
+    return value is None or value == "N/A" or value != value
+
+class Flow:
+    """
+    State of a unidirectional flow, keyed on the 5-tuple.
+    The TTL, window and sequence numbers of the first packet are kept, as the
+    per-packet features do for a single packet.
+    """
+    __slots__ = ("key", "first", "last", "spkts", "sbytes", "sttl", "swin", "stcpb", "dtcpb", "label")
+
+    def __init__(self, key, ts, sbytes, sttl, swin, stcpb, dtcpb, label):
+        self.key = key
+        self.first = ts
+        self.last = ts
+        self.spkts = 1
+        self.sbytes = sbytes
+        self.sttl = sttl
+        self.swin = swin
+        self.stcpb = stcpb
+        self.dtcpb = dtcpb
+        self.label = label
+
+class FlowAggregator:
+    """
+    Aggregates packets into flows keyed on (source ip, destination ip, source
+    port, destination port, protocol) and produces one feature row per flow,
+    with the same columns as the per-packet rows of process_pcap.py:
+    dur is the flow duration and spkts/sbytes/rate/pps/bpp are computed over
+    all the packets of the flow, closer to the UNSW-NB15 features.
+    Timeouts are evaluated on packet timestamps, so a resident aggregator can
+    keep flows open across consecutive captures.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, active_timeout=ACTIVE_TIMEOUT, with_label=False):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.with_label = with_label
+        self.flows = {}
+        self.flow_count = 0
+        self.now = None
+
+    def add(self, key, ts, sbytes, sttl="N/A", swin="N/A", stcpb="N/A", dtcpb="N/A", label=None):
+        """
+        Adds a packet to its flow.
+        Returns the rows of the flow that the packet closed, if any.
+        """
+        ts = float(ts)
+        self.now = ts if self.now is None else max(self.now, ts)
+        expired = []
+        flow = self.flows.get(key)
+        if flow is not None and (ts - flow.last > self.idle_timeout or ts - flow.first > self.active_timeout):
+            expired.append(self.flow_row(self.flows.pop(key)))
+            flow = None
+        if flow is None:
+            self.flows[key] = Flow(key, ts, sbytes, sttl, swin, stcpb, dtcpb, label)
+        else:
+            flow.last = max(flow.last, ts)
+            flow.spkts += 1
+            flow.sbytes += sbytes
+            if label is not None:
+                flow.label = label if flow.label is None else max(flow.label, label)
+        return expired
+
+    def expire(self, now=None):
+        """
+        Returns the rows of the flows that are idle or too long at time now
+        (by default the timestamp of the latest packet), and forgets them.
+        """
+        now = self.now if now is None else now
+        if now is None:
+            return []
+        expired = [key for key, flow in self.flows.items()
+                   if now - flow.last > self.idle_timeout or now - flow.first > self.active_timeout]
+        return [self.flow_row(self.flows.pop(key)) for key in expired]
+
+    def flush(self):
+        """
+        Returns the rows of all the open flows, and forgets them.
+        """
+        rows = [self.flow_row(flow) for flow in self.flows.values()]
+        self.flows = {}
+        return rows
+
+    def flow_row(self, flow):
+        """
+        Computes the feature row of a flow, in the CSV_HEADER order of process_pcap.py.
+        Missing values are reported as "N/A".
+        """
+        self.flow_count += 1
+        dur = flow.last - flow.first
+        spkts = flow.spkts
+        sbytes = flow.sbytes
+        sttl = "N/A" if is_missing(flow.sttl) else flow.sttl
+        swin = "N/A" if is_missing(flow.swin) else flow.swin
+        stcpb = "N/A" if is_missing(flow.stcpb) else flow.stcpb
+        dtcpb = "N/A" if is_missing(flow.dtcpb) else flow.dtcpb
+
+        rate = "N/A" if dur == 0 else sbytes / dur
+        pps = "N/A" if dur == 0 else spkts / dur
+        bpp = sbytes / spkts
+        ttl_ratio = "N/A" if sttl == "N/A" or dur == 0 else float(sttl) / dur
+        tcp_diff = "N/A" if stcpb == "N/A" or dtcpb == "N/A" else float(dtcpb) - float(stcpb)
+        swin_interaction = "N/A" if swin == "N/A" or stcpb == "N/A" else float(swin) * float(stcpb)
+        source_ip = "N/A" if is_missing(flow.key[0]) else flow.key[0]
+
+        row = [
+            self.flow_count, source_ip, dur, spkts, sbytes, sttl, swin, stcpb, dtcpb, rate, pps, bpp, ttl_ratio, tcp_diff, swin_interaction
+        ]
+        if self.with_label:
+            row.append("N/A" if flow.label is None else flow.label)
+        return row
@@ -0,0 +1,73 @@
+import json
+import sys
+import pandas as pd
+
+# Written by the statistics poller of allowal_connectivity.py.
+STATS_FILE = "/tmp/flow_stats.json"
+
+# Capture-free detection (cap_main.py --flow-stats): the packets of a host are
+# counted as malicious when it sent more than PPS_THRESHOLD packets per second
+# over a polling interval. The packet model is not used, as the counters have
+# none of the TCP header fields it splits on.
+PPS_THRESHOLD = 1000
+
+def load_snapshot(stats_file=STATS_FILE):
+    with open(stats_file, 'r') as f:
+        return json.load(f)
+
+def read_flow_stats(stats_file=STATS_FILE):
+    """
+    Reads the last snapshot of the controller flow and port counters.
+    Returns (timestamp, flows, ports): one row per flow entry (dpid, match,
+    dur, spkts, sbytes, rate, pps, bpp and the rates over the last polling
+    interval) and one row per switch port (rx/tx counters, rx_pps, rx_rate,
+    and the source_ip of the host attached to it, if any).
+    Rates that cannot be computed yet are NaN.
+    """
+    snapshot = load_snapshot(stats_file)
+    return snapshot["timestamp"], *snapshot_frames(snapshot)
+
+def snapshot_frames(snapshot):
+    flows = pd.DataFrame(snapshot["flows"])
+    ports = pd.DataFrame(snapshot["ports"])
+    for frame in (flows, ports):
+        for column in frame.columns:
+            if column not in ("match", "source_ip"):
+                frame[column] = pd.to_numeric(frame[column])
+    return flows, ports
+
+def source_rows(snapshot):
+    """
+    Returns one row per host of the snapshot with the traffic it sent over the
+    last polling interval (the rx counters of its access port), in the
+    columns of the packet features where they apply: dur is the interval,
+    spkts and sbytes the packets and bytes of the interval.
+    """
+    _, ports = snapshot_frames(snapshot)
+    if ports.empty or "source_ip" not in ports:
+        return pd.DataFrame(columns=["source_ip", "dur", "spkts", "sbytes", "rate", "pps", "bpp"])
+    ports = ports[ports["source_ip"].notna() & ports["rx_pps"].notna()]
+    interval = snapshot["interval"]
+    spkts = (ports["rx_pps"] * interval).round()
+    sbytes = (ports["rx_rate"] * interval).round()
+    return pd.DataFrame({
+        "source_ip": ports["source_ip"],
+        "dur": float(interval),
+        "spkts": spkts,
+        "sbytes": sbytes,
+        "rate": ports["rx_rate"],
+        "pps": ports["rx_pps"],
+        "bpp": (sbytes / spkts).where(spkts > 0),
+    }).reset_index(drop=True)
+
+if __name__ == "__main__":
+    stats_file = sys.argv[1] if len(sys.argv) > 1 else STATS_FILE
+    timestamp, flows, ports = read_flow_stats(stats_file)
+    print(f"Snapshot of {pd.Timestamp(timestamp, unit='s')}: {len(flows)} flows, {len(ports)} ports")
+    if not ports.empty:
+        print(ports.sort_values("rx_pps", ascending=False).head(10).to_string(index=False))
+    if not flows.empty:
+        print(flows.sort_values("pps_interval", ascending=False).head(10).to_string(index=False))
+    rows = source_rows(load_snapshot(stats_file))
+    print(f"Hosts above {PPS_THRESHOLD} packets/s:")
+    print(rows[rows["pps"] > PPS_THRESHOLD].to_string(index=False))
@@ -0,0 +1,258 @@
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import types
+import numpy as np
+
+from forest_engine import LEAF
+
+# Bumped when the generated code changes, so that older cached modules are not reused.
+COMPILER_VERSION = 1
+
+# Generated modules are cached here, one file per model hash.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "compiled_models")
+
+def forest_from_estimator(model):
+    """
+    Converts a fitted scikit-learn RandomForestClassifier, or a single
+    DecisionTreeClassifier such as trained_model.joblib, into the list of
+    tree structures of forest_model.json.
+    """
+    forest = []
+    for estimator in getattr(model, "estimators_", [model]):
+        tree = estimator.tree_
+        forest.append({
+            "feature": tree.feature.tolist(),
+            "threshold": tree.threshold.tolist(),
+            "children_left": tree.children_left.tolist(),
+            "children_right": tree.children_right.tolist(),
+            "values": tree.value[:, 0, :].tolist(),
+        })
+    return forest
+
+def float_key(value):
+    # Integer with the same order as the float64 value, one step per representable float.
+    bits = int(np.float64(value).view(np.int64))
+    return bits ^ 0x7FFFFFFFFFFFFFFF if bits < 0 else bits
+
+def key_float(key):
+    bits = key ^ 0x7FFFFFFFFFFFFFFF if key < 0 else key
+    return float(np.int64(bits).view(np.float64))
+
+def raw_threshold(threshold, mean, scale, float32=False):
+    """
+    Returns the largest float64 x such that the scaled value (x - mean) / scale
+    satisfies the split test "<= threshold", computed as StandardScaler does.
+    With float32, the scaled value is rounded to float32 before the test, as
+    scikit-learn trees do with their input.
+    The scaled value never decreases when x grows (scale > 0), so for every x
+    "x <= raw_threshold" takes the same branch as the scaled test: the
+    largest x is found by bisection over the representable floats.
+    """
+    def goes_left(x):
+        # Overflows to infinity are part of the scaled values, not errors.
+        with np.errstate(over="ignore"):
+            scaled = (np.float64(x) - mean) / scale
+            if float32:
+                scaled = np.float32(scaled)
+        return bool(scaled <= threshold)
+
+    low, high = float_key(-np.inf), float_key(np.inf)
+    if goes_left(np.inf):
+        return np.inf
+    # goes_left(key_float(low)) is always True, goes_left(key_float(high)) False.
+    while high - low > 1:
+        middle = (low + high) // 2
+        if goes_left(key_float(middle)):
+            low = middle
+        else:
+            high = middle
+    return key_float(low)
+
+def fold_scaler(forest, mean, scale, float32=False):
+    """
+    Returns a copy of the forest whose thresholds are in raw feature units:
+    it predicts on raw features exactly what the forest predicts on the
+    features standardized with mean and scale, without scaling them.
+    """
+    mean = np.asarray(mean, dtype=np.float64)
+    scale = np.asarray(scale, dtype=np.float64)
+    if not (scale > 0).all():
+        raise ValueError("The scale of every feature must be positive")
+    folded = []
+    for tree in forest:
+        tree = dict(tree)
+        tree["threshold"] = [
+            threshold if feature == LEAF else
+            raw_threshold(threshold, mean[feature], scale[feature], float32)
+            for feature, threshold in zip(tree["feature"], tree["threshold"])
+        ]
+        folded.append(tree)
+    return folded
+
+def compile_folded(model, mean, scale, cache_dir=CACHE_DIR):
+    """
+    Compiles a forest (list of tree structures) or a scikit-learn decision
+    tree with the scaler folded into its thresholds, so that it is fed raw
+    features. A scikit-learn random forest averages the probabilities of
+    its trees instead of voting, so it cannot be folded into a compiled
+    module with the same predictions.
+    """
+    if isinstance(model, list):
+        return compile_forest(fold_scaler(model, mean, scale), cache_dir)
+    return compile_forest(fold_scaler(tree_forest(model), mean, scale, float32=True), cache_dir)
+
+def tree_forest(model):
+    """
+    Converts a single fitted scikit-learn decision tree into a forest of one
+    tree. Random forests are refused: scikit-learn averages the probabilities
+    of their trees, which the compiled majority vote does not reproduce.
+    """
+    if hasattr(model, "estimators_"):
+        raise ValueError("Only single scikit-learn trees can be compiled")
+    if list(model.classes_) != list(range(len(model.classes_))):
+        raise ValueError(f"Unsupported classes {list(model.classes_)}")
+    return forest_from_estimator(model)
+
+def model_hash(forest):
+    """
+    Returns the hash identifying a forest (and the compiler version) in the cache.
+    """
+    text = json.dumps(forest, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{COMPILER_VERSION}:{text}".encode()).hexdigest()[:16]
+
+def tree_source(tree, index):
+    """
+    Generates the function that evaluates one tree on the rows of X.
+    Every split divides the row indices of its node with a mask, so each
+    level of the tree costs one comparison per row, and every leaf writes
+    its class into out for the rows that reach it.
+    """
+    lines = [f"def tree_{index}(X, rows, out):"]
+    counter = [0]
+
+    def emit(node, rows):
+        feature = tree["feature"][node]
+        if feature == LEAF:
+            lines.append(f"    out[{rows}] = {int(np.argmax(tree['values'][node]))}")
+            return
+        counter[0] += 1
+        n = counter[0]
+        # NaN comparisons are False, so missing values go right as in predict_tree.
+        threshold = float(tree["threshold"][node])
+        # Folded thresholds can be infinite, which has no literal.
+        threshold = repr(threshold) if np.isfinite(threshold) else f"{'-' if threshold < 0 else ''}np.inf"
+        lines.append(f"    m{n} = X[{rows}, {int(feature)}] <= {threshold}")
+        lines.append(f"    l{n}, r{n} = {rows}[m{n}], {rows}[~m{n}]")
+        emit(tree["children_left"][node], f"l{n}")
+        emit(tree["children_right"][node], f"r{n}")
+
+    emit(0, "rows")
+    return "\n".join(lines)
+
+def generate_source(forest):
+    """
+    Generates a standalone scoring module for a forest: predict(X) returns the
+    majority vote of the trees for every row of the float matrix X, with ties
+    broken like Counter.most_common in process_csv.predict_forest.
+    """
+    n_classes = max(int(np.argmax(values)) for tree in forest for values in tree["values"]) + 1
+    parts = [
+        f"# Generated by forest_compiler.py (version {COMPILER_VERSION}), do not edit.",
+        "import numpy as np",
+        "",
+        f"MODEL_HASH = {model_hash(forest)!r}",
+        f"N_TREES = {len(forest)}",
+        f"N_CLASSES = {n_classes}",
+        "",
+    ]
+    for index, tree in enumerate(forest):
+        parts.append(tree_source(tree, index))
+        parts.append("")
+    parts.append(f"TREES = [{', '.join(f'tree_{index}' for index in range(len(forest)))}]")
+    parts.append('''
+def tree_predictions(X):
+    X = np.asarray(X, dtype=np.float64)
+    votes = np.empty((X.shape[0], N_TREES), dtype=np.int64)
+    rows = np.arange(X.shape[0])
+    for index, tree in enumerate(TREES):
+        tree(X, rows, votes[:, index])
+    return votes
+
+def predict(X):
+    votes = tree_predictions(X)
+    n_rows = votes.shape[0]
+    if n_rows == 0:
+        return np.empty(0, dtype=np.int64)
+    classes = np.arange(N_CLASSES)
+    is_class = votes[:, None, :] == classes[None, :, None]
+    counts = is_class.sum(axis=2)
+    first_vote = np.where(is_class.any(axis=2), is_class.argmax(axis=2), N_TREES)
+    # Highest count first, then earliest first vote.
+    score = counts * (N_TREES + 1) - first_vote
+    return classes[score.argmax(axis=1)]
+''')
+    return "\n".join(parts)
+
+def compile_forest(forest, cache_dir=CACHE_DIR):
+    """
+    Returns the compiled scoring module of a forest, generating it only if
+    the cache has no module for the model hash.
+    If the cache directory is not writable, the module is built in memory.
+    """
+    digest = model_hash(forest)
+    name = f"forest_{digest}"
+    path = os.path.join(cache_dir, name + ".py")
+    if not os.path.exists(path):
+        source = generate_source(forest)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written under a unique temporary name so concurrent loaders never
+            # import a partial file, and concurrent compilers never share one.
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=name, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(source)
+                os.replace(tmp_path, path)
+            except OSError:
+                os.remove(tmp_path)
+                raise
+        except OSError:
+            module = types.ModuleType(name)
+            exec(compile(source, name, "exec"), module.__dict__)
+            return module
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def read_forest(model_file):
+    """
+    Reads forest_model.json, or a joblib scikit-learn tree model. The
+    thresholds of a scikit-learn tree are moved to the largest float64 that
+    passes its test once rounded to float32, since the tree compares its
+    input as float32, so the compiled module can keep float64 inputs.
+    """
+    if not model_file.endswith(".joblib"):
+        with open(model_file, 'r') as f:
+            return json.load(f)
+    import joblib
+    model = joblib.load(model_file)
+    forest = tree_forest(model)
+    return fold_scaler(forest, np.zeros(model.n_features_in_), np.ones(model.n_features_in_), float32=True)
+
+def load_compiled_forest(model_file, cache_dir=CACHE_DIR):
+    """
+    Compiles forest_model.json, or a joblib scikit-learn tree model, into a scoring module.
+    """
+    return compile_forest(read_forest(model_file), cache_dir)
+
+if __name__ == "__main__":
+    # python3 forest_compiler.py <model_file> prints the generated module.
+    if len(sys.argv) != 2:
+        print("Usage: python3 forest_compiler.py <forest_model.json | model.joblib>")
+        sys.exit(1)
+    print(generate_source(read_forest(sys.argv[1])))
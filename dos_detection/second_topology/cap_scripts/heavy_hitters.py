@@ -0,0 +1,280 @@
+import heapq
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from check_malicius_packets import (ALERT_COOLDOWN, ALERT_THRESHOLD, WINDOW_SECONDS, AlertLog, SlidingWindowCounter,
+                                    log_attack)
+
+# Sources tracked by every summary, and summaries (panes) per window: the
+# memory is bounded by CAPACITY * PANES sources, whatever the number of
+# (spoofed) source IPs. Panes expire whole, so the counted window is between
+# WINDOW_SECONDS * (PANES - 1) / PANES and WINDOW_SECONDS long (50 to 60 s).
+CAPACITY = 1000
+PANES = 6
+
+class SpaceSaving:
+    """
+    Space-Saving summary of the heaviest sources of a stream, with at most
+    capacity counters. A new source replaces the source with the smallest
+    count m, and starts from m with an error of m. For every tracked source,
+    count - error <= true count <= count; an untracked source has a true
+    count of at most minimum() <= total / capacity.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Min-heap of (count, source); entries whose count changed are stale.
+        self.heap = []
+        self.total = 0
+
+    def add(self, key, count=1):
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            minimum, victim = self.pop_minimum()
+            del self.counts[victim]
+            del self.errors[victim]
+            self.counts[key] = minimum + count
+            self.errors[key] = minimum
+        heapq.heappush(self.heap, (self.counts[key], key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_minimum(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def minimum(self):
+        # Largest possible count of an untracked source.
+        if len(self.counts) < self.capacity:
+            return 0
+        while self.counts.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0]
+
+    def bounds(self, key):
+        """
+        Returns (lower, upper) bounds of the true count of key.
+        """
+        if key in self.counts:
+            return self.counts[key] - self.errors[key], self.counts[key]
+        return 0, self.minimum()
+
+class HeavyHitterCounter:
+    """
+    Sketch-based replacement of SlidingWindowCounter, with the same interface,
+    for floods from many (possibly spoofed) source IPs. The window is split
+    into panes of window / panes seconds, each counted by a SpaceSaving
+    summary; the panes older than the window are dropped, so the window
+    covers the last panes - 1 to panes panes (50 to 60 seconds by default).
+    Memory is bounded by capacity * panes sources.
+    Counts are bounds: a source is reported only when the lower bound of its
+    count is above the threshold, so spoofed sources never raise false
+    alerts; the upper bound exceeds the true count by at most error_bound(),
+    which is at most the number of packets in the window / capacity.
+    """
+
+    def __init__(self, window=WINDOW_SECONDS, threshold=ALERT_THRESHOLD, capacity=CAPACITY, panes=PANES,
+                 checkpoint_file=None, checkpoint_interval=10, cooldown=ALERT_COOLDOWN, reporter=log_attack):
+        self.window = window
+        self.threshold = threshold
+        self.alert_log = AlertLog(cooldown, reporter)
+        self.capacity = capacity
+        self.pane_count = panes
+        self.pane_seconds = window / panes
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.time()
+        # Pane index -> SpaceSaving.
+        self.panes = {}
+        self.last_pane = None
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            self.load_checkpoint()
+
+    def pane(self, now):
+        return int(now // self.pane_seconds)
+
+    def expire(self, now):
+        pane = self.pane(now)
+        if self.last_pane is None or pane > self.last_pane:
+            self.last_pane = pane
+            for index in [i for i in self.panes if i <= pane - self.pane_count]:
+                del self.panes[index]
+
+    def add(self, source_ip, count=1, now=None):
+        """
+        Adds count malicious packets from source_ip at time now (seconds since the epoch).
+        Returns the lower bound of the malicious packets of source_ip in the window.
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        pane = self.pane(now)
+        if pane > self.last_pane - self.pane_count:
+            if pane not in self.panes:
+                self.panes[pane] = SpaceSaving(self.capacity)
+            self.panes[pane].add(source_ip, count)
+        return self.bounds(source_ip)[0]
+
+    def bounds(self, source_ip, now=None):
+        """
+        Returns (lower, upper) bounds of the malicious packets of source_ip in the window.
+        """
+        if now is not None:
+            self.expire(now)
+        lower = upper = 0
+        for summary in self.panes.values():
+            low, high = summary.bounds(source_ip)
+            lower += low
+            upper += high
+        return lower, upper
+
+    def count(self, source_ip, now=None):
+        """
+        Returns the estimated (upper bound) malicious packets of source_ip in the window.
+        """
+        return self.bounds(source_ip, now)[1]
+
+    def error_bound(self):
+        """
+        Returns the largest possible overestimate of a count in the window.
+        """
+        return sum(summary.minimum() for summary in self.panes.values())
+
+    def total(self):
+        return sum(summary.total for summary in self.panes.values())
+
+    def heavy_hitters(self, k=10):
+        """
+        Returns the k sources with the highest estimated counts, with their (lower, upper) bounds.
+        """
+        candidates = set().union(*(summary.counts for summary in self.panes.values()))
+        bounds = {source_ip: self.bounds(source_ip) for source_ip in candidates}
+        return sorted(bounds.items(), key=lambda item: item[1][1], reverse=True)[:k]
+
+    def add_batch(self, source_ips, now=None):
+        """
+        Same as SlidingWindowCounter.add_batch: returns {source_ip: count} for
+        the reported sources whose count (lower bound) is above the threshold.
+        """
+        now = time.time() if now is None else now
+        counts = source_ips if hasattr(source_ips, "items") else Counter(source_ips)
+        alerts = {}
+        for source_ip, count in counts.items():
+            total = self.add(source_ip, count, now)
+            if total > self.threshold and self.alert_log.report(source_ip, total, now):
+                alerts[source_ip] = total
+        self.maybe_checkpoint(now)
+        return alerts
+
+    def maybe_checkpoint(self, now):
+        if self.checkpoint_file and now - self.last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint()
+            self.last_checkpoint = now
+
+    def save_checkpoint(self):
+        """
+        Writes the summaries to checkpoint_file (atomically, through a rename).
+        """
+        state = {
+            "pane_seconds": self.pane_seconds,
+            "panes": {
+                str(index): [[source_ip, int(count), int(summary.errors[source_ip])]
+                             for source_ip, count in summary.counts.items()]
+                for index, summary in self.panes.items()
+            },
+        }
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_file, 'r') as f:
+            state = json.load(f)
+        # Checkpoints of the exact counter, or with other panes, are not reused.
+        if not isinstance(state, dict) or state.get("pane_seconds") != self.pane_seconds:
+            return
+        for index, entries in state["panes"].items():
+            summary = self.panes[int(index)] = SpaceSaving(self.capacity)
+            for source_ip, count, error in sorted(entries, key=lambda entry: entry[1], reverse=True)[:self.capacity]:
+                summary.counts[source_ip] = count
+                summary.errors[source_ip] = error
+                summary.total += count
+                heapq.heappush(summary.heap, (count, source_ip))
+        self.expire(time.time())
+
+def spoofed_flood(duration=120, attackers=3, attack_rate=200, spoofed_rate=5000, benign=50, false_positives=0.05,
+                  seed=1):
+    """
+    Yields (second, {source_ip: malicious packets}) batches of a flood from
+    attackers real sources plus spoofed_rate packets per second from random
+    spoofed sources, over benign hosts misclassified with probability
+    false_positives every second (below the alert threshold).
+    """
+    rng = random.Random(seed)
+    for second in range(duration):
+        batch = Counter()
+        for a in range(attackers):
+            batch[f"10.0.0.{a + 1}"] += attack_rate
+        for h in range(benign):
+            if rng.random() < false_positives:
+                batch[f"10.1.0.{h}"] += 1
+        for _ in range(spoofed_rate):
+            batch[".".join(str(rng.randrange(256)) for _ in range(4))] += 1
+        yield second, batch
+
+def benchmark(counter_class, batches, **options):
+    """
+    Feeds the batches to a counter. Returns the counter, the alerts per
+    second, the processing time and the peak memory allocated.
+    The alerts are not written to attack_log.txt.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    counter = counter_class(reporter=lambda source_ip, count: None, **options)
+    alerts = {}
+    for second, batch in batches:
+        alerts[second] = counter.add_batch(batch, 1_000_000 + second + 0.5)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return counter, alerts, elapsed, peak
+
+if __name__ == "__main__":
+    # python3 heavy_hitters.py [spoofed packets per second] compares the
+    # sketch with the exact counter on a spoofed-source flood.
+    spoofed_rate = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    batches = list(spoofed_flood(spoofed_rate=spoofed_rate))
+    exact, exact_alerts, exact_time, exact_peak = benchmark(SlidingWindowCounter, batches)
+    sketch, sketch_alerts, sketch_time, sketch_peak = benchmark(HeavyHitterCounter, batches)
+
+    true_alerts = set().union(*(alerts.keys() for alerts in exact_alerts.values()))
+    found_alerts = set().union(*(alerts.keys() for alerts in sketch_alerts.values()))
+    now = 1_000_000 + len(batches) - 0.5
+    errors = [sketch.count(ip) - exact.count(ip, now) for ip in exact.sources]
+    print(f"Spoofed-source flood: {len(batches)} seconds, {spoofed_rate} spoofed packets per second")
+    print(f"Exact counter:  {exact_time:.2f} s, peak memory {exact_peak / 2**20:.1f} MiB, "
+          f"{len(exact.sources)} sources in memory")
+    print(f"Sketch counter: {sketch_time:.2f} s, peak memory {sketch_peak / 2**20:.1f} MiB, "
+          f"{sum(len(s.counts) for s in sketch.panes.values())} counters in memory")
+    print(f"Alerted sources: exact {sorted(true_alerts)}, sketch {sorted(found_alerts)} "
+          f"({len(found_alerts & true_alerts)} true, {len(found_alerts - true_alerts)} false, "
+          f"{len(true_alerts - found_alerts)} missed)")
+    print(f"Packets in the sketch window: {sketch.total()}, error bound {sketch.error_bound()} "
+          f"(window packets / capacity = {sketch.total() / CAPACITY:.0f})")
+    print(f"Overestimate over {len(errors)} sources: max {max(errors)}, mean {sum(errors) / len(errors):.2f}")
+    print("Heavy hitters (lower, upper):", sketch.heavy_hitters(5))
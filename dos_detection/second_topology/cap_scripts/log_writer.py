@@ -0,0 +1,186 @@
+import atexit
+import fcntl
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+# Shared logging of the cap_scripts.
+# log_message/log_error only put the formatted line on a queue: a background
+# thread writes the lines in batches to files that stay open, so the callers
+# never open, write or close files themselves.
+
+LOG_FILE = "logs.txt"
+ERROR_LOG_FILE = "errors_logs.txt"
+# Alerts of check_malicius_packets.py, written whatever the level.
+ATTACK_LOG_FILE = "attack_log.txt"
+
+# Environment variables read when the writer is created (see configure).
+LOG_DIR_ENV = "DOS_DETECTION_LOG_DIR"
+LOG_LEVEL_ENV = "DOS_DETECTION_LOG_LEVEL"
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "ERROR": 40}
+DEFAULT_LEVEL = "INFO"
+
+# By default the logs are written next to main.py, where they used to land
+# when main.py started the scripts from the topology folder.
+DEFAULT_LOG_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 3
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 1000
+
+class LogWriter:
+    """
+    Background writer of the log files.
+    Lines below `level` are dropped by the caller. The others are queued and
+    written by a daemon thread, which drains up to BATCH_SIZE lines at a time
+    and flushes at least every flush_interval seconds.
+    A file is rotated (logs.txt -> logs.txt.1 -> ...) once it exceeds max_bytes,
+    keeping backup_count old files. Every process has its own writer (pool
+    workers included): a file is rotated by one of them, under a lock, and
+    the others reopen it when they see that it was replaced.
+    """
+
+    def __init__(self, log_dir=None, level="INFO", max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 flush_interval=FLUSH_INTERVAL):
+        self.log_dir = os.path.abspath(log_dir or DEFAULT_LOG_DIR)
+        if level.upper() not in LEVELS:
+            print(f"Unknown log level {level!r}, using {DEFAULT_LEVEL}", file=sys.stderr)
+            level = DEFAULT_LEVEL
+        self.level = LEVELS[level.upper()]
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        self.files = {}
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def log(self, script_name, message, level="INFO", file_name=LOG_FILE):
+        # Unknown levels are written, as INFO.
+        if LEVELS.get(level, LEVELS[DEFAULT_LEVEL]) < self.level:
+            return
+        self.write(file_name, f"{datetime.now()} [{script_name}]: {message}\n")
+
+    def write(self, file_name, line):
+        self.queue.put((file_name, line))
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [item]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self.write_batch([entry for entry in batch if entry is not None])
+            if stop:
+                return
+
+    def write_batch(self, batch):
+        lines = {}
+        for file_name, line in batch:
+            lines.setdefault(file_name, []).append(line)
+        for file_name, file_lines in lines.items():
+            try:
+                log_file = self.open_file(file_name)
+                log_file.write("".join(file_lines))
+                log_file.flush()
+                if log_file.tell() > self.max_bytes:
+                    self.rotate(file_name)
+            except Exception as e:
+                print(f"An error occurred while writing {file_name}: {e}", file=sys.stderr)
+
+    def open_file(self, file_name):
+        path = os.path.join(self.log_dir, file_name)
+        log_file = self.files.get(file_name)
+        if log_file is not None and not same_file(path, log_file):
+            # Rotated by another process: the lines go to the new file.
+            self.files.pop(file_name).close()
+            log_file = None
+        if log_file is None:
+            log_file = self.files[file_name] = open(path, 'a')
+        return log_file
+
+    def rotate(self, file_name):
+        self.files.pop(file_name).close()
+        path = os.path.join(self.log_dir, file_name)
+        with open(path, 'a') as log_file:
+            fcntl.flock(log_file, fcntl.LOCK_EX)
+            # Another process may have rotated it while this one waited for the lock.
+            if not same_file(path, log_file) or os.fstat(log_file.fileno()).st_size <= self.max_bytes:
+                return
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{path}.{i}"):
+                    os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+            if self.backup_count > 0:
+                os.replace(path, f"{path}.1")
+            else:
+                os.remove(path)
+
+    def close(self):
+        """
+        Writes the queued lines and stops the thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for log_file in self.files.values():
+            log_file.close()
+        self.files = {}
+
+def same_file(path, log_file):
+    """
+    Returns True if path is still the file open as log_file.
+    """
+    try:
+        return os.stat(path).st_ino == os.fstat(log_file.fileno()).st_ino
+    except OSError:
+        return False
+
+_writer = None
+_lock = threading.Lock()
+
+def configure(log_dir=None, level=None, **options):
+    """
+    (Re)creates the shared writer. Arguments left to None are read from the
+    DOS_DETECTION_LOG_DIR and DOS_DETECTION_LOG_LEVEL environment variables.
+    """
+    global _writer
+    with _lock:
+        if _writer is not None and _writer.pid == os.getpid():
+            _writer.close()
+        _writer = LogWriter(log_dir or os.environ.get(LOG_DIR_ENV),
+                            level or os.environ.get(LOG_LEVEL_ENV, DEFAULT_LEVEL), **options)
+        return _writer
+
+def get_writer():
+    # A forked worker process does not inherit the writer thread, so it gets its own writer.
+    if _writer is None or _writer.pid != os.getpid():
+        return configure()
+    return _writer
+
+def log_message(script_name, message, level="INFO"):
+    get_writer().log(script_name, message, level)
+
+def log_error(script_name, message):
+    get_writer().log(script_name, message, "ERROR", ERROR_LOG_FILE)
+
+def log_attack(message):
+    get_writer().write(ATTACK_LOG_FILE, f"{datetime.now()} - {message}\n")
+
+def shutdown():
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.close()
+
+atexit.register(shutdown)
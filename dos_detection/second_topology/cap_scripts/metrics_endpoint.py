@@ -0,0 +1,161 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tracing import STAGES
+import log_writer
+
+SCRIPT_NAME = "metrics_endpoint.py"
+
+# The endpoint only listens on the cap host itself.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Upper bounds (seconds) of the buckets of the stage latency histograms.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def log_error(message):
+    log_writer.log_error(SCRIPT_NAME, message)
+
+def log_message(message):
+    log_writer.log_message(SCRIPT_NAME, message)
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, as a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+class PipelineStats:
+    """
+    Counters and per-stage latency histograms of the detection service,
+    updated by the stages from their own threads.
+    """
+
+    def __init__(self, stages=STAGES):
+        self.lock = threading.Lock()
+        self.counters = {"pcap_files": 0, "rows_classified": 0, "malicious_rows": 0, "alerts": 0}
+        self.latency = {stage: Histogram() for stage in stages}
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.latency[stage].observe(seconds)
+
+    def render(self):
+        """
+        Returns the counters and histograms in the Prometheus text format.
+        """
+        with self.lock:
+            lines = []
+            for name, value in self.counters.items():
+                lines += [f"# TYPE dos_detection_{name}_total counter", f"dos_detection_{name}_total {value}"]
+            lines.append("# TYPE dos_detection_stage_latency_seconds histogram")
+            for stage, histogram in self.latency.items():
+                for bound, count in histogram.cumulative():
+                    lines.append(f'dos_detection_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines += [
+                    f'dos_detection_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}',
+                    f'dos_detection_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}',
+                    f'dos_detection_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}',
+                ]
+        return lines
+
+def metric(lines, name, kind, value, labels=""):
+    lines += [f"# TYPE dos_detection_{name} {kind}", f"dos_detection_{name}{labels} {value}"]
+
+def render_metrics(stats, queues, spool=None, model_version=None):
+    """
+    Returns the page of the endpoint: the counters and histograms of stats,
+    the queues of DetectionService.metrics(), the spool work queue of
+    ReadyFiles.metrics() and the model version in use.
+    """
+    lines = stats.render()
+    buffer = queues["buffer"]
+    metric(lines, "packets_ingested_total", "counter", buffer["received"])
+    metric(lines, "packets_dropped_total", "counter", buffer["dropped"])
+    metric(lines, "packets_sampled_out_total", "counter", buffer["sampled_out"])
+    metric(lines, "windows_total", "counter", buffer["windows"])
+    metric(lines, "buffer_packets", "gauge", buffer["depth"])
+    metric(lines, "buffer_max_packets", "gauge", buffer["max_depth"])
+    metric(lines, "buffer_capacity_packets", "gauge", buffer["capacity"])
+    metric(lines, "degraded", "gauge", int(buffer["degraded"]))
+    if "extracted" in queues:
+        metric(lines, "extracted_windows", "gauge", queues["extracted"]["depth"])
+        metric(lines, "extracted_windows_capacity", "gauge", queues["extracted"]["capacity"])
+    if "sampling" in queues:
+        metric(lines, "sampling_packets_total", "counter", queues["sampling"]["packets"])
+        metric(lines, "sampling_kept_packets_total", "counter", queues["sampling"]["kept"])
+    if spool is not None:
+        metric(lines, "spool_files_waiting", "gauge", spool["depth"])
+        metric(lines, "spool_files_pending", "gauge", spool["pending"])
+        metric(lines, "spool_max_files_waiting", "gauge", spool["max_depth"])
+        metric(lines, "spool_files_dropped_total", "counter", spool["dropped"])
+    if model_version is not None:
+        metric(lines, "model_info", "gauge", 1, f'{{version="{model_version}"}}')
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = self.server.render().encode()
+        except Exception as e:
+            log_error(f"Could not render the metrics: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not written to the logs.
+        pass
+
+class MetricsEndpoint:
+    """
+    HTTP endpoint serving render() at /metrics, in the Prometheus text
+    format, from a background thread.
+    """
+
+    def __init__(self, render, host=METRICS_HOST, port=METRICS_PORT):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.render = render
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        log_message(f"Metrics available at http://{host}:{port}/metrics")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+from forest_compiler import compile_folded
+import log_writer
+
+SCRIPT_NAME = "model_registry.py"
+
+# Columns of the 14-entry scaler_params.json shipped with the cap_scripts: the
+# scaler was fitted on all the numeric CSV columns, while the model uses
+# process_csv.FEATURES. The entries of the model features are picked by name.
+LEGACY_SCALER_COLUMNS = ["id", "dur", "spkts", "sbytes", "sttl", "swin", "stcpb", "dtcpb",
+                         "rate", "pps", "ttl_ratio", "tcp_diff", "swin_interaction", "label"]
+
+# Seconds between two checks of the model files.
+CHECK_INTERVAL = 2.0
+
+def log_error(message):
+    log_writer.log_error(SCRIPT_NAME, message)
+
+def log_message(message):
+    log_writer.log_message(SCRIPT_NAME, message)
+
+def scaler_arrays(scaler_params, features):
+    """
+    Returns the mean and scale arrays of the StandardScaler parameters, in the
+    order of features. The parameters may list their "columns"; without them
+    they must either match features or the LEGACY_SCALER_COLUMNS.
+    """
+    mean = np.asarray(scaler_params["mean"], dtype=np.float64)
+    scale = np.asarray(scaler_params["scale"], dtype=np.float64)
+    columns = scaler_params.get("columns")
+    if columns is None:
+        if len(mean) == len(features):
+            return mean, scale
+        if len(mean) != len(LEGACY_SCALER_COLUMNS):
+            raise ValueError(f"{len(mean)} scaler parameters for {len(features)} features")
+        columns = LEGACY_SCALER_COLUMNS
+    index = [columns.index(feature) for feature in features]
+    return mean[index], scale[index]
+
+def files_version(files):
+    """
+    Returns a short id of the content of the model files.
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+class ModelVersion:
+    """
+    A loaded model with its prebuilt scaler arrays (None when the model takes
+    raw features) and the id of the files it was loaded from.
+    """
+
+    def __init__(self, version, model, mean=None, scale=None):
+        self.version = version
+        self.model = model
+        self.mean = mean
+        self.scale = scale
+
+    def predict(self, X):
+        if self.mean is not None:
+            X = (X - self.mean) / self.scale
+        return self.model.predict(X)
+
+class ModelRegistry:
+    """
+    Holds the model in memory and swaps it when its files change.
+    load_model(model_file) loads the model; when scaler_params_file is given,
+    load_scaler(scaler_params_file) returns the parameters and the features
+    are standardized before prediction. A background thread checks the files
+    every check_interval seconds and loads a new version on change; the new
+    version replaces the old one in a single assignment, so a batch is always
+    predicted by one complete version, and a version that fails to load is
+    ignored (the previous one stays in use).
+    With fold_scaler, the scaler is folded into the thresholds of the model
+    when it is loaded (see forest_compiler.compile_folded): the raw features
+    are fed to the compiled model, with the same predictions and no scaling
+    pass. load_model must then return a scikit-learn tree or a list of tree
+    structures.
+    """
+
+    def __init__(self, model_file, load_model, features, scaler_params_file=None, load_scaler=None,
+                 check_interval=CHECK_INTERVAL, fold_scaler=False):
+        self.model_file = model_file
+        self.scaler_params_file = scaler_params_file
+        self.load_model = load_model
+        self.load_scaler = load_scaler
+        self.features = features
+        self.check_interval = check_interval
+        self.fold_scaler = fold_scaler
+        self.files = [f for f in (model_file, scaler_params_file) if f]
+        self.stamps = self.file_stamps()
+        self.current = self.load()
+        log_message(f"Loaded model version {self.current.version}")
+        self.thread = None
+
+    def file_stamps(self):
+        return [(os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in self.files]
+
+    def load(self):
+        version = files_version(self.files)
+        model = self.load_model(self.model_file)
+        mean = scale = None
+        if self.scaler_params_file:
+            mean, scale = scaler_arrays(self.load_scaler(self.scaler_params_file), self.features)
+            if self.fold_scaler:
+                model = compile_folded(model, mean, scale)
+                mean = scale = None
+        return ModelVersion(f"{os.path.basename(self.model_file)}@{version}", model, mean, scale)
+
+    def check(self):
+        """
+        Loads a new version if the model files changed since the last check.
+        Returns True when the model was swapped.
+        """
+        try:
+            stamps = self.file_stamps()
+        except OSError:
+            # A file is being replaced, the next check will see the new one.
+            return False
+        if stamps == self.stamps:
+            return False
+        self.stamps = stamps
+        try:
+            version = self.load()
+        except (Exception, SystemExit) as e:
+            log_error(f"Could not load the new model, keeping version {self.current.version}: {e}")
+            return False
+        if version.version == self.current.version:
+            return False
+        previous, self.current = self.current, version
+        log_message(f"Model version {previous.version} replaced by {version.version}")
+        return True
+
+    def watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.watch, name="model-registry", daemon=True)
+        self.thread.start()
+        return self
+
+    def predict(self, X):
+        """
+        Returns (predictions, version id) for the feature matrix X.
+        """
+        current = self.current
+        return current.predict(X), current.version
@@ -1,43 +1,37 @@
 import pandas as pd
-import json
 import sys
 import os
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import Counter
+from forest_compiler import load_compiled_forest, read_forest
+from feature_file import FEATURE_FILE_EXT, read_feature_file
+import log_writer
 
 SCRIPT_NAME = "process_csv.py"
 
-def ensure_log_files_exist():
-    try:
-        if not os.path.exists('logs.txt'):
-            with open('logs.txt', 'w') as log_file:
-                log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: Log file created\n")
-        if not os.path.exists('errors_logs.txt'):
-            with open('errors_logs.txt', 'w') as log_file:
-                log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: Error log file created\n")
-    except Exception as e:
-        print(f"An error occurred while ensuring log files exist: {e}")
-        sys.exit(1)
+# Features used during training.
+# (Adjust the list below if your training used a different set of features.)
+FEATURES = ["id", "dur", "spkts", "sttl", "swin",
+            "stcpb", "dtcpb", "pps", "ttl_ratio", "tcp_diff", "swin_interaction"]
 
 def log_error(message):
-    try:
-        with open('errors_logs.txt', 'a') as log_file:
-            log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
-    except Exception as e:
-        print(f"An error occurred while logging an error: {e}")
+    log_writer.log_error(SCRIPT_NAME, message)
 
 def log_message(message):
-    try:
-        with open('logs.txt', 'a') as log_file:
-            log_file.write(f"{datetime.now()} [{SCRIPT_NAME}]: {message}\n")
-    except Exception as e:
-        print(f"An error occurred while logging a message: {e}")
+    log_writer.log_message(SCRIPT_NAME, message)
 
 def load_csv(csv_file):
+    """
+    Loads the features written by process_pcap.py, either as CSV or as a
+    binary feature file (see feature_file.py).
+    """
     try:
-        data = pd.read_csv(csv_file)
-        log_message(f"Loaded CSV file: {csv_file}")
+        if csv_file.endswith(FEATURE_FILE_EXT):
+            data = read_feature_file(csv_file)
+        else:
+            data = pd.read_csv(csv_file)
+        log_message(f"Loaded features file: {csv_file}")
         return data
     except Exception as e:
         error_message = f"An error occurred while loading the CSV file: {e}"
@@ -47,18 +41,33 @@ def load_csv(csv_file):
 def load_model(model_file):
     """
     Loads the Random Forest JSON model.
-    The JSON is assumed to be a list of tree structures.
+    The JSON is assumed to be a list of tree structures, which is compiled
+    into a vectorized scoring module (see forest_compiler.py). The module is
+    cached on the model hash, so it is only generated again when the model changes.
     """
     try:
-        with open(model_file, 'r') as f:
-            model = json.load(f)
-        log_message(f"Loaded JSON model: {model_file}")
+        model = load_compiled_forest(model_file)
+        log_message(f"Loaded JSON model: {model_file} (compiled as {model.__name__})")
         return model
     except Exception as e:
         error_message = f"An error occurred while loading the JSON model: {e}"
         log_error(error_message)
         sys.exit(1)
 
+def load_forest(model_file):
+    """
+    Loads the Random Forest JSON model as its list of tree structures, for
+    the model registry to fold the scaler into it (see forest_compiler.compile_folded).
+    """
+    try:
+        forest = read_forest(model_file)
+        log_message(f"Loaded JSON model: {model_file}")
+        return forest
+    except Exception as e:
+        error_message = f"An error occurred while loading the JSON model: {e}"
+        log_error(error_message)
+        sys.exit(1)
+
 def predict_tree(tree, X):
     """
     Traverses a single decision tree (from the JSON model) using feature vector X.
@@ -90,17 +99,11 @@ def predict_forest(forest, X):
 def predict(data, model):
     try:
         # Extract the features used during training.
-        # (Adjust the list below if your training used a different set of features.)
-        features = data[["id", "dur", "spkts", "sttl", "swin", 
-                         "stcpb", "dtcpb", "pps", "ttl_ratio", "tcp_diff", "swin_interaction"]]
-        
-        features_array = features.to_numpy()
-        predictions = []
-        for row in features_array:
-            pred = predict_forest(model, row)
-            predictions.append(pred)
+        features = data[FEATURES]
         
-        data['prediction'] = predictions
+        features_array = features.to_numpy(dtype=np.float64, na_value=np.nan)
+        # All rows are evaluated at once, same result as predict_forest row by row.
+        data['prediction'] = model.predict(features_array)
         log_message("Made predictions on the data")
         return data
     except Exception as e:
@@ -133,7 +136,6 @@ def update_malicious_csv(data, output_file):
 
 if __name__ == "__main__":
     print("Starting process_csv.py")
-    ensure_log_files_exist()
     log_message("Processing CSV file...")
     
     if len(sys.argv) != 2:
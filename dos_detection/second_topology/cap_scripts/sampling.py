@@ -0,0 +1,109 @@
+import math
+import random
+import numpy as np
+
+# Sampling of the packets of a window before feature extraction. Every kept
+# packet gets a weight, the number of packets it stands for, so that the
+# malicious counts of the alert threshold are scaled back up.
+
+# Uniform: one packet in SAMPLE_RATE.
+SAMPLE_RATE = 10
+# Reservoir: at most FLOW_SAMPLES packets of every flow in a window.
+FLOW_SAMPLES = 50
+# Adaptive: no sampling while the buffer holds at most TARGET_DEPTH packets,
+# then one in depth / TARGET_DEPTH packets, up to one in MAX_RATE.
+TARGET_DEPTH = 20000
+MAX_RATE = 100
+
+def flow_key(frame):
+    """
+    Returns the (source, destination, protocol, ports) key of an Ethernet/IPv4
+    frame, or None for other frames.
+    """
+    if frame[12:14] != b"\x08\x00" or len(frame) < 34:
+        return None
+    header_length = (frame[14] & 0x0F) * 4
+    proto = frame[23]
+    ports = frame[14 + header_length:18 + header_length] if proto in (6, 17) else b""
+    return frame[26:30], frame[30:34], proto, ports
+
+class UniformSampler:
+    """
+    Keeps every packet with probability 1 / rate, independently, so that
+    periodic traffic cannot line up with the sampling (as it would with one
+    packet every rate packets). Every kept packet has weight rate.
+    """
+
+    def __init__(self, rate=SAMPLE_RATE, seed=None):
+        self.rate = rate
+        self.random = np.random.default_rng(seed)
+
+    def current_rate(self):
+        return self.rate
+
+    def sample(self, frames, timestamps):
+        rate = self.current_rate()
+        if rate == 1:
+            return frames, timestamps, [1] * len(frames)
+        kept = np.flatnonzero(self.random.random(len(frames)) < 1 / rate)
+        return [frames[i] for i in kept], [timestamps[i] for i in kept], [rate] * len(kept)
+
+class AdaptiveSampler(UniformSampler):
+    """
+    Uniform sampling whose rate follows the depth of the window buffer: no
+    sampling while the detection keeps up, more sampling as packets pile up.
+    """
+
+    def __init__(self, buffer, target_depth=TARGET_DEPTH, max_rate=MAX_RATE):
+        super().__init__(1)
+        self.buffer = buffer
+        self.target_depth = target_depth
+        self.max_rate = max_rate
+
+    def current_rate(self):
+        return max(1, min(self.max_rate, math.ceil(len(self.buffer) / self.target_depth)))
+
+class FlowReservoirSampler:
+    """
+    Keeps a uniform random sample (reservoir) of at most size packets of every
+    flow in a window, in their original order. The kept packets of a flow of
+    n packets have weight n / kept, so short flows are kept whole and large
+    floods are reduced to size packets per flow.
+    """
+
+    def __init__(self, size=FLOW_SAMPLES, seed=None):
+        self.size = size
+        self.random = random.Random(seed)
+
+    def sample(self, frames, timestamps):
+        reservoirs = {}
+        seen = {}
+        for index, frame in enumerate(frames):
+            key = flow_key(frame)
+            n = seen[key] = seen.get(key, 0) + 1
+            reservoir = reservoirs.setdefault(key, [])
+            if n <= self.size:
+                reservoir.append(index)
+            else:
+                slot = self.random.randrange(n)
+                if slot < self.size:
+                    reservoir[slot] = index
+        kept = sorted((index, seen[key] / len(reservoir))
+                      for key, reservoir in reservoirs.items() for index in reservoir)
+        return ([frames[index] for index, _ in kept], [timestamps[index] for index, _ in kept],
+                [weight for _, weight in kept])
+
+def make_sampler(spec, buffer=None):
+    """
+    Builds a sampler from "uniform[:rate]", "reservoir[:size]" or "adaptive[:max_rate]".
+    """
+    name, _, value = spec.partition(":")
+    if name not in ("uniform", "reservoir", "adaptive"):
+        raise ValueError(f"Unknown sampling mode: {spec}")
+    if value and int(value) < 1:
+        raise ValueError(f"The sampling parameter must be at least 1: {spec}")
+    if name == "uniform":
+        return UniformSampler(int(value or SAMPLE_RATE))
+    if name == "reservoir":
+        return FlowReservoirSampler(int(value or FLOW_SAMPLES))
+    return AdaptiveSampler(buffer, max_rate=int(value or MAX_RATE))
@@ -0,0 +1,188 @@
+import collections
+import os
+import threading
+import time
+import log_writer
+
+SCRIPT_NAME = "spool.py"
+
+# Captures are written here by main.py instead of /tmp, so that the service
+# only sees its own files.
+SPOOL_DIR = "/var/spool/dos_detection"
+
+# Without close events, a file is complete when its size and modification
+# time did not change for STABLE_CHECKS checks, STABLE_INTERVAL seconds apart.
+STABLE_INTERVAL = 1.0
+STABLE_CHECKS = 3
+
+# Complete files waiting to be processed. Above MAX_FILES the oldest one is
+# deleted, so a detection slower than the capture never fills the disk.
+MAX_FILES = 20
+
+# Processed files remembered, so that a late event (or the startup scan)
+# does not process them again.
+MAX_FINISHED = 1000
+
+def file_identity(path):
+    # Tells a new file apart from an earlier one with the same name, None if it does not exist.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+def log_error(message):
+    log_writer.log_error(SCRIPT_NAME, message)
+
+def log_message(message):
+    log_writer.log_message(SCRIPT_NAME, message)
+
+class ReadyFiles:
+    """
+    Work queue of the complete files of the spool directory.
+    A file is complete when it is renamed to its final name (completed() on
+    the moved event), or when its writer closes it (completed() on the close
+    event). For observers that do not report close events, size_stable
+    makes the files reported by created() complete once their size stops
+    changing. Every file is handed out once by files(), even if several
+    events report it: while it is queued or being processed, and after
+    done() as long as it is the same file (same inode and modification
+    time) or it was deleted.
+    At most max_files complete files wait in the queue: beyond that the
+    oldest waiting file is deleted without being processed (drop-oldest).
+    """
+
+    def __init__(self, size_stable=False, stable_interval=STABLE_INTERVAL, stable_checks=STABLE_CHECKS,
+                 max_files=MAX_FILES, max_finished=MAX_FINISHED):
+        self.size_stable = size_stable
+        self.stable_interval = stable_interval
+        self.stable_checks = stable_checks
+        self.max_files = max_files
+        self.max_finished = max_finished
+        self.waiting = collections.deque()
+        self.available = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.max_depth = 0
+        # Files waiting to be complete: path -> (size, mtime, number of checks without change).
+        self.pending = {}
+        # Files queued or being processed (path -> file_identity()), and when
+        # they were complete (time.monotonic()).
+        self.queued = {}
+        self.completed_at = {}
+        # Processed files, oldest first: path -> file_identity() when it was complete.
+        self.finished = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def created(self, path):
+        if not self.size_stable:
+            return
+        with self.lock:
+            if path not in self.queued:
+                self.pending.setdefault(path, None)
+
+    def completed(self, path):
+        identity = file_identity(path)
+        with self.lock:
+            self.pending.pop(path, None)
+            if path in self.queued:
+                return
+            if path in self.finished:
+                if identity is None or identity == self.finished[path]:
+                    return
+                # A new file with the name of a processed one.
+                del self.finished[path]
+            self.queued[path] = identity
+            self.completed_at[path] = time.monotonic()
+        with self.available:
+            self.waiting.append(path)
+            if len(self.waiting) > self.max_files:
+                self.drop(self.waiting.popleft())
+            self.max_depth = max(self.max_depth, len(self.waiting))
+            self.available.notify()
+
+    def drop(self, path):
+        self.dropped += 1
+        self.done(path)
+        try:
+            os.remove(path)
+        except OSError as e:
+            log_error(f"Could not delete {path}: {e}")
+            return
+        log_message(f"Deleted {path} without processing it, {len(self.waiting)} files are waiting")
+
+    def metrics(self):
+        with self.lock:
+            pending = len(self.pending)
+        with self.available:
+            return {"depth": len(self.waiting), "max_depth": self.max_depth, "dropped": self.dropped,
+                    "pending": pending}
+
+    def completed_time(self, path):
+        with self.lock:
+            return self.completed_at.get(path)
+
+    def done(self, path):
+        with self.lock:
+            if path in self.queued:
+                self.finished[path] = self.queued.pop(path)
+                if len(self.finished) > self.max_finished:
+                    self.finished.popitem(last=False)
+            self.completed_at.pop(path, None)
+
+    def check(self):
+        """
+        Completes the pending files whose size did not change for stable_checks checks.
+        """
+        with self.lock:
+            pending = list(self.pending.items())
+        for path, previous in pending:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted or renamed: a new event reports it under its new name.
+                with self.lock:
+                    self.pending.pop(path, None)
+                continue
+            checks = 0
+            if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                checks = previous[2] + 1
+            if checks >= self.stable_checks:
+                self.completed(path)
+                continue
+            with self.lock:
+                if path in self.pending:
+                    self.pending[path] = (stat.st_size, stat.st_mtime_ns, checks)
+
+    def watch(self):
+        while self.running:
+            time.sleep(self.stable_interval)
+            self.check()
+
+    def start(self):
+        self.running = True
+        if self.size_stable:
+            self.thread = threading.Thread(target=self.watch, name="spool", daemon=True)
+            self.thread.start()
+        return self
+
+    def files(self):
+        """
+        Yields the complete files, in the order they became complete, until close().
+        """
+        while True:
+            with self.available:
+                while not self.waiting and not self.closed:
+                    self.available.wait()
+                if self.closed:
+                    return
+                path = self.waiting.popleft()
+            yield path
+
+    def close(self):
+        self.running = False
+        with self.available:
+            self.closed = True
+            self.available.notify_all()
@@ -0,0 +1,158 @@
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+import log_writer
+
+SCRIPT_NAME = "tracing.py"
+
+# Spans kept in memory for the latency summary, and traces whose origin is kept.
+MAX_SPANS = 100000
+MAX_TRACES = 1000
+
+# Stages of a trace, in pipeline order: capture (from the first packet of a
+# capture to the file being complete, or to the window being cut for the
+# live capture), dispatch (from the file being complete to its processing),
+# read (pcap file into the window buffer), extract, write (features file
+# handoff), predict and alert; capture_to_alert spans a whole trace, from
+# its first packet to an alert.
+STAGES = ("capture", "dispatch", "read", "extract", "write", "predict", "alert", "capture_to_alert")
+
+def log_error(message):
+    log_writer.log_error(SCRIPT_NAME, message)
+
+def log_message(message):
+    log_writer.log_message(SCRIPT_NAME, message)
+
+def wall_to_monotonic(timestamp):
+    """
+    Converts a time in seconds since the epoch (e.g. a packet timestamp) to
+    the time.monotonic() clock of the spans.
+    """
+    return time.monotonic() - (time.time() - timestamp)
+
+def percentiles(durations):
+    ms = np.asarray(durations) * 1000
+    return {"count": len(ms), "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+
+def summarize(spans):
+    """
+    Returns the p50/p95/p99 durations of every stage of spans, in pipeline order.
+    """
+    durations = collections.defaultdict(list)
+    for span in spans:
+        durations[span["stage"]].append(span["end"] - span["start"])
+    order = sorted(durations, key=lambda stage: STAGES.index(stage) if stage in STAGES else len(STAGES))
+    return {stage: percentiles(durations[stage]) for stage in order}
+
+def chrome_trace(spans):
+    """
+    Returns the spans as a Chrome trace (chrome://tracing, Perfetto): one row
+    per stage, every span labelled with its trace id.
+    """
+    events = []
+    for span in spans:
+        args = {key: value for key, value in span.items() if key not in ("stage", "start", "end")}
+        tid = STAGES.index(span["stage"]) if span["stage"] in STAGES else len(STAGES)
+        events.append({"name": span["stage"], "cat": "detection", "ph": "X", "pid": 1, "tid": tid,
+                       "ts": span["start"] * 1e6, "dur": (span["end"] - span["start"]) * 1e6, "args": args})
+    names = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": stage}}
+             for tid, stage in enumerate(STAGES)]
+    return {"traceEvents": names + events, "displayTimeUnit": "ms"}
+
+def read_spans(trace_file):
+    with open(trace_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class Tracer:
+    """
+    Records the stages of every batch of the detection service as spans
+    (trace id, stage, start and end on the time.monotonic() clock, which is
+    shared by the processes of the host). A trace starts when a capture file
+    or a live window enters the pipeline and follows its windows to the
+    alerts. The last MAX_SPANS spans are kept for summary(); with
+    trace_file every span is also appended to it as a JSON line.
+    """
+
+    def __init__(self, trace_file=None, max_spans=MAX_SPANS, max_traces=MAX_TRACES):
+        self.trace_file = trace_file
+        self.spans = collections.deque(maxlen=max_spans)
+        self.max_traces = max_traces
+        # Trace id -> monotonic time of its first packet.
+        self.origins = collections.OrderedDict()
+        self.ids = itertools.count(1)
+        self.prefix = f"{os.getpid():x}-{int(time.time()):x}"
+        self.lock = threading.Lock()
+        self.file = open(trace_file, 'a') if trace_file else None
+
+    def start(self, origin=None):
+        """
+        Returns the id of a new trace whose first packet came at origin (monotonic, default now).
+        """
+        trace_id = f"{self.prefix}-{next(self.ids)}"
+        self.set_origin(trace_id, time.monotonic() if origin is None else origin)
+        return trace_id
+
+    def set_origin(self, trace_id, origin):
+        with self.lock:
+            self.origins[trace_id] = origin
+            while len(self.origins) > self.max_traces:
+                self.origins.popitem(last=False)
+
+    def origin(self, trace_id):
+        with self.lock:
+            return self.origins.get(trace_id)
+
+    def pop_origin(self, trace_id):
+        with self.lock:
+            return self.origins.pop(trace_id, None)
+
+    def span(self, trace_id, stage, start, end, **args):
+        span = {"trace_id": trace_id, "stage": stage, "start": start, "end": end, **args}
+        with self.lock:
+            self.spans.append(span)
+            if self.file is not None:
+                try:
+                    self.file.write(json.dumps(span) + "\n")
+                    self.file.flush()
+                except OSError as e:
+                    log_error(f"Could not write to the trace file {self.trace_file}: {e}")
+        return span
+
+    def summary(self):
+        with self.lock:
+            spans = list(self.spans)
+        return summarize(spans) if spans else {}
+
+    def log_summary(self):
+        for stage, stats in self.summary().items():
+            log_message(f"Latency of {stage}: p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+                        f"p99 {stats['p99_ms']:.1f} ms over {stats['count']} spans")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+if __name__ == "__main__":
+    # python3 tracing.py <trace.jsonl> [chrome_trace.json] prints the latency
+    # summary of a trace file written by cap_main.py --trace, and converts it
+    # to a Chrome trace.
+    if len(sys.argv) < 2:
+        print("Usage: python3 tracing.py <trace.jsonl> [chrome_trace.json]")
+        sys.exit(1)
+    spans = read_spans(sys.argv[1])
+    print(f"{len(spans)} spans, {len({span['trace_id'] for span in spans})} traces")
+    for stage, stats in summarize(spans).items():
+        print(f"{stage:<17} {stats['count']:>7} spans  p50 {stats['p50_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms  "
+              f"p99 {stats['p99_ms']:9.2f} ms  max {stats['max_ms']:9.2f} ms")
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as f:
+            json.dump(chrome_trace(spans), f)
+        print(f"Chrome trace saved as {sys.argv[2]}")
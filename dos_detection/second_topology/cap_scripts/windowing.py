@@ -0,0 +1,199 @@
+import collections
+import threading
+import time
+
+# Default window: whichever comes first of WINDOW_PACKETS packets and
+# WINDOW_DELAY seconds after the first packet of the window was received.
+WINDOW_PACKETS = 10000
+WINDOW_DELAY = 1.0
+
+# Packets held between the sources and the detection.
+BUFFER_CAPACITY = 200000
+
+# What put() does when the buffer is full: wait for the detection to catch up
+# (back-pressure, for sources that can wait such as pcap files), drop the
+# oldest packet (for live captures, which cannot be paused), or sample the
+# packets of every source IP until the buffer is back under half its capacity.
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP = "drop"
+OVERFLOW_SAMPLE = "sample"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP, OVERFLOW_SAMPLE)
+
+# Degraded mode of OVERFLOW_SAMPLE: the first SAMPLE_QUOTA packets of every
+# source IP in a window are kept, then one in SAMPLE_RATE while the buffer is
+# not full. Quiet hosts are not sampled, floods are thinned out while their
+# sources stay visible.
+SAMPLE_QUOTA = 100
+SAMPLE_RATE = 10
+
+def frame_source(frame):
+    # IPv4 source address of an Ethernet frame, None for other frames.
+    if frame[12:14] == b"\x08\x00":
+        return frame[26:30]
+    return None
+
+class WindowBuffer:
+    """
+    Groups the packets of one or more sources into windows by count or time.
+    Sources put (source, timestamp, frame) items from their own threads; the
+    detection takes the windows with windows(). A window never spans two
+    sources, and flush() closes the current window of a source (e.g. at the
+    end of a pcap file) without waiting for the delay.
+    Larger windows mean fewer, larger batches (throughput); a shorter delay
+    means faster alerts (latency).
+    With the OVERFLOW_SAMPLE policy a full buffer enters a degraded mode, in
+    which the packets of every source IP are sampled (see SAMPLE_QUOTA),
+    until the detection brings it back under half its capacity; if the
+    buffer fills up even so, the oldest packets are dropped.
+    """
+
+    def __init__(self, max_packets=WINDOW_PACKETS, max_delay=WINDOW_DELAY, capacity=BUFFER_CAPACITY,
+                 overflow=OVERFLOW_BLOCK, sample_quota=SAMPLE_QUOTA, sample_rate=SAMPLE_RATE):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if max_packets < 1 or max_delay <= 0:
+            raise ValueError(f"A window needs at least one packet and a positive delay, "
+                             f"got {max_packets} packets and {max_delay} s")
+        self.max_packets = max_packets
+        self.max_delay = max_delay
+        self.capacity = capacity
+        self.overflow = overflow
+        self.sample_quota = sample_quota
+        self.sample_rate = sample_rate
+        # (source, timestamp, frame, time.monotonic() when the item was put)
+        self.items = collections.deque()
+        # Absolute index of items[0], and absolute positions where a window must end.
+        self.head = 0
+        self.boundaries = collections.deque()
+        self.changed = threading.Condition()
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+        self.window_count = 0
+        # Degraded mode: packets per source IP since the last window, and counters.
+        self.degraded = False
+        self.source_counts = collections.Counter()
+        self.sampled_out = 0
+        self.degraded_count = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def metrics(self):
+        """
+        Returns the depth of the buffer and its counters.
+        """
+        with self.changed:
+            return {
+                "depth": len(self.items),
+                "max_depth": self.max_depth,
+                "capacity": self.capacity,
+                "received": self.received,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+                "degraded": self.degraded,
+                "degraded_count": self.degraded_count,
+                "windows": self.window_count,
+            }
+
+    def sample(self, frame):
+        # True if the frame is kept by the degraded mode, which starts when the
+        # buffer is full and ends when it is back under half its capacity.
+        if not self.degraded:
+            if len(self.items) < self.capacity:
+                return True
+            self.degraded = True
+            self.degraded_count += 1
+            self.source_counts.clear()
+        elif len(self.items) <= self.capacity // 2:
+            self.degraded = False
+            return True
+        source = frame_source(frame)
+        self.source_counts[source] += 1
+        extra = self.source_counts[source] - self.sample_quota
+        # A full buffer only takes the packets of the sources under their quota.
+        if extra <= 0 or (extra % self.sample_rate == 0 and len(self.items) < self.capacity):
+            return True
+        self.sampled_out += 1
+        return False
+
+    def put(self, source, timestamp, frame):
+        with self.changed:
+            if self.overflow == OVERFLOW_SAMPLE and not self.sample(frame):
+                return
+            while len(self.items) >= self.capacity and not self.closed:
+                if self.overflow != OVERFLOW_BLOCK:
+                    self.items.popleft()
+                    self.head += 1
+                    self.dropped += 1
+                else:
+                    self.changed.wait()
+            if self.closed:
+                return
+            self.items.append((source, timestamp, frame, time.monotonic()))
+            self.received += 1
+            self.max_depth = max(self.max_depth, len(self.items))
+            if len(self.items) == 1 or len(self.items) >= self.max_packets:
+                self.changed.notify_all()
+
+    def flush(self):
+        """
+        Ends the current window at the last packet put so far.
+        """
+        with self.changed:
+            self.boundaries.append(self.head + len(self.items))
+            self.changed.notify_all()
+
+    def close(self):
+        """
+        Stops the buffer: windows() returns once the packets already put are consumed.
+        """
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def window_size(self):
+        # Number of items of the next window if it had to be cut now.
+        while self.boundaries and self.boundaries[0] <= self.head:
+            self.boundaries.popleft()
+        size = min(self.max_packets, len(self.items))
+        if self.boundaries:
+            size = min(size, self.boundaries[0] - self.head)
+        source = self.items[0][0]
+        for i in range(1, size):
+            if self.items[i][0] != source:
+                return i
+        return size
+
+    def complete(self):
+        # True when the next window cannot grow any more.
+        return (self.closed or len(self.items) >= self.max_packets
+                or self.window_size() < len(self.items)
+                or bool(self.boundaries and self.boundaries[0] - self.head == len(self.items)))
+
+    def windows(self):
+        """
+        Yields (source, frames, timestamps) windows until the buffer is closed.
+        """
+        while True:
+            with self.changed:
+                while not self.items and not self.closed:
+                    self.changed.wait()
+                if not self.items:
+                    return
+                # The delay counts from when the first packet of the window was
+                # put, not from when the detection started waiting for it.
+                deadline = self.items[0][3] + self.max_delay
+                while not self.complete():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.changed.wait(remaining)
+                size = self.window_size()
+                items = [self.items.popleft() for _ in range(size)]
+                self.head += size
+                self.window_count += 1
+                self.source_counts.clear()
+                self.changed.notify_all()
+            yield items[0][0], [frame for _, _, frame, _ in items], [ts for _, ts, _, _ in items]
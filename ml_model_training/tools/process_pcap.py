@@ -1,7 +1,25 @@
 import csv
+import glob
+import importlib.util
 import os
-import random
-from scapy.all import rdpcap, TCP, IP
+from scapy.all import rdpcap, TCP, UDP, IP
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..")
+
+def load_flow_aggregator():
+    """
+    Loads flow_aggregator.py of the detection scripts (the same in every
+    topology), so that the model is trained on the same flows as it classifies.
+    """
+    paths = sorted(glob.glob(os.path.join(REPO_DIR, "dos_detection", "*", "cap_scripts", "flow_aggregator.py")))
+    if not paths:
+        raise ImportError("flow_aggregator.py not found under dos_detection/*/cap_scripts")
+    spec = importlib.util.spec_from_file_location("flow_aggregator", paths[0])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+FlowAggregator = load_flow_aggregator().FlowAggregator
 
 def pcap_to_csv(pcap_file, csv_file, exclude_non_tcp=False):
     print(f"Reading pcap file: {pcap_file}")
@@ -115,14 +133,74 @@ def pcap_to_csv(pcap_file, csv_file, exclude_non_tcp=False):
     print(f"Malicious packets (label 1): {malicious_packets}")
     print(f"CSV file saved as {csv_file}")
 
+def pcap_to_flow_csv(pcap_file, csv_file, exclude_non_tcp=False):
+    """
+    Same as pcap_to_csv, but packets are aggregated into flows keyed on the
+    5-tuple and one row per flow is written (see flow_aggregator.py).
+    A flow is labeled malicious if any of its packets is.
+    """
+    print(f"Reading pcap file: {pcap_file}")
+    packets = rdpcap(pcap_file)
+    print(f"Total packets read: {len(packets)}")
+
+    aggregator = FlowAggregator(with_label=True)
+    flows = 0
+
+    with open(csv_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([
+            "id", "source_ip", "dur", "spkts", "sbytes", "sttl", "swin", "stcpb", "dtcpb",
+            "rate", "pps", "bpp", "ttl_ratio", "tcp_diff", "swin_interaction", "label"
+        ])
+
+        for packet in packets:
+            if exclude_non_tcp and not packet.haslayer(TCP):
+                continue
+
+            has_ip = packet.haslayer(IP)
+            has_tcp = packet.haslayer(TCP)
+            if has_tcp:
+                sport, dport = packet[TCP].sport, packet[TCP].dport
+            elif packet.haslayer(UDP):
+                sport, dport = packet[UDP].sport, packet[UDP].dport
+            else:
+                sport, dport = "N/A", "N/A"
+            key = (
+                packet[IP].src if has_ip else "N/A",
+                packet[IP].dst if has_ip else "N/A",
+                sport, dport,
+                packet[IP].proto if has_ip else "N/A",
+            )
+            rows = aggregator.add(
+                key, packet.time, len(packet),
+                sttl=packet[IP].ttl if has_ip else "N/A",
+                swin=packet[TCP].window if has_tcp else "N/A",
+                stcpb=packet[TCP].seq if has_tcp else "N/A",
+                dtcpb=packet[TCP].ack if has_tcp else "N/A",
+                label="1" if has_tcp and packet[TCP].flags & 0x20 else "0",  # URG flag is 0x20
+            )
+            writer.writerows(rows)
+            flows += len(rows)
+
+        rows = aggregator.flush()
+        writer.writerows(rows)
+        flows += len(rows)
+
+    print(f"Total flows written: {flows}")
+    print(f"CSV file saved as {csv_file}")
+
 if __name__ == "__main__":
     pcap_file = input("Enter the name of the pcap file (located in ../data/captures/): ")
     pcap_path = os.path.join("../data/captures/", pcap_file)
 
     exclude_non_tcp = input("Do you want to exclude non-TCP packets? (yes/no): ").strip().lower() == 'yes'
+    aggregate_flows = input("Do you want one row per flow instead of one row per packet? (yes/no): ").strip().lower() == 'yes'
 
-    csv_file = os.path.splitext(pcap_file)[0] + ("_tcp_only.csv" if exclude_non_tcp else ".csv")
+    csv_file = os.path.splitext(pcap_file)[0] + ("_flows" if aggregate_flows else "") + ("_tcp_only.csv" if exclude_non_tcp else ".csv")
     csv_path = os.path.join("../data/csv_files/", csv_file)
 
-    pcap_to_csv(pcap_path, csv_path, exclude_non_tcp)
+    if aggregate_flows:
+        pcap_to_flow_csv(pcap_path, csv_path, exclude_non_tcp)
+    else:
+        pcap_to_csv(pcap_path, csv_path, exclude_non_tcp)
     print(f"CSV file saved as {csv_path}")
\ No newline at end of file